@@ -3,7 +3,7 @@ from assignSession import *
 import reqMgrClient
 from utils import workflowInfo, campaignInfo, siteInfo, userLock, unifiedConfiguration, reqmgr_url, monitor_pub_dir, monitor_dir, global_SI
 from utils import getDatasetEventsPerLumi, getLFNbase, lockInfo, do_html_in_each_module
-from utils import componentInfo, sendEmail, sendLog, getWorkflows, eosRead
+from utils import componentInfo, sendEmail, sendLog, getWorkflows, RequestIndex, eosRead
 #from utils import lockInfo
 from utils import moduleLock
 import optparse
@@ -92,12 +92,8 @@ def assignor(url ,specific = None, talk=True, options=None):
     max_cpuh_block = UC.get('max_cpuh_block')
 
     ##order by priority instead of random
-    cache = sorted(getWorkflows(url, 'assignment-approved', details=True), key = lambda r : r['RequestPriority'])
-    cache = [r['RequestName'] for r in cache]
-    def rank( wfn ):
-        return cache.index( wfn ) if wfn in cache else 0
-
-    wfos = sorted(wfos, key = lambda wfo : rank( wfo.name ),reverse=True)
+    cache = RequestIndex.from_reqmgr(url, 'assignment-approved', fields=['RequestName','RequestPriority'])
+    wfos = sorted(wfos, key = lambda wfo : cache.rank( wfo.name ),reverse=True)
     print "10 first",[wfo.name for wfo in wfos[:10]]
     print "10 last",[wfo.name for wfo in wfos[-10:]]
 
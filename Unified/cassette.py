@@ -0,0 +1 @@
+../cassette.py
\ No newline at end of file
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from assignSession import *
-from utils import getWorkflows, workflowInfo, getDatasetEventsAndLumis, getDatasetEventsPerLumi, siteInfo, campaignInfo, getWorkflowById, forceComplete, getDatasetSize, sendLog, reqmgr_url, dbs_url, dbs_url_writer, display_time, checkMemory, ThreadHandler, wtcInfo
+from utils import getWorkflows, workflowInfo, workflow_registry, getDatasetEventsAndLumis, getDatasetEventsPerLumi, siteInfo, campaignInfo, getWorkflowById, family_cache, forceComplete, getDatasetSize, sendLog, reqmgr_url, dbs_url, dbs_url_writer, display_time, checkMemory, WorkerPool, wtcInfo
 from utils import componentInfo, unifiedConfiguration, userLock, moduleLock, dataCache, unified_url, getDatasetLumisAndFiles, getDatasetRuns, duplicateAnalyzer, invalidateFiles, findParent, do_html_in_each_module, getDatasetFileArray
 import dbs3Client
 dbs3Client.dbs3_url = dbs_url
@@ -250,6 +250,9 @@ def checkor(url, spec=None, options=None):
 
     report_created = 0
 
+    ## the families of all of them, in bulk
+    family_cache.prefetch_requests(url, 'completed', names = set([wfo.name for wfo in wfs]))
+
     checkers = []
     for iwfo,wfo in enumerate(wfs):
         ## do the check other one workflow
@@ -274,25 +277,23 @@ def checkor(url, spec=None, options=None):
             mcm = mcm
             ))
 
-    ## run the threads
-    run_threads = ThreadHandler( threads = checkers,
-                                 n_threads = options.threads,
-                                 sleepy = 10,
-                                 timeout = None,
-                                 verbose = True,
-                                 label = 'checkor'
-                             )
-    run_threads.start()
+    ## run the checks
+    random.shuffle( checkers )
+    run_threads = WorkerPool( n_threads = options.threads,
+                              ramp_up = 1,
+                              verbose = True,
+                              label = 'checkor'
+                          )
+    run_threads.map( lambda c : c.run(), checkers )
 
     ## waiting on all to complete
-    while run_threads.is_alive():
-        time.sleep(5)
+    run_threads.shutdown()
 
-    print len(run_threads.threads),"finished thread to gather information from"
+    print len(checkers),"finished thread to gather information from"
 
     ## then wrap up from the threads
     failed_threads = 0
-    for to in run_threads.threads:
+    for to in checkers:
         if to.failed:
             failed_threads += 1
             continue
@@ -315,7 +316,7 @@ def checkor(url, spec=None, options=None):
         if to.custodials:
             for site,items in to.custodials.items():
                 custodials[site].extend( items )
-    n_wfs = len(run_threads.threads)
+    n_wfs = len(checkers)
     if n_wfs and float(failed_threads/n_wfs) > 0:
         sendLog('checkor','%d/%d threads have failed, better check this out'% (failed_threads, n_wfs), level='critical')
         ## remove once it's all good
@@ -363,9 +364,8 @@ def checkor(url, spec=None, options=None):
 
             
 
-class CheckBuster(threading.Thread):
+class CheckBuster(object):
     def __init__(self, **args):
-        threading.Thread.__init__(self)
         ## a bunch of other things
         for k,v in args.items():
             setattr(self, k, v)
@@ -456,7 +456,7 @@ class CheckBuster(threading.Thread):
         print "memory so far",usage
 
         ## get info
-        wfi = workflowInfo(url, wfo.name)
+        wfi = workflow_registry.get(url, wfo.name)
         wfi.sendLog('checkor',"checking on %s %s"%( wfo.name,wfo.status))
         ## make sure the wm status is up to date.
         # and send things back/forward if necessary.
@@ -582,7 +582,7 @@ class CheckBuster(threading.Thread):
         print campaigns
 
         check_output_text = "Initial outputs:"+",".join(sorted(wfi.request['OutputDatasets'] ))
-        wfi.request['OutputDatasets'] = [ out for out in wfi.request['OutputDatasets'] if not any([out.split('/')[-1] == veto_tier for veto_tier in tiers_with_no_check])]
+        wfi.own_request()['OutputDatasets'] = [ out for out in wfi.request['OutputDatasets'] if not any([out.split('/')[-1] == veto_tier for veto_tier in tiers_with_no_check])]
         check_output_text += "\nWill check on:"+",".join(sorted(wfi.request['OutputDatasets'] ))
         check_output_text += "\ntiers out:"+",".join( sorted(tiers_with_no_check ))
         check_output_text += "\ntiers no custodial:"+",".join( sorted(vetoed_custodial_tier) )
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 from assignSession import *
-from utils import componentInfo, sendEmail, setDatasetStatus, unifiedConfiguration, workflowInfo, siteInfo, sendLog, reqmgr_url, monitor_dir, moduleLock, userLock, global_SI, do_html_in_each_module, getWorkflows, closeoutInfo, batchInfo
-from utils import ThreadHandler
+from utils import componentInfo, sendEmail, setDatasetStatus, unifiedConfiguration, workflowInfo, workflow_registry, siteInfo, sendLog, reqmgr_url, monitor_dir, moduleLock, userLock, global_SI, do_html_in_each_module, getWorkflows, RequestIndex, closeoutInfo, batchInfo
+from utils import WorkerPool
 import threading
 import reqMgrClient
 import json
@@ -79,7 +79,7 @@ def spawn_harvesting(url, wfi , sites_for_DQMHarvest):
             harvesting_schema['TimePerEvent'] = 1
             harvesting_schema['PrepID'] = 'Harvest-'+wfi.request['PrepID']
             if len(wfi.request['RequestString'])>60:
-                wfi.request['RequestString']= wfi.request['RequestString'][:60]
+                wfi.own_request()['RequestString']= wfi.request['RequestString'][:60]
                 print "truncating request string",wfi.request['RequestString']
                 
             harvesting_schema['RequestString'] = 'HARVEST-'+wfi.request['RequestString']
@@ -178,12 +178,8 @@ def closor(url, specific=None, options=None):
 
     if max_per_round: 
         ## order them by priority
-        all_closedout = sorted(getWorkflows(url, 'closed-out', details=True), key = lambda r : r['RequestPriority'])
-        all_closedout = [r['RequestName'] for r in all_closedout]
-        def rank( wfn ):
-            return all_closedout.index( wfn ) if wfn in all_closedout else 0
-
-        wfs = sorted( wfs, key = lambda wfo : rank( wfo.name ),reverse=True)
+        all_closedout = RequestIndex.from_reqmgr(url, 'closed-out', fields=['RequestName','RequestPriority'])
+        wfs = sorted( wfs, key = lambda wfo : all_closedout.rank( wfo.name ),reverse=True)
         wfs = wfs[:max_per_round]
 
     batch_go = {}
@@ -215,25 +211,20 @@ def closor(url, specific=None, options=None):
             ))
 
     
-    run_threads = ThreadHandler( threads = closers,
-                                 n_threads = options.threads,
-                                 sleepy = 10,
-                                 timeout = None,
-                                 verbose = True,
-                                 label = 'closor')
-
-    run_threads.start()
-
+    random.shuffle( closers )
+    run_threads = WorkerPool( n_threads = options.threads,
+                              ramp_up = 1,
+                              verbose = True,
+                              label = 'closor')
+    run_threads.map( lambda c : c.run(), closers )
 
     ## waiting on all to complete
-    while run_threads.is_alive():
-        #print "Waiting on closing threads",time.asctime(time.gmtime())
-        time.sleep(5)
+    run_threads.shutdown()
 
     JC = JIRAClient() if up.status.get('jira',False) else None
-    print len(run_threads.threads),"finished thread to gather information from"
+    print len(closers),"finished thread to gather information from"
     failed_threads = 0
-    for to in run_threads.threads:
+    for to in closers:
         if to.failed:
             failed_threads += 1
             continue
@@ -331,9 +322,8 @@ def closor(url, specific=None, options=None):
 
 
 
-class CloseBuster(threading.Thread):
+class CloseBuster(object):
     def __init__(self, **args):
-        threading.Thread.__init__(self)
         ## a bunch of other things
         for k,v in args.items():
             setattr(self, k, v)
@@ -370,7 +360,7 @@ class CloseBuster(threading.Thread):
         check_fullcopy_to_announce = UC.get('check_fullcopy_to_announce')
 
         ## what is the expected #lumis 
-        self.wfi = workflowInfo(url, wfo.name )
+        self.wfi = workflow_registry.get(url, wfo.name )
         wfi = self.wfi
         wfo.wm_status = wfi.request['RequestStatus']
 
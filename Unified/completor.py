@@ -2,7 +2,7 @@
 from assignSession import *
 import sys
 import reqMgrClient
-from utils import workflowInfo, getWorkflowById, forceComplete, getDatasetEventsAndLumis, componentInfo, monitor_dir, reqmgr_url, unifiedConfiguration, monitor_pub_dir, moduleLock , eosFile, eosRead, wtcInfo
+from utils import workflowInfo, workflow_registry, getWorkflowById, family_cache, forceComplete, getDatasetEventsAndLumis, componentInfo, monitor_dir, reqmgr_url, unifiedConfiguration, monitor_pub_dir, moduleLock , eosFile, eosRead, wtcInfo
 from utils import campaignInfo, siteInfo, sendLog, sendEmail
 from collections import defaultdict
 import json
@@ -40,6 +40,9 @@ def completor(url, specific):
 
     max_per_round = UC.get('max_per_round').get('completor',None)
     if max_per_round and not specific: wfs = wfs[:max_per_round]
+
+    ## the families of all of them, in bulk
+    family_cache.prefetch_requests(url, ['running-open','running-closed','completed'], names = set([wfo.name for wfo in wfs]))
         
 
     all_stuck = set()
@@ -116,7 +119,7 @@ def completor(url, specific):
         print "looking at",wfo.name
 
         ## get all of the same
-        wfi = workflowInfo(url, wfo.name)
+        wfi = workflow_registry.get(url, wfo.name)
         pids = wfi.getPrepIDs()
         skip=False
         campaigns = wfi.getCampaigns()
@@ -198,7 +201,7 @@ def completor(url, specific):
         original = wfi
         if 'OriginalRequestName' in original.request:
             ## go up the clone chain
-            original = workflowInfo(url, original.request['OriginalRequestName'])
+            original = workflow_registry.get(url, original.request['OriginalRequestName'])
         injected_log = filter(lambda change : change["Status"] in ["assignment-approved"],original.request['RequestTransition'])
         if injected_log:
             injected_on = injected_log[-1]['UpdateTime'] / (60.*60.*24.)
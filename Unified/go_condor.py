@@ -1,10 +1,15 @@
 #!/usr/bin/python
 
+import os
 import re
 import sys
 import json
+import time
+import stat
+import fcntl
 import socket
 import urllib
+import StringIO
 import classad
 import hashlib
 import htcondor
@@ -12,6 +17,27 @@ from collections import defaultdict
 
 
 _site_re = re.compile("(T\d)_([A-Z]{2})_([A-Z]{1}[A-Z,a-z,_]+)$")
+
+def nameLookup(names, attribute='target.WMAgent_SubTaskName', exact=False):
+    """
+    Requirements matching the attribute against a set of names, with a lookup in a ClassAd record keyed by
+    the names, which does not depend on the number of names as member() over a list or one route per name do.
+    The record keys are case-insensitive : the lookup is case-insensitive as member(), or exact as =?= by
+    checking the attribute among the names sharing its key.
+    """
+    record = classad.ClassAd()
+    if exact:
+        folded = {}
+        for name in sorted(set(map(str, names))):
+            folded.setdefault(name.lower(), []).append(name)
+        for key, same in sorted(folded.items()):
+            record[same[0]] = same
+        ## a job without the attribute looks up undefined, it must not match
+        return '(isString(%s) && identicalMember(%s, %s[%s]))' % (attribute, attribute, str(record), attribute)
+    for name in sorted(set(map(str, names))):
+        record[name] = True
+    return '(%s[%s] is true)' % (str(record), attribute)
+
 def makeHighPrioAds(config):
     to_be_raised = config.get('highprio',[])
     if to_be_raised:
@@ -19,10 +45,7 @@ def makeHighPrioAds(config):
         anAd["Name"] = str("Raising to highprio group")
         anAd["GridResource"] = "condor localhost localhost"
         anAd["TargetUniverse"] = 5
-        anAd["RaisedTaskNames"] = map(str,to_be_raised)
-        wfs_escaped = anAd.lookup('RaisedTaskNames').__repr__()
-        del anAd["RaisedTaskNames"]
-        exp = '(HasBeenRaisedHighPrio isnt true)  && member(target.WMAgent_RequestName, %s)' % wfs_escaped
+        exp = '(HasBeenRaisedHighPrio isnt true)  && %s' % nameLookup(to_be_raised, attribute='target.WMAgent_RequestName')
         anAd["Requirements"] = classad.ExprTree(str(exp))        
         anAd["set_AccountingGroup"] = "highprio.cmsdataops"
         anAd["set_HasBeenRaisedHighPrio"] = True
@@ -72,16 +95,16 @@ def makeReleaseSiteAds(config):
     
 def makeHoldAds(config):
     """
-    Create a set of rules to hold a task from matching
+    Create a rule to hold tasks from matching
     """
-    for task,where in config.get('hold',{}).items():
-        # task is the task name
-        # where is either an empty list=all sites, or a list of sites (not implemented)
+    ## the tasks are keys, values are where : either an empty list=all sites, or a list of sites (not implemented)
+    held = config.get('hold',{})
+    if held:
         anAd = classad.ClassAd()
-        anAd["Name"] = str("Holding task %s from %s"%(task, where))
+        anAd["Name"] = str("Holding %d tasks"% len(held))
         anAd["GridResource"] = "condor localhost localhost"
         anAd["TargetUniverse"] = 5
-        exp = '(HasBeenSetHeld isnt true)  && (target.WMAgent_SubTaskName =?= %s)' % classad.quote(str(task))
+        exp = '(HasBeenSetHeld isnt true)  && %s' % nameLookup(held, exact=True)
         anAd["Requirements"] = classad.ExprTree(str(exp))
         ## we use the site whitelist to prevent matching
         anAd["copy_DESIRED_Sites"] = "Held_DESIRED_Sites"
@@ -92,13 +115,14 @@ def makeHoldAds(config):
 
 def makeReleaseAds(config):
     """
-    Create a set of rules to release a task to match
+    Create a rule to release tasks to match
     """
-    for task,where in config.get('release',{}).items():
+    released = config.get('release',{})
+    if released:
         anAd = classad.ClassAd()
-        anAd["Name"] = str("Releasing task %s"%(task))
+        anAd["Name"] = str("Releasing %d tasks"% len(released))
         anAd["GridResource"] = "condor localhost localhost"
-        exp = '(HasBeenSetHeld is true) && (target.WMAgent_SubTaskName =?= %s)' % classad.quote(str(task))
+        exp = '(HasBeenSetHeld is true) && %s' % nameLookup(released, exact=True)
         anAd["Requirements"] = classad.ExprTree(str(exp))
         anAd["copy_Held_DESIRED_Sites"] = "DESIRED_Sites"
         anAd["set_HasBeenRouted"] = False
@@ -106,52 +130,51 @@ def makeReleaseAds(config):
         print anAd
 
 def makeReadAds(config):
-    for needs, tasks in config.get('read',{}).items():
+    for needs, tasks in sorted(config.get('read',{}).items()):
         anAd = classad.ClassAd()
         set_read = int(float(needs))
         anAd["Name"] = str("Set read requirement to %s"% set_read)
         anAd["GridResource"] = "condor localhost localhost"
         anAd["TargetUniverse"] = 5
-        anAd["JobRouterTasknames"] = map(str, tasks)
-        task_names_escaped = anAd.lookup('JobRouterTasknames').__repr__()
-        del anAd["JobRouterTasknames"]
-        exp = classad.ExprTree('member(target.WMAgent_SubTaskName, %s) && (EstimatedInputRateKBs =!= %d)' %( task_names_escaped,int(set_read))) ## just set to a different value
+        exp = classad.ExprTree('%s && (EstimatedInputRateKBs =!= %d)' %( nameLookup(tasks),int(set_read))) ## just set to a different value
         anAd["Requirements"] = classad.ExprTree(str(exp))
         anAd["set_HasBeenRouted"] = False
         anAd["set_HasBeenReadTuned"] = True
         anAd["set_EstimatedInputRateKBs"] = int(set_read)
         print anAd
 
-def makeOverflowAds(config):
+def overflowGroups(config):
+    """
+    The overflow ads, one per replacement whitelist and one per set of added sites, in their order, as
+    (group, content, builder) with builder(content) printing the ad of the group from its content only.
+    The contents are lists in a set order, so that they hash the same without sorting.
+    """
     # Mapping from source to a list of destinations.
     # key can be read by site in values
     reversed_mapping = config['reversed_mapping']
 
     overflow_tasks = {}
-    for workflow, tasks in config.get('modifications',{}).items():
-        for taskname,specs in tasks.items():
-            anAd = classad.ClassAd()
-            anAd["GridResource"] = "condor localhost localhost"
-            anAd["TargetUniverse"] = 5
-            exp = '(HasBeenReplaced isnt true)  && (target.WMAgent_SubTaskName =?= %s)' % classad.quote(str(taskname))
-            anAd["Requirements"] = classad.ExprTree(str(exp))
+    replaced_tasks = {}
+    for workflow, tasks in sorted(config.get('modifications',{}).items()):
+        for taskname,specs in sorted(tasks.items()):
             add_whitelist = specs.get("AddWhitelist")
             if "ReplaceSiteWhitelist" in specs:
-                anAd["Name"] = str("Site Replacement for %s"% taskname)
-                anAd["eval_set_DESIRED_Sites"] = str(",".join(specs['ReplaceSiteWhitelist']))
-                anAd['set_Rank'] = classad.ExprTree("stringlistmember(GLIDEIN_CMSSite, ExtDESIRED_Sites)")
-                anAd["set_HasBeenReplaced"] = True
-                anAd["set_HasBeenRouted"] = False
-                print anAd
+                replace_whitelist_key = str(",".join(specs['ReplaceSiteWhitelist']))
+                replaced_tasks.setdefault(replace_whitelist_key, []).append(taskname)
             elif add_whitelist:
                 add_whitelist.sort()
                 add_whitelist_key = ",".join(add_whitelist)
                 tasks = overflow_tasks.setdefault(add_whitelist_key, [])
                 tasks.append(taskname)
 
+    groups = []
+    # One rule per replacement whitelist, for all the tasks getting it.
+    for whitelist_sites, tasks in sorted(replaced_tasks.items()):
+        groups.append( ('replace %s'%whitelist_sites, [whitelist_sites, tasks], makeReplacementAd) )
+
     # Create a source->dests mapping from the provided reverse_mapping.
     source_to_dests = {}
-    for dest, sources in reversed_mapping.items():
+    for dest, sources in sorted(reversed_mapping.items()):
         for source in sources:
             dests = source_to_dests.setdefault(source, set())
             dests.add(dest)
@@ -160,61 +183,72 @@ def makeOverflowAds(config):
     # For each unique set of site whitelists, create a new rule.  Each task
     # should appear on just one of these ads, meaning it should only get routed
     # once.
-    for whitelist_sites, tasks in overflow_tasks.items():
+    for whitelist_sites, tasks in sorted(overflow_tasks.items()):
         ## these are the sites that need to be added in whitelist.
         whitelist_sites_set = set(whitelist_sites.split(","))
 
         # Create an updated source_to_dests, where the dests are filtered
         # on the whitelist.
         source_to_dests = {}
-        for source, dests in tmp_source_to_dests.items():
-            new_dests = [str(i) for i in dests if i in whitelist_sites_set]
+        for source, dests in sorted(tmp_source_to_dests.items()):
+            new_dests = [str(i) for i in sorted(dests) if i in whitelist_sites_set]
             if new_dests:
                 source_to_dests[str(source)] = new_dests
+        groups.append( ('overflow %s'%whitelist_sites, [whitelist_sites, tasks, sorted(source_to_dests.items())], makeAddedSitesAd) )
+    return groups
 
-        anAd = classad.ClassAd()
-        anAd["GridResource"] = "condor localhost localhost"
-        anAd["TargetUniverse"] = 5
-        anAd["Name"] = "Master overflow rule to run at %s in addition" % str(whitelist_sites)
+def makeReplacementAd(group):
+    whitelist_sites, tasks = group
+    anAd = classad.ClassAd()
+    anAd["GridResource"] = "condor localhost localhost"
+    anAd["TargetUniverse"] = 5
+    exp = '(HasBeenReplaced isnt true)  && %s' % nameLookup(tasks, exact=True)
+    anAd["Requirements"] = classad.ExprTree(str(exp))
+    anAd["Name"] = str("Site Replacement to %s"% whitelist_sites)
+    anAd["eval_set_DESIRED_Sites"] = whitelist_sites
+    anAd['set_Rank'] = classad.ExprTree("stringlistmember(GLIDEIN_CMSSite, ExtDESIRED_Sites)")
+    anAd["set_HasBeenReplaced"] = True
+    anAd["set_HasBeenRouted"] = False
+    print anAd
 
-        # ClassAds trick to create a properly-formatted ClassAd list.
-        anAd["OverflowTasknames"] = map(str, tasks)
-        overflow_names_escaped = anAd.lookup('OverflowTasknames').__repr__()
-        del anAd['OverflowTaskNames']
+def makeAddedSitesAd(group):
+    whitelist_sites, tasks, source_to_dests = group
+    anAd = classad.ClassAd()
+    anAd["GridResource"] = "condor localhost localhost"
+    anAd["TargetUniverse"] = 5
+    anAd["Name"] = "Master overflow rule to run at %s in addition" % str(whitelist_sites)
 
-        exp = classad.ExprTree('member(target.WMAgent_SubTaskName, %s) && (HasBeenRouted_Overflow isnt true)' % overflow_names_escaped)
-        anAd["Requirements"] = classad.ExprTree(str(exp))
-        anAd["copy_DESIRED_Sites"] = "Pre_DESIRED_Sites"
-        anAd["eval_set_DESIRED_Sites"] = classad.ExprTree('ifThenElse(siteMapping("", []) isnt error, siteMapping(Pre_DESIRED_Sites, %s), Pre_DESIRED_Sites)' % str(classad.ClassAd(source_to_dests)))
+    exp = classad.ExprTree('%s && (HasBeenRouted_Overflow isnt true)' % nameLookup(tasks))
+    anAd["Requirements"] = classad.ExprTree(str(exp))
+    anAd["copy_DESIRED_Sites"] = "Pre_DESIRED_Sites"
+    anAd["eval_set_DESIRED_Sites"] = classad.ExprTree('ifThenElse(siteMapping("", []) isnt error, siteMapping(Pre_DESIRED_Sites, %s), Pre_DESIRED_Sites)' % str(classad.ClassAd(dict(source_to_dests))))
 
-        # Where possible, prefer to run at a site where the input can be read locally.
-        anAd['set_Rank'] = classad.ExprTree("stringlistmember(GLIDEIN_CMSSite, ExtDESIRED_Sites)")
-        anAd['set_HasBeenRouted'] = False
-        anAd['set_HasBeenRouted_Overflow'] = True
-        print anAd
+    # Where possible, prefer to run at a site where the input can be read locally.
+    anAd['set_Rank'] = classad.ExprTree("stringlistmember(GLIDEIN_CMSSite, ExtDESIRED_Sites)")
+    anAd['set_HasBeenRouted'] = False
+    anAd['set_HasBeenRouted_Overflow'] = True
+    print anAd
+
+def makeOverflowAds(config):
+    for group, content, builder in overflowGroups(config):
+        builder(content)
 
 
 def makeResizeAds(config):
     policies = {}
-    for workflow, info in config.get('resizing', {}).items():
+    for workflow, info in sorted(config.get('resizing', {}).items()):
         minCores = info.get("minCores", 3)
         maxCores = info.get("maxCores", 8)
         memoryPerThread = info.get("memoryPerThread")
         workflows = policies.setdefault((minCores, maxCores, memoryPerThread), set())
         workflows.add(workflow)
-    for policy, workflows in policies.items():
+    for policy, workflows in sorted(policies.items()):
         minCores, maxCores, memoryPerThread = policy
         anAd = classad.ClassAd()
         anAd['GridResource'] = 'condor localhost localhost'
         anAd['TargetUniverse'] = 5
-
-        # Same trick as above to convert the set to a ClassAd list.
-        anAd["OverflowTasknames"] = map(str, workflows)
-        tasks_escaped = anAd.lookup('OverflowTasknames').__repr__()
-        del anAd['OverflowTaskNames']
-
         anAd['Name'] = 'Resize Jobs (%d-%d cores, %d MB/thread)' % (minCores, maxCores, memoryPerThread)
-        anAd['Requirements'] = classad.ExprTree('(target.WMCore_ResizeJob is False) && member(target.WMAgent_SubTaskName, %s)' % tasks_escaped)
+        anAd['Requirements'] = classad.ExprTree('(target.WMCore_ResizeJob is False) && %s' % nameLookup(workflows))
         anAd['set_WMCore_ResizeJob'] = True
         anAd['set_MinCores'] = minCores
         anAd['set_MaxCores'] = maxCores
@@ -267,15 +301,13 @@ def makePrioCorrectionsAds():
 
 def makePerformanceCorrectionsAds(configs):
     m_config = configs.get('memory',{})
-    for memory in m_config:
+    for memory in sorted(m_config):
         wfs = m_config[memory]
         anAd = classad.ClassAd()
         anAd["GridResource"] = "condor localhost localhost"
         anAd["TargetUniverse"] = 5
         anAd["Name"] = str("Set memory requirement to %s"% memory)
-        anAd["MemoryTasknames"] = map(str, wfs)
-        memory_names_escaped = anAd.lookup('MemoryTasknames').__repr__()
-        exp = classad.ExprTree('member(target.WMAgent_SubTaskName, %s) && ((target.HasBeenMemoryTuned =!= true) || (target.OriginalMemory =!= %d))' %( memory_names_escaped, int(memory) )) ## just set to a different value
+        exp = classad.ExprTree('%s && ((target.HasBeenMemoryTuned =!= true) || (target.OriginalMemory =!= %d))' %( nameLookup(wfs), int(memory) )) ## just set to a different value
         anAd["Requirements"] = classad.ExprTree(str(exp))
         anAd['set_HasBeenMemoryTuned'] = True
         anAd['set_HasBeenRouted'] = False
@@ -283,15 +315,13 @@ def makePerformanceCorrectionsAds(configs):
         print anAd
 
     t_config = configs.get('time',{})
-    for timing in t_config:
+    for timing in sorted(t_config):
         wfs = t_config[timing]
         anAd = classad.ClassAd()
         anAd["GridResource"] = "condor localhost localhost"
         anAd["TargetUniverse"] = 5
         anAd["Name"] = str("Set timing requirement to %s"% timing)
-        anAd["TimeTasknames"] = map(str, wfs)
-        time_names_escaped = anAd.lookup('TimeTasknames').__repr__()
-        exp = classad.ExprTree('member(target.WMAgent_SubTaskName, %s) && ((target.HasBeenTimingTuned =!= true) || (target.EstimatedSingleCoreMins <= %d))' %( time_names_escaped, int(timing) ))
+        exp = classad.ExprTree('%s && ((target.HasBeenTimingTuned =!= true) || (target.EstimatedSingleCoreMins <= %d))' %( nameLookup(wfs), int(timing) ))
         anAd["Requirements"] = classad.ExprTree(str(exp))
         anAd['set_HasBeenTimingTuned'] = True
         anAd['set_HasBeenRouted'] = False
@@ -300,15 +330,13 @@ def makePerformanceCorrectionsAds(configs):
         print anAd
 
     s_config = configs.get('slope',{})
-    for slope in s_config:
+    for slope in sorted(s_config):
         wfs = s_config[slope]
         anAd = classad.ClassAd()
         anAd["GridResource"] = "condor localhost localhost"
         anAd["TargetUniverse"] = 5
         anAd["Name"] = str("Set memory per thread requirement to %s"% slope)
-        anAd["TimeTasknames"] = map(str, wfs)
-        time_names_escaped = anAd.lookup('TimeTasknames').__repr__()
-        exp = classad.ExprTree('member(target.WMAgent_SubTaskName, %s) && (target.ExtraMemory =!= %d)' %( time_names_escaped , int(slope))) ## just set to a different value
+        exp = classad.ExprTree('%s && (target.ExtraMemory =!= %d)' %( nameLookup(wfs) , int(slope))) ## just set to a different value
         anAd["Requirements"] = classad.ExprTree(str(exp))
         anAd['set_HasBeenSlopeTuned'] = True 
         anAd['set_HasBeenRouted'] = False
@@ -441,28 +469,263 @@ def makeAdhocAds(config):
 
 
 
+## the builders, in the order of their ads, with the sections of the configuration they read
+_builders = [('overflow', makeOverflowAds, ['modifications', 'reversed_mapping']),
+             ('sort', lambda config : makeSortAds(), []),
+             ('prio', lambda config : makePrioCorrectionsAds(), []),
+             ('performance', makePerformanceCorrectionsAds, ['memory', 'time', 'slope']),
+             ('resize', makeResizeAds, ['resizing']),
+             ('read', makeReadAds, ['read']),
+             ('hold', makeHoldAds, ['hold']),
+             ('release', makeReleaseAds, ['release']),
+             ('hold_site', makeHoldSiteAds, ['hold_site']),
+             ('release_site', makeReleaseSiteAds, ['release_site']),
+             ('highprio', makeHighPrioAds, ['highprio']),
+             ('drain', makeDrainAds, ['speed_drain']),
+             ('adhoc', makeAdhocAds, [])]
+
+## the builders whose ads are made per group, so that a change rebuilds only the ads of the groups it touches
+_builder_groups = {'overflow' : overflowGroups}
+
 def makeAds(config):
-    makeOverflowAds(config)
-    makeSortAds()
-    makePrioCorrectionsAds()
-    makePerformanceCorrectionsAds(config)    
-    makeResizeAds(config)
-    makeReadAds(config)
-    makeHoldAds(config)
-    makeReleaseAds(config)
-    makeHoldSiteAds(config)
-    makeReleaseSiteAds(config)
-    makeHighPrioAds(config)
-    makeDrainAds(config)
-    makeAdhocAds(config)
+    for name, builder, sections in _builders:
+        builder(config)
+
+
+def sectionHash(content):
+    ## as utils.interface_hashes, on the publishing side
+    return hashlib.sha1( json.dumps(content, sort_keys=True) ).hexdigest()
+
+def siblingUrl(url, kind):
+    ## the version and delta documents published next to equalizor.json
+    return url[:-len('.json')]+'.%s.json'%kind if url.endswith('.json') else None
+
+def applyChange(content, change):
+    if change.get('remove'):
+        return None
+    if 'replace' in change:
+        return change['replace']
+    content = dict(content) if isinstance(content, dict) else {}
+    for k in change.get('unset', []):
+        content.pop(k, None)
+    content.update( change.get('set', {}) )
+    return content
+
+def _codeHash():
+    try:
+        return hashlib.sha1( open(os.path.abspath(__file__).replace('.pyc','.py')).read() ).hexdigest()
+    except Exception:
+        return None
+
+
+def defaultCacheDir():
+    ## a directory of condor, the ads read back from it go to the JobRouter as they are
+    spool = htcondor.param.get('SPOOL') or htcondor.param.get('LOCAL_DIR')
+    return os.path.join(spool, 'unified_overflow_cache') if spool else None
+
+
+class configCache(object):
+    """
+    The sections of the last configuration and the ads built from them, kept in a local directory between
+    the invocations of the hook, so that only the changed sections are fetched and only their ads are rebuilt.
+    The directory is refused unless it belongs to the user running the hook and nobody else can write in it,
+    and the invocations that overlap take turns on a lock file, from reading the state to saving it.
+    """
+    def __init__(self, directory, wait=30):
+        self.directory = directory
+        if not os.path.isdir( directory ):
+            os.makedirs( directory, 0o700 )
+        info = os.lstat( directory )
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.geteuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise Exception("%s is not a directory of uid %d only it can write to"%(directory, os.geteuid()))
+        self.lock = open(os.path.join(directory, 'lock'), 'a')
+        start = time.time()
+        while True:
+            try:
+                fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except IOError:
+                if time.time() - start > wait:
+                    self.lock.close()
+                    raise Exception("%s is locked by another invocation"%directory)
+                time.sleep(0.1)
+        self.state = self._load('state.json') or {}
+        self.state.setdefault('version', None)
+        self.state.setdefault('sections', {})
+        self.code = _codeHash()
+        if self.state.get('code') != self.code:
+            ## ads made by another version of the builders
+            self.state['ads'] = {}
+        self.state['code'] = self.code
+        self.contents = {}
+        self.built = []
+        self.groups_built = {}
+
+    def _load(self, fn):
+        try:
+            return json.load(open(os.path.join(self.directory, fn)))
+        except Exception:
+            return None
+
+    def _save(self, fn, content):
+        path = os.path.join(self.directory, fn)
+        tmp = '%s.tmp.%d'%(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write( content )
+        os.rename(tmp, path)
+
+    def section(self, name):
+        if not name in self.contents:
+            self.contents[name] = self._load('section.%s.json'%name) if name in self.state['sections'] else None
+        return self.contents[name]
+
+    def setSection(self, name, content, digest=None):
+        digest = digest if digest else sectionHash( content )
+        if self.state['sections'].get(name) != digest:
+            self._save('section.%s.json'%name, json.dumps( content ))
+            self.state['sections'][name] = digest
+        self.contents[name] = content
+
+    def removeSection(self, name):
+        self.state['sections'].pop(name, None)
+        self.contents.pop(name, None)
+
+    def update(self, url):
+        """
+        brings the sections to the published version : nothing is fetched if the hashes did not change,
+        only the deltas if they lead to the published hashes, and the whole configuration otherwise
+        """
+        try:
+            status = json.load(urllib.urlopen( siblingUrl(url, 'version') ))
+        except Exception:
+            status = None
+        if status:
+            changed = [s for s,h in status['sections'].items() if self.state['sections'].get(s) != h]
+            for s in set(self.state['sections']) - set(status['sections']):
+                self.removeSection( s )
+            if not changed or self._applyDeltas(url, status, changed):
+                self.state['version'] = status['version']
+                return
+        config = json.load(urllib.urlopen( url ))
+        ## the published hashes of that same version spare computing them
+        digests = status['sections'] if status and status['version'] == config.get('version') else {}
+        for s in set(self.state['sections']) - set(config):
+            self.removeSection( s )
+        for s, content in config.items():
+            if s in ['version','hash']: continue
+            self.setSection(s, content, digests.get(s))
+        self.state['version'] = config.get('version')
+
+    def _applyDeltas(self, url, status, changed):
+        if self.state['version'] is None:
+            return False
+        try:
+            deltas = json.load(urllib.urlopen( siblingUrl(url, 'delta') ))['deltas']
+        except Exception:
+            return False
+        chain = [d for d in deltas if self.state['version'] < d['version'] <= status['version']]
+        if not chain or chain[0]['from_version'] != self.state['version'] or chain[-1]['version'] != status['version']:
+            return False
+        if any([b['from_version'] != a['version'] for a,b in zip(chain, chain[1:])]):
+            return False
+        updated = {}
+        for s in changed:
+            ## each change applies to the content with the hash it was made from
+            content = self.section( s )
+            digest = self.state['sections'].get(s)
+            for d in chain:
+                if s in d['sections']:
+                    change = d['sections'][s]
+                    if change['from'] != digest:
+                        return False
+                    content = applyChange(content, change)
+                    digest = change['to']
+            if digest != status['sections'][s]:
+                return False
+            updated[s] = content
+        for s, content in updated.items():
+            self.setSection(s, content, status['sections'][s])
+        return True
+
+    def ads(self):
+        """
+        the text of all ads, re-using those of the builders whose sections did not change
+        """
+        texts = []
+        for name, builder, sections in _builders:
+            key = sectionHash( [self.state['sections'].get(s) for s in sections] )
+            text = None
+            if self.state['ads'].get(name) == key:
+                try:
+                    text = open(os.path.join(self.directory, 'ads.%s.txt'%name)).read()
+                except Exception:
+                    text = None
+            if text is None:
+                config = dict([(s, self.section(s)) for s in sections if s in self.state['sections']])
+                if name in _builder_groups:
+                    text = self._groupAds(name, _builder_groups[name], config)
+                else:
+                    text = self._printed(builder, config)
+                self._save('ads.%s.txt'%name, text)
+                self.state['ads'][name] = key
+                self.built.append( name )
+            texts.append( text )
+        self._save('state.json', json.dumps( self.state ))
+        return ''.join( texts )
+
+    def _printed(self, builder, content):
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            builder( content )
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def _groupAds(self, name, groups, config):
+        """
+        the ads of a builder made per group, the ad of a group being rebuilt only when its content changed
+        """
+        previous = self._load('groups.%s.json'%name) or {}
+        texts = {}
+        order = []
+        for group, content, builder in groups(config):
+            ## ads made by another version of the builders are not re-used either
+            digest = hashlib.sha1( json.dumps([self.code, group, content]) ).hexdigest()
+            if not digest in texts:
+                texts[digest] = previous[digest] if digest in previous else self._printed(builder, content)
+            order.append( digest )
+        self.groups_built[name] = (len([d for d in texts if not d in previous]), len(order))
+        self._save('groups.%s.json'%name, json.dumps( texts ))
+        return ''.join([texts[d] for d in order])
+
+    def close(self):
+        ## the next invocation can go
+        self.lock.close()
 
 if __name__ == "__main__":
 
     if 'UNIFIED_OVERFLOW_CONFIG' not in htcondor.param:
         sys.exit(0)
 
+    url = htcondor.param['UNIFIED_OVERFLOW_CONFIG']
+    ads = None
+    try:
+        cache = configCache( htcondor.param.get('UNIFIED_OVERFLOW_CACHE', defaultCacheDir()) )
+        try:
+            cache.update( url )
+            ads = cache.ads()
+        finally:
+            cache.close()
+    except:
+        ## no usable local cache : everything from scratch, as it goes
+        ads = None
+    if ads is not None:
+        sys.stdout.write( ads )
+        sys.exit(0)
+
     try:
-        config = json.load(urllib.urlopen(htcondor.param['UNIFIED_OVERFLOW_CONFIG']))
+        config = json.load(urllib.urlopen(url))
         makeAds(config)
     except:
         ### well that's too bad
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 from assignSession import *
 import time
-from utils import getWorkLoad, campaignInfo, siteInfo, getWorkflows, unifiedConfiguration, getPrepIDs, componentInfo, getAllAgents, sendLog, moduleLock, dataCache, agentInfo, display_time, eosFile, eosRead, StartStopInfo, remainingDatasetInfo
+from utils import getWorkLoad, campaignInfo, siteInfo, getWorkflows, RequestIndex, unifiedConfiguration, getPrepIDs, componentInfo, getAllAgents, sendLog, moduleLock, dataCache, agentInfo, display_time, eosFile, eosRead, StartStopInfo, remainingDatasetInfo
 import os
 import json
 from collections import defaultdict
@@ -25,12 +25,12 @@ def htmlor( caller = ""):
         boost = json.loads(eosRead('%s/equalizor.json'%monitor_pub_dir))['modifications']
     except:
         boost = {}
-    #cache = getWorkflows(reqmgr_url,'assignment-approved', details=True)
-    cache = []
+    #cache = RequestIndex.from_reqmgr(reqmgr_url,'assignment-approved')
+    cache = RequestIndex()
     def getWL( wfn ):
-        cached = filter(lambda d : d['RequestName']==wfn, cache)
+        cached = cache.get( wfn )
         if cached:
-            wl = cached[0]
+            wl = cached
         else:
             wl = getWorkLoad(reqmgr_url,wfn)
         return wl
@@ -101,9 +101,9 @@ def htmlor( caller = ""):
                                  ])
 
         if p:
-            cached = filter(lambda d : d['RequestName']==wfn, cache)
+            cached = cache.get( wfn )
             if cached:
-                wl = cached[0]
+                wl = cached
             else:
                 wl = getWorkLoad('cmsweb.cern.ch',wfn)
             text+=', (%s)'%(wl['RequestPriority'])
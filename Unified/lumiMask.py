@@ -0,0 +1 @@
+../lumiMask.py
\ No newline at end of file
@@ -2,6 +2,7 @@ import json
 import time
 from utils import getWorkflowById, workflowInfo, getDatasetLumis, DbsApi, getWorkflowByOutput, monitor_dir
 from collections import defaultdict
+from lumiMask import LumiMask
 import pickle
 import sys
 
@@ -24,10 +25,10 @@ if not wfs:
 
 in_dataset = None
 input_json = defaultdict(list)
-input_rl = []
+input_rl = LumiMask()
 output_json = {}
-output_rl = defaultdict(list)
-missing_rl = defaultdict(list)
+output_rl = defaultdict(LumiMask)
+missing_rl = defaultdict(LumiMask)
 errors_by_lb = defaultdict(lambda : defaultdict(set))
 dbsapi = DbsApi(url='https://cmsweb.cern.ch/dbs/prod/global/DBSReader')
 ecode_ban = []#99999,139,134,92]
@@ -60,7 +61,7 @@ for wf in wfs:
         print "runs",",".join(map(str,runs)),"were processed"
         input_json = getDatasetLumis( in_dataset, runs=runs, with_cache=True)
         #print len(input_json)
-        for r in input_json: input_rl.extend([(int(r),l) for l in input_json[r]])
+        input_rl = LumiMask.from_lumis( input_json )
         #print in_dataset,len(input_rl),"lumis processed",sorted( input_rl, key = lambda i:i[1])[-10:]
 
     ## collect the actual content of the output
@@ -68,13 +69,12 @@ for wf in wfs:
         if not out in output_json:
             #print out, (not fetch)
             output_json[out] = getDatasetLumis( out, with_cache=(not fetch))
-            for r in output_json[out]:
-                output_rl[out].extend([(int(r),l) for l in output_json[out][r]])
+            output_rl[out] = LumiMask.from_lumis( output_json[out] )
             #print out, len(output_rl[out]),sorted(output_rl[out], key = lambda i:i[1] )[-10:]
 
     ## make a diff ?
     for out in wf['OutputDatasets']:
-        missing_rl[out] = list(set(input_rl) - set(output_rl[out]))
+        missing_rl[out] = input_rl - output_rl[out]
         if missing_rl[out]:
             print out,"is missing",len( missing_rl[out]),"lumisections"
             #print json.dumps( missing_rl[out], indent=2)
@@ -134,7 +134,7 @@ for wf in wfs:
                     #if ecode != '134': continue
                     #print "\t\t",ecode
                     if int(ecode) in ecode_ban: continue
-                    eruns = []
+                    eruns = LumiMask()
                     details = ""
                     types = ""
                     for d in errors[task][etype][ecode]['errors']:
@@ -150,20 +150,19 @@ for wf in wfs:
                             if type(l) == list:
                                 #print l
                                 #print list(range(l[0],l[1]+1))
-                                ils.extend( range(l[0],l[1]+1) )
+                                eruns |= LumiMask({run : [l]})
                             else:
                                 ils.append( l ) 
-                        eruns.extend( [(int(run),l) for l in ils] )
+                        eruns.add( run, ils )
                     #print "in error",len(eruns)
 
 
                     #print "JRJR",eruns
                     #print "JRJR",set(eruns)
-                    seruns = set(eruns)
-                    affected = filter(lambda t: t[1], [(out,set(missing_rl[out])&seruns) for out in affected_outputs])
+                    affected = filter(lambda t: t[1], [(out,missing_rl[out]&eruns) for out in affected_outputs])
                     #print "affected",affected
                     for ds,affected_ls in affected:
-                        for ls in affected_ls:
+                        for ls in affected_ls.lumis():
                             errors_by_lb[ds][ls].add( (date, str(task),str(etype),int(ecode),str(details),str(types)) )
     else:
         print "no errors for",wf['RequestName']
@@ -177,7 +176,7 @@ for wf in wfs:
 missing_rl_with_exp = {}
 for out in missing_rl:
     missing_rl_with_exp[out] = {}    
-    for ls in missing_rl[out]:
+    for ls in missing_rl[out].lumis():
         missing_rl_with_exp[out][':'.join(map(str,ls))] = None
 
 
@@ -3,7 +3,7 @@ from assignSession import *
 import os
 import json
 #import numpy as np
-from utils import siteInfo, getWorkflowByInput, getWorkflowByOutput, getWorkflowByMCPileup, monitor_dir, monitor_pub_dir, eosRead, eosFile, remainingDatasetInfo, moduleLock, allCompleteToAnaOps, getDatasetStatus, setDatasetStatus, unifiedConfiguration, ThreadHandler
+from utils import siteInfo, getWorkflowByInput, getWorkflowByOutput, getWorkflowByMCPileup, monitor_dir, monitor_pub_dir, eosRead, eosFile, remainingDatasetInfo, moduleLock, allCompleteToAnaOps, getDatasetStatus, setDatasetStatus, unifiedConfiguration, ThreadHandler, WorkerPool
 import sys
 import time
 import random 
@@ -12,10 +12,8 @@ import threading
 import optparse
 import copy
 
-class DatasetCheckBuster(threading.Thread):
+class DatasetCheckBuster(object):
     def __init__(self, **args):
-        threading.Thread.__init__(self)
-        self.daemon = True
         for k,v in args.items():
             setattr(self,k,v)
 
@@ -100,19 +98,14 @@ class SiteBuster(threading.Thread):
                                                    url = url))
 
         
-        run_threads = ThreadHandler( threads = ds_threads,
-                                     label = '%s Dataset Threads'%site,
-                                     n_threads = 10 ,
-                                     start_wait = 0,
-                                     timeout = None,
-                                     verbose=True)
+        run_threads = WorkerPool( label = '%s Dataset Threads'%site,
+                                  n_threads = 10 ,
+                                  verbose=True)
         ## start and sync
-        run_threads.run()
-        #run_threads.start()
-        #while run_threads.is_alive():
-        #    time.sleep(10)        
+        run_threads.map( lambda t : t.run(), ds_threads )
+        run_threads.shutdown()
 
-        for t in run_threads.threads:
+        for t in ds_threads:
             remainings[t.dataset]["reasons"].extend( t.reasons )
             remainings[t.dataset]["reasons"].sort()
             print t.dataset,remainings[t.dataset]["reasons"]
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-from utils import workflowInfo, siteInfo, monitor_dir, monitor_pub_dir, base_dir, global_SI, unifiedConfiguration, getDatasetEventsPerLumi, dataCache, unified_url, base_eos_dir, monitor_eos_dir, unified_url_eos, eosFile, ThreadHandler, moduleLock, reportInfo
+from utils import workflowInfo, workflow_registry, siteInfo, monitor_dir, monitor_pub_dir, base_dir, global_SI, unifiedConfiguration, getDatasetEventsPerLumi, dataCache, unified_url, base_eos_dir, monitor_eos_dir, unified_url_eos, eosFile, ThreadHandler, WorkerPool, moduleLock, reportInfo
 import time
 
 import json
@@ -12,10 +12,8 @@ import optparse
 import random
 import threading
 
-class ParseBuster(threading.Thread):
+class ParseBuster(object):
     def __init__(self, **args):
-        threading.Thread.__init__(self)
-        self.daemon = True
         self.url = args.get('url')
         self.wfn = args.get('wfn')
         self.options = args.get('options')
@@ -220,7 +218,7 @@ def parse_one(url, wfn, options=None):
     SI = global_SI()
     UC = unifiedConfiguration()
     RI = reportInfo()
-    wfi = workflowInfo( url , wfn)
+    wfi = workflow_registry.get( url , wfn)
     time_point("wfi" ,sub_lap=True)
     where_to_run, missing_to_run,missing_to_run_at = wfi.getRecoveryInfo()       
     time_point("acdcinfo" ,sub_lap=True)
@@ -228,11 +226,11 @@ def parse_one(url, wfn, options=None):
     time_point("inputs" ,sub_lap=True)
 
 
-    ancestor = workflowInfo( url , wfn)
+    ancestor = wfi
     lhe,prim,_,sec = ancestor.getIO()
     high_order_acdc = 0
     while ancestor.request['RequestType'] == 'Resubmission':
-        ancestor = workflowInfo(url, ancestor.request['OriginalRequestName'])
+        ancestor = workflow_registry.get(url, ancestor.request['OriginalRequestName'])
         lhe,prim,_,sec = ancestor.getIO()
         high_order_acdc += 1
 
@@ -1012,15 +1010,13 @@ def parse_those(url, options=None, those=[]):
 
 
     #threads = thread[:5]
-    run_threads = ThreadHandler( threads = threads, n_threads = options.threads,# if options else 5,
-                                 sleepy = 10,
-                                 timeout = None,
-                                 verbose = True )
+    run_threads = WorkerPool( n_threads = options.threads,# if options else 5,
+                              verbose = True,
+                              label = 'showError')
 
     print "running all workers"
-    run_threads.start()
-    while run_threads.is_alive():
-        time.sleep(10)
+    run_threads.map( lambda w : w.run(), threads )
+    run_threads.shutdown()
 
     print "all threads completed"
     for worker in threads:
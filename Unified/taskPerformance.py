@@ -0,0 +1 @@
+../taskPerformance.py
\ No newline at end of file
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+    Content-addressed, compressed on-disk cache of the large per-workflow artifacts
+    (workload spec, wmstats, job details, large cacheInfo documents).
+    An entry is addressed by its kind, its name and the revision of the document it holds,
+    written atomically (temporary file and rename) so that concurrent threads and hosts sharing
+    the directory never see a partial entry, and the least recently used entries are removed
+    once the directory goes over its size budget.
+"""
+
+import hashlib
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+## codec byte and creation time ahead of the compressed payload
+_HEADER = struct.Struct('!cd')
+
+
+class artifactCache(object):
+    def __init__(self, root, budget_mb=2048, codec=None):
+        self.root = root
+        self.budget = budget_mb * 1024 * 1024
+        self.codec = codec if codec else ('L' if lz4 else 'Z')
+        self.lock = threading.Lock()
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, kind, name, revision=None):
+        digest = hashlib.sha1( json.dumps([kind, name, revision]) ).hexdigest()
+        return os.path.join(self.root, 'artifacts', digest[:2], '%s.%s'%(digest, kind))
+
+    def _compress(self, blob):
+        if self.codec == 'L':
+            return lz4.compress( blob )
+        return zlib.compress( blob )
+
+    def _decompress(self, codec, blob):
+        if codec == 'L':
+            return lz4.decompress( blob )
+        return zlib.decompress( blob )
+
+    def get(self, kind, name, revision=None, max_age=None):
+        """
+        the content, or None if absent, older than max_age seconds or unreadable
+        """
+        fn = self.path(kind, name, revision)
+        try:
+            content = open(fn, 'rb').read()
+            codec, created = _HEADER.unpack( content[:_HEADER.size] )
+            if max_age is not None and (time.time() - created) > max_age:
+                self.misses += 1
+                return None
+            blob = self._decompress(codec, content[_HEADER.size:])
+        except Exception:
+            ## absent, evicted meanwhile, or not decodable
+            self.misses += 1
+            return None
+        try:
+            ## recently used, for the eviction
+            os.utime(fn, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return blob
+
+    def put(self, kind, name, blob, revision=None):
+        fn = self.path(kind, name, revision)
+        content = _HEADER.pack(self.codec, time.time()) + self._compress( blob )
+        d = os.path.dirname( fn )
+        if not os.path.isdir( d ):
+            try:
+                os.makedirs( d )
+            except OSError:
+                ## created by someone else meanwhile
+                pass
+        tmp = '%s.tmp.%d.%d.%d'%(fn, os.getpid(), threading.current_thread().ident, random.randint(0, 1<<30))
+        with open(tmp, 'wb') as f:
+            f.write( content )
+        os.rename(tmp, fn)
+        with self.lock:
+            if self.size is not None:
+                self.size += len(content)
+            over = self.size is None or self.size > self.budget
+        if over:
+            self.evict()
+
+    def get_json(self, kind, name, revision=None, max_age=None):
+        blob = self.get(kind, name, revision, max_age)
+        return json.loads( blob ) if blob is not None else None
+
+    def put_json(self, kind, name, data, revision=None):
+        self.put(kind, name, json.dumps( data ), revision)
+
+    def read_through(self, kind, name, fetch, revision=None, max_age=None):
+        """
+        the cached json content, or the one returned by fetch() which gets cached
+        """
+        data = self.get_json(kind, name, revision, max_age)
+        if data is None:
+            data = fetch()
+            self.put_json(kind, name, data, revision)
+        return data
+
+    def _entries(self):
+        entries = []
+        for d, _, files in os.walk( os.path.join(self.root, 'artifacts') ):
+            for f in files:
+                fn = os.path.join(d, f)
+                try:
+                    st = os.stat( fn )
+                except OSError:
+                    continue
+                if '.tmp.' in f and (time.time() - st.st_mtime) < 3600:
+                    ## being written
+                    continue
+                entries.append( (st.st_mtime, st.st_size, fn) )
+        return entries
+
+    def evict(self, fraction=0.9):
+        """
+        removes the least recently used entries, down to fraction of the budget
+        """
+        with self.lock:
+            entries = sorted( self._entries() )
+            size = sum([s for (_, s, _) in entries])
+            target = self.budget * fraction if size > self.budget else size
+            for (_, s, fn) in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove( fn )
+                except OSError:
+                    pass
+                size -= s
+            self.size = size
+            return size
@@ -0,0 +1 @@
+../artifactCache.py
\ No newline at end of file
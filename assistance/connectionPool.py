@@ -0,0 +1 @@
+../connectionPool.py
\ No newline at end of file
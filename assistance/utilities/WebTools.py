@@ -7,7 +7,7 @@ Description: Class which contains helper functions for web interaction
 """
 import json
 import os
-import httplib
+from connectionPool import x509_pool
 from UnifiedConfiguration import UnifiedConfiguration
 
 # Get necessary parameters
@@ -18,7 +18,7 @@ def getX509Conn(url=reqmgr_url,max_try=5):
     tries = 0
     while tries<max_try:
         try:
-            conn = httplib.HTTPSConnection(url, cert_file = os.getenv('X509_USER_PROXY'), key_file = os.getenv('X509_USER_PROXY'))
+            conn = x509_pool.connection(url)
             return conn
         except:
             tries+=1
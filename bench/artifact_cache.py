@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+    Size on disk and read time of synthetic wmstats documents in artifactCache.artifactCache, against the
+    former uncompressed json files, in a temporary directory.
+    Checks the read-through and max_age, that the least recently used entries are evicted first and the
+    directory kept within its budget, and that --threads threads in each of --processes processes writing
+    and reading the same entries never read a partial one. Exits with an error otherwise :
+      python bench/artifact_cache.py --documents 200 --threads 4 --processes 4
+"""
+import hashlib
+import json
+import multiprocessing
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from artifactCache import artifactCache
+from benchUtils import check
+
+
+def document(i, n_agents=20):
+    ## a wmstats request document, with its AgentJobInfo per agent and task
+    name = 'pdmvserv_task_B2G-RunIISummer20UL18wmLHEGEN-%05d__v1_T_201017_000000_%04d'%(i, i)
+    return {'RequestName' : name, 'RequestStatus' : 'running-closed',
+            'AgentJobInfo' : dict([('vocms0%d.cern.ch'%(250+a),
+                                    {'tasks' : dict([('/%s/Task%d'%(name, t),
+                                                      {'status' : {'success' : 100*t+a, 'failure' : {'exception' : a}},
+                                                       'sites' : {'T2_CH_CERN' : {'success' : t}, 'T1_US_FNAL' : {'success' : a}}})
+                                                     for t in range(10)])})
+                                   for a in range(n_agents)])}
+
+
+def directory_size(root):
+    return sum([os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files])
+
+
+def compare(base, n_documents):
+    docs = [document(i) for i in range(n_documents)]
+    former = os.path.join(base, 'former')
+    os.makedirs( former )
+    for doc in docs:
+        open(os.path.join(former, '%s.wmstats.json'%doc['RequestName']), 'w').write( json.dumps( doc ))
+    cache = artifactCache(os.path.join(base, 'current'))
+    for doc in docs:
+        cache.put_json('wmstats', doc['RequestName'], doc)
+    start = time.time()
+    for doc in docs:
+        json.loads( open(os.path.join(former, '%s.wmstats.json'%doc['RequestName'])).read() )
+    former_read = time.time() - start
+    start = time.time()
+    for doc in docs:
+        cache.get_json('wmstats', doc['RequestName'])
+    current_read = time.time() - start
+    print "former  %4d documents %8.1f [kB] on disk, read in %6.3f [s]"%(n_documents, directory_size(former) / 1024., former_read)
+    print "current %4d documents %8.1f [kB] on disk, read in %6.3f [s], codec %s"%(n_documents, directory_size(cache.root) / 1024., current_read, cache.codec)
+
+
+def read_through(base):
+    cache = artifactCache(os.path.join(base, 'read_through'))
+    calls = []
+    fetch = lambda : calls.append(1) or {'value' : len(calls)}
+    first = cache.read_through('spec', 'wf', fetch, revision='1-abc')
+    again = cache.read_through('spec', 'wf', fetch, revision='1-abc')
+    failed = check("read-through fetches once", first == again == {'value' : 1} and len(calls) == 1)
+    changed = cache.read_through('spec', 'wf', fetch, revision='2-def')
+    failed |= check("new revision fetched", changed == {'value' : 2} and cache.get_json('spec', 'wf', revision='1-abc') == {'value' : 1})
+    time.sleep(1.1)
+    failed |= check("older than max_age fetched again", cache.read_through('spec', 'wf', fetch, revision='2-def', max_age=1) == {'value' : 3})
+    return failed
+
+
+def eviction(base):
+    blob = os.urandom(100*1024)
+    cache = artifactCache(os.path.join(base, 'eviction'), budget_mb=1, codec='Z')
+    for i in range(8):
+        cache.put('job', 'wf%d'%i, blob)
+        time.sleep(0.02)
+    ## the two oldest used since
+    cache.get('job', 'wf0')
+    cache.get('job', 'wf1')
+    for i in range(8, 16):
+        time.sleep(0.02)
+        cache.put('job', 'wf%d'%i, blob)
+    kept = [i for i in range(16) if cache.get('job', 'wf%d'%i) is not None]
+    print "kept after eviction", kept
+    failed = check("within the budget", directory_size(cache.root) <= cache.budget)
+    failed |= check("least recently used evicted first", 0 in kept and 1 in kept and 2 not in kept and 15 in kept)
+    return failed
+
+
+def blob_for(name, version):
+    ## large enough for a write to take a while, and checkable in full
+    payload = ('%s:%d:'%(name, version)) * 20000
+    return payload + hashlib.sha1(payload).hexdigest()
+
+
+def valid(blob):
+    ## a partial entry does not decompress, and reads as None
+    return blob is not None and hashlib.sha1(blob[:-40]).hexdigest() == blob[-40:]
+
+
+def hammer(root, n_threads, seconds, bad):
+    cache = artifactCache(root)
+    for i in range(5):
+        cache.put('spec', 'wf%d'%i, blob_for('wf%d'%i, 0))
+    def work(t):
+        i = 0
+        stop = time.time() + seconds
+        while time.time() < stop:
+            name = 'wf%d'%(i % 5)
+            cache.put('spec', name, blob_for(name, os.getpid()*100+t))
+            if not valid( cache.get('spec', 'wf%d'%((i+1) % 5)) ):
+                bad.value += 1
+            i += 1
+    threads = [threading.Thread(target=work, args=(t,)) for t in range(n_threads)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+
+def concurrent(base, n_threads, n_processes, seconds=3):
+    root = os.path.join(base, 'concurrent')
+    bad = multiprocessing.Value('i', 0)
+    processes = [multiprocessing.Process(target=hammer, args=(root, n_threads, seconds, bad)) for p in range(n_processes)]
+    for p in processes: p.start()
+    for p in processes: p.join()
+    cache = artifactCache(root)
+    left = [f for d, _, files in os.walk(root) for f in files if '.tmp.' in f]
+    failed = check("no partial entry read by %d threads in %d processes"%(n_threads, n_processes), bad.value == 0)
+    failed |= check("all entries readable", all([valid(cache.get('spec', 'wf%d'%i)) for i in range(5)]))
+    failed |= check("no temporary file left", not left)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--documents', help='number of wmstats documents', default=200, type=int)
+    parser.add_option('--threads', help='number of writing threads per process', default=4, type=int)
+    parser.add_option('--processes', help='number of writing processes', default=4, type=int)
+    (options, args) = parser.parse_args()
+
+    base = tempfile.mkdtemp()
+    try:
+        compare(base, options.documents)
+        failed = read_through(base)
+        failed |= eviction(base)
+        failed |= concurrent(base, options.threads, options.processes)
+    finally:
+        shutil.rmtree( base )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,187 @@
+"""
+    What the benches share : the report of a check, and the stand-ins of DBS, of cacheInfo, of an x509
+    connection to cmsweb and of a TLS server, which the benches put in place of the real ones.
+"""
+import BaseHTTPServer
+import SocketServer
+import os
+import ssl
+import subprocess
+import threading
+import time
+from collections import defaultdict
+
+
+def check(name, ok):
+    print "%-60s %s"%(name, 'ok' if ok else 'FAILED')
+    return not ok
+
+
+class fakeDbs(object):
+    """
+    Blocks of files, named dataset#block, the files carrying their lumis, events and validity as the benches
+    make them. Counts the calls per api, each answered after the latency, and fails on the failing block.
+    """
+    blocks = {}
+    modified = {}
+    latency = 0
+    failing = None
+    calls = defaultdict(int)
+    lock = threading.Lock()
+
+    def __init__(self, url=None):
+        pass
+
+    @classmethod
+    def reset(cls):
+        cls.blocks = {}
+        cls.modified = {}
+        cls.latency = 0
+        cls.failing = None
+        cls.calls.clear()
+
+    def _call(self, api, block_name=None):
+        with fakeDbs.lock:
+            fakeDbs.calls[api] += 1
+        if fakeDbs.latency:
+            time.sleep( fakeDbs.latency )
+        if block_name and block_name == fakeDbs.failing:
+            raise Exception("%s failed on %s"%(api, block_name))
+
+    def _blocks(self, dataset=None, block_name=None):
+        return [b for b in sorted(fakeDbs.blocks) if (not dataset or b.split('#')[0] == dataset) and (not block_name or b == block_name)]
+
+    def _file(self, f, detail):
+        ## the lumis come from listFileLumis only
+        f = dict([(k, v) for (k, v) in f.items() if not k in ['run_num', 'lumi_section_num']])
+        return f if detail else {'logical_file_name' : f['logical_file_name']}
+
+    def listBlocks(self, dataset, detail=False):
+        self._call('listBlocks')
+        return [{'block_name' : b, 'last_modification_date' : fakeDbs.modified.get(b, 0)} for b in self._blocks(dataset)]
+
+    def listFiles(self, dataset=None, block_name=None, detail=False, validFileOnly=0):
+        self._call('listFiles', block_name)
+        return [self._file(f, detail) for b in self._blocks(dataset, block_name) for f in fakeDbs.blocks[b]
+                if not validFileOnly or f.get('is_file_valid', 1)]
+
+    def listFileArray(self, logical_file_name=None, block_name=None, detail=True):
+        self._call('listFileArray', block_name)
+        lfns = set([logical_file_name] if isinstance(logical_file_name, basestring) else logical_file_name or [])
+        return [dict(self._file(f, detail), block_name=b) for b in self._blocks(block_name=block_name) for f in fakeDbs.blocks[b]
+                if block_name or f['logical_file_name'] in lfns]
+
+    def listFileLumis(self, block_name=None, logical_file_name=None, validFileOnly=0):
+        self._call('listFileLumis', block_name)
+        return [dict(f) for b in self._blocks(block_name=block_name) for f in fakeDbs.blocks[b]
+                if (block_name or f['logical_file_name'] == logical_file_name) and (not validFileOnly or f.get('is_file_valid', 1))]
+
+    def listFileSummaries(self, dataset):
+        self._call('listFileSummaries')
+        files = [f for b in self._blocks(dataset) for f in fakeDbs.blocks[b]]
+        return [{'num_file' : len(files), 'num_event' : sum([f.get('event_count', 0) for f in files])}] if files else []
+
+
+def dotted_keys(content):
+    if isinstance(content, dict):
+        return any(['.' in k or dotted_keys(v) for k,v in content.items()])
+    if isinstance(content, list):
+        return any(map(dotted_keys, content))
+    return False
+
+
+class fakeCacheInfo(object):
+    """
+    the documents of cacheInfo, in memory with their expiration, refusing those mongo would not take
+    """
+    docs = {}
+    refused = []
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.docs.clear()
+            del cls.refused[:]
+
+    def get(self, key, no_expire=False):
+        with fakeCacheInfo.lock:
+            doc = fakeCacheInfo.docs.get(key)
+        if doc and (no_expire or doc['expire'] > time.time()):
+            return doc['data']
+        return None
+
+    def store(self, key, data, lifetime_min=10):
+        with fakeCacheInfo.lock:
+            if dotted_keys(data):
+                fakeCacheInfo.refused.append( key )
+                return
+            fakeCacheInfo.docs[key] = {'data' : data, 'expire' : time.time() + 60*lifetime_min}
+
+    def remove(self, key):
+        with fakeCacheInfo.lock:
+            fakeCacheInfo.docs.pop(key, None)
+
+    def expire(self, key):
+        with fakeCacheInfo.lock:
+            fakeCacheInfo.docs[key]['expire'] = 0
+
+
+class fakeResponse(object):
+    status = 200
+    reason = 'OK'
+    def __init__(self, body):
+        self.body = body
+    def getheaders(self):
+        return [('content-length', str(len(self.body)))]
+    def read(self):
+        return self.body
+
+
+class fakeConnection(object):
+    """
+    An x509 connection to cmsweb, whose answers the benches give in answer(method, url, body).
+    """
+    def request(self, method, url, body=None, headers=None):
+        self.body = self.answer(method, url, body)
+
+    def getresponse(self):
+        return fakeResponse( self.body )
+
+    def close(self):
+        pass
+
+    def answer(self, method, url, body):
+        raise NotImplementedError("%s %s"%(method, url))
+
+
+def certificate(directory):
+    ## a self-signed certificate and its key, in one file as the proxy
+    key = os.path.join(directory, 'key.pem')
+    cert = os.path.join(directory, 'cert.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                           '-keyout', key, '-out', cert], stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    both = os.path.join(directory, 'proxy.pem')
+    open(both, 'w').write( open(cert).read() + open(key).read() )
+    return both
+
+
+class standIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A local TLS server answering with the given request handler, one thread per connection.
+    """
+    daemon_threads = True
+
+    def __init__(self, certificate, handler):
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0), handler)
+        self.certificate = certificate
+        self.lock = threading.Lock()
+
+    def finish_request(self, request, client_address):
+        ## the handshake in the thread of the connection
+        request = ssl.wrap_socket(request, certfile=self.certificate, server_side=True)
+        BaseHTTPServer.HTTPServer.finish_request(self, request, client_address)
+
+    def handle_error(self, request, client_address):
+        ## clients closing their connections
+        pass
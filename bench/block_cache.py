@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+    DBS calls of utils.getDatasetBlocksContent over the cycles of a running workflow whose output dataset grows
+    by --new blocks per cycle, with its open block modified, against a stand-in of DBS and of cacheInfo kept
+    in memory, compared with fetching the whole dataset again as when the dataset entry expired.
+    Checks that only the new or modified blocks are fetched, that the content matches DBS, and that the
+    block of a file whose validity changed from here is fetched again. Exits with an error otherwise :
+      python bench/block_cache.py --cycles 10 --blocks 200 --new 5
+"""
+import optparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from benchUtils import check, fakeDbs, fakeCacheInfo
+
+
+def grow(dataset, n_blocks, files_per_block=10, stamp=0):
+    start = len(fakeDbs.blocks)
+    for i in range(start, start + n_blocks):
+        block = '%s#block%05d'%(dataset, i)
+        fakeDbs.blocks[block] = [{'logical_file_name' : '/store/mc/Era/Primary/AODSIM/Processing-v1/%05d/%03d.root'%(i, f), 'is_file_valid' : 1}
+                                 for f in range(files_per_block)]
+        fakeDbs.modified[block] = stamp
+    return block
+
+
+def append(block, stamp):
+    ## files added to the open block
+    n = len(fakeDbs.blocks[block])
+    fakeDbs.blocks[block].append({'logical_file_name' : fakeDbs.blocks[block][0]['logical_file_name'].replace('/000.root', '/%03d.root'%n), 'is_file_valid' : 1})
+    fakeDbs.modified[block] = stamp
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--cycles', help='number of cycles', default=10, type=int)
+    parser.add_option('--blocks', help='number of blocks at the start', default=200, type=int)
+    parser.add_option('--new', help='number of new blocks per cycle', default=5, type=int)
+    (options, args) = parser.parse_args()
+
+    utils.DbsApi = fakeDbs
+    utils.cacheInfo = fakeCacheInfo
+    dataset = '/Primary/Era-Processing-v1/AODSIM'
+    getter = lambda b : fakeDbs().listFiles( block_name = b, detail = True)
+    open_block = grow(dataset, options.blocks)
+
+    failed = False
+    former = 0
+    current = 0
+    for cycle in range(options.cycles):
+        if cycle:
+            append(open_block, cycle)
+            open_block = grow(dataset, options.new, stamp = cycle)
+        before = fakeDbs.calls['listFiles']
+        content = utils.getDatasetBlocksContent( dataset, 'listFile', getter )
+        fetched = fakeDbs.calls['listFiles'] - before
+        expected = len(fakeDbs.blocks) if cycle == 0 else options.new + 1
+        former += len(fakeDbs.blocks)
+        current += fetched
+        failed |= check("cycle %d : %d blocks fetched of %d"%(cycle, fetched, len(fakeDbs.blocks)),
+                        fetched == expected and content == fakeDbs.blocks)
+    print "%d blocks fetched over %d cycles, against %d fetching the whole dataset"%(current, options.cycles, former)
+
+    ## a file invalidated from here, in a block which is not modified
+    block = sorted(fakeDbs.blocks)[0]
+    fakeDbs.blocks[block][0]['is_file_valid'] = 0
+    utils.forgetFilesContent( [fakeDbs.blocks[block][0]['logical_file_name']] )
+    before = fakeDbs.calls['listFiles']
+    content = utils.getDatasetBlocksContent( dataset, 'listFile', getter )
+    failed |= check("block of an invalidated file fetched again", fakeDbs.calls['listFiles'] - before == 1 and content[block][0]['is_file_valid'] == 0)
+    sys.exit(1 if failed else 0)
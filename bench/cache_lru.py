@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+    Cost of reading the documents of cacheInfo from the in-memory utils.lruCache, against the former
+    deep copy on each get, on synthetic documents the size of the gwmsmon ones. Then checks that a caller
+    modifying what it got does not change the cache, that the least recently used keys go first and that
+    the cache stays within max_bytes, and that the modules share a single MongoClient per process.
+    Exits with an error otherwise :
+      python bench/cache_lru.py --keys 50 --gets 2000
+"""
+import copy
+import cPickle
+import optparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import lruCache, mongo_client
+from benchUtils import check
+
+
+def synthetic(n_sites):
+    return dict([('T2_XX_Site%d'%i, {'CpusPending' : random.randint(0, 1000), 'CpusInUse' : random.randint(0, 10000),
+                                     'sixdays' : random.random(), 'agents' : ['vocms0%d.cern.ch'%a for a in range(5)]})
+                 for i in range(n_sites)])
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--keys', help='number of cached documents', default=50, type=int)
+    parser.add_option('--sites', help='number of sites per document', default=2000, type=int)
+    parser.add_option('--gets', help='number of reads', default=2000, type=int)
+    (options, args) = parser.parse_args()
+
+    random.seed(1)
+    expire = time.time() + 3600
+    docs = dict([('doc%d'%k, synthetic(options.sites)) for k in range(options.keys)])
+    reads = [random.choice(sorted(docs)) for g in range(options.gets)]
+
+    ## the former get
+    start = time.time()
+    for key in reads:
+        copy.deepcopy( docs[key] )
+    former = time.time() - start
+
+    cache = lruCache( max_size = options.keys )
+    start = time.time()
+    for key, doc in docs.items():
+        cache.put(key, doc, expire)
+    put = time.time() - start
+    start = time.time()
+    for key in reads:
+        cache.get(key)
+    current = time.time() - start
+    print "former  %8.3f [ms] per get"%(1000.*former/len(reads))
+    print "current %8.3f [ms] per get, %8.3f [ms] per put, %.1f [MB] held"%(1000.*current/len(reads), 1000.*put/len(docs), cache.bytes/1024.**2)
+
+    failed = False
+    got = cache.get('doc0')
+    got.pop( sorted(got)[0] )
+    failed |= check("a modified document does not change the cache", cache.get('doc0') == docs['doc0'])
+
+    size = len(cPickle.dumps(docs['doc0'], cPickle.HIGHEST_PROTOCOL))
+    small = lruCache( max_size = 100, max_bytes = 3*size )
+    for key in ['doc0', 'doc1', 'doc2']:
+        small.put(key, docs[key], expire)
+    small.get('doc0')
+    small.put('doc3', docs['doc3'], expire)
+    failed |= check("least recently used key evicted", small.get('doc1') is None and small.get('doc0') is not None)
+    failed |= check("within max_bytes (%d/%d)"%(small.bytes, small.max_bytes), small.bytes <= small.max_bytes and len(small.items) == 3)
+    small.put('big', synthetic(4*options.sites), expire)
+    failed |= check("a document larger than max_bytes is not kept", small.get('big') is None and small.bytes <= small.max_bytes)
+    small.pop('doc0')
+    failed |= check("bytes accounted on pop", small.bytes == sum([len(v[1]) for v in small.items.values()]))
+
+    failed |= check("one MongoClient per process", mongo_client() is mongo_client())
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+    Record and replay of the cycle of bench/cassettes/campaign_cycle.py over a synthetic campaign.
+    A cassette is recorded against in-process stand-ins of ReqMgr, DBS and of the unified mongo database, and
+    replayed with bench/run_cycle.py, as is the shipped bench/cassettes/campaign.json.gz.
+    Checks that the live database is not written to while recording, and that the replays print the same
+    output, spec checksums included, and make the same calls per service as the recording. Exits with an error otherwise :
+      python bench/cassette_cycle.py
+    The shipped cassette, and the output expected from it in campaign.expected.json, are made again with :
+      python bench/cassette_cycle.py --make bench/cassettes/campaign.json.gz
+"""
+import json
+import optparse
+import os
+import runpy
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+from benchUtils import check, fakeConnection, fakeDbs
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+module = os.path.join(base, 'bench', 'cassettes', 'campaign_cycle.py')
+shipped = os.path.join(base, 'bench', 'cassettes', 'campaign.json.gz')
+
+CAMPAIGN = 'RunIISynthetic20'
+WORKFLOWS = [('pdmvserv_task_SYN-RunIISynthetic20-%05d__v1_T_201017_000000_%04d'%(i, i), CAMPAIGN if i < 3 else 'RunIIOff') for i in range(4)]
+
+
+def outputs(name):
+    i = int(name.split('-')[2][:5])
+    return ['/Synthetic%d/RunIISynthetic20-v1/%s'%(i, tier) for tier in ['AODSIM', 'MINIAODSIM']]
+
+
+def spec(name):
+    ## a pickle is not utf-8
+    return '\x80\x02' + ''.join([chr((i*37 + len(name)*7 + ord(name[-1])) % 256) for i in range(2000)])
+
+
+def output_files(output):
+    ## 10 files in a block, with the events of the output
+    i = int(output.split('/')[1].replace('Synthetic', ''))
+    for f in range(10):
+        fakeDbs.blocks.setdefault('%s#block0'%output, []).append({'logical_file_name' : '%s/%03d.root'%(output, f),
+                                                                  'event_count' : (250 if output.endswith('/AODSIM') else 100)*(i+1)})
+
+
+class cmswebConnection(fakeConnection):
+    """
+    ReqMgr2 and reqmgr_workload_cache
+    """
+    def answer(self, method, there, body):
+        if there.startswith('/reqmgr2/data/request?status=running-closed'):
+            docs = dict([(name, {'RequestName' : name, 'Campaign' : campaign, 'RequestStatus' : 'running-closed',
+                                 'RequestNumEvents' : 10000, 'OutputDatasets' : outputs(name)}) for (name, campaign) in WORKFLOWS])
+            return json.dumps({'result' : [docs]})
+        elif there.startswith('/couchdb/reqmgr_workload_cache/') and there.endswith('/spec'):
+            return spec( there.split('/')[-2] )
+        raise Exception("not in the stand-in: %s %s"%(method, there))
+
+
+class fakePool(object):
+    def connection(self, url):
+        return cmswebConnection()
+
+
+def live_database():
+    import mongomock
+    live = mongomock.MongoClient()
+    live.unified.campaignsConfiguration.insert_many([{'name' : CAMPAIGN, 'go' : True}, {'name' : 'RunIIOff', 'go' : False}])
+    ## an output known as closed, from an earlier cycle : DBS is not asked for it
+    live.unified.campaignProgress.insert_one({'name' : outputs(WORKFLOWS[0][0])[0], 'events' : 9000, 'closed' : True})
+    live.unified.cacheLease.create_index('key', unique=True)
+    return live
+
+
+def content(client):
+    db = client.unified
+    return dict([(name, sorted([json.dumps(dict((k,v) for k,v in d.items() if k != '_id'), sort_keys=True) for d in db[name].find()]))
+                 for name in db.list_collection_names()])
+
+
+def make(path):
+    """
+    records the cycle against the stand-ins, in this process
+    """
+    os.environ['UNIFIED_CASSETTE'] = os.path.abspath( path )
+    os.environ['UNIFIED_CASSETTE_MODE'] = 'record'
+    sys.path.insert(0, base)
+    import cassette
+    import utils
+    live = live_database()
+    before = content( live )
+    utils.x509_pool = fakePool()
+    for (name, campaign) in WORKFLOWS:
+        for output in outputs(name):
+            output_files(output)
+    utils.DbsApi = cassette.wrap_api(fakeDbs, 'dbs')
+    utils.mongo_client = lambda : cassette.mongo(lambda : live)
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        runpy.run_path( module, run_name = '__main__')
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    c = cassette.active()
+    c.save()
+    expected = {'output' : output, 'calls' : c.counts()}
+    open(path.replace('.json.gz', '.expected.json'), 'w').write( json.dumps(expected, indent=2, sort_keys=True) )
+    print output,
+    print "calls", expected['calls']
+    failed = check("nothing written to the live database while recording", content( live ) == before)
+    failed |= check("the module wrote to the recorded copy", content( utils.mongo_client() ) != before)
+    return failed
+
+
+def replay(path):
+    ## the module output, its exit status and the calls per service, as printed by run_cycle
+    out = subprocess.Popen([sys.executable, os.path.join(base, 'bench', 'run_cycle.py'), '--cassette', path, module],
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT).communicate()[0]
+    output, _, report = out.partition('='*40 + '\n')
+    calls = {}
+    status = None
+    for line in report.splitlines():
+        if line.startswith('calls '):
+            service, n = line[len('calls '):].split(':')
+            calls[service.strip()] = int(n)
+        if line.startswith('module '):
+            status = line.split()[-1]
+    return output, status, calls
+
+
+def compare(label, path):
+    expected = json.loads( open(path.replace('.json.gz', '.expected.json')).read() )
+    output, status, calls = replay(path)
+    print "%s : %s"%(label, ', '.join(['%d %s calls'%(n, s) for s, n in sorted(calls.items())]))
+    failed = check("%s : same output"%label, status in ['0', 'None'] and output == expected['output'])
+    if output != expected['output']:
+        print output
+    failed |= check("%s : same calls per service"%label, calls == expected['calls'])
+    return failed
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--make', help='record the cassette of the cycle in this file', default=None)
+    (options, args) = parser.parse_args()
+
+    if options.make:
+        sys.exit(1 if make(options.make) else 0)
+
+    directory = tempfile.mkdtemp()
+    try:
+        recorded = os.path.join(directory, 'campaign.json.gz')
+        failed = subprocess.call([sys.executable, os.path.abspath(__file__), '--make', recorded]) != 0
+        failed |= compare("replay of the recording", recorded)
+        failed |= compare("replay of the shipped cassette", shipped)
+    finally:
+        shutil.rmtree( directory )
+    sys.exit(1 if failed else 0)
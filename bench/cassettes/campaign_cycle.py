@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+    The cycle of a small module over a synthetic campaign, recorded in campaign.json.gz by bench/cassette_cycle.py :
+    the running workflows of the campaigns which are on in mongo, the events of their outputs in DBS unless mongo
+    already has them as closed, and the size and checksum of their spec.
+"""
+import hashlib
+from utils import getWorkflows, GET, DbsApi, mongo_client, reqmgr_url, dbs_url
+
+def campaign_cycle(url):
+    db = mongo_client().unified
+    on = set([c['name'] for c in db.campaignsConfiguration.find({'go' : True})])
+    for wf in sorted(getWorkflows(url, 'running-closed', details=True), key = lambda r : r['RequestName']):
+        if not wf['Campaign'] in on:
+            print wf['RequestName'],"is in",wf['Campaign'],"which is off"
+            continue
+        spec = GET(url, '/couchdb/reqmgr_workload_cache/%s/spec'%wf['RequestName'], l=False).read()
+        print wf['RequestName'],"spec of",len(spec),"bytes",hashlib.sha1( spec ).hexdigest()
+        for output in wf['OutputDatasets']:
+            known = db.campaignProgress.find_one({'name' : output})
+            if known and known.get('closed'):
+                events = known['events']
+            else:
+                summary = DbsApi(url=dbs_url).listFileSummaries(dataset=output)
+                events = summary[0]['num_event'] if summary else 0
+            fraction = events / float(wf['RequestNumEvents'])
+            print "  %-60s %5.1f%% (%s)"%(output, 100.*fraction, 'closed' if known and known.get('closed') else 'dbs')
+            db.campaignProgress.update_one({'name' : output}, {'$set' : {'name' : output, 'events' : events}}, upsert = True)
+
+if __name__ == "__main__":
+    campaign_cycle(reqmgr_url)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+    Cost of building unifiedConfiguration as many times as a module cycle does for its workflows, reading and
+    parsing the file each time as before, and through the process-wide utils.config_snapshot. Checks that the
+    file is parsed once per process, and again only once it changes. Exits with an error otherwise :
+      python bench/config_snapshot.py --instances 5000
+"""
+import json
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base)
+## the service configuration is read from the working directory when utils is imported
+os.chdir(base)
+from utils import unifiedConfiguration, config_snapshot
+from benchUtils import check
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--instances', help='number of instances built', default=5000, type=int)
+    (options, args) = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'unifiedConfiguration.json')
+    shutil.copy(os.path.join(base, 'unifiedConfiguration.json'), path)
+    parameter = sorted(json.load(open(path)))[0]
+
+    ## as each construction did before
+    start = time.time()
+    for i in range(options.instances):
+        json.loads(open(path).read())[parameter]['value']
+    print "%-9s %8.3f [ms] per instance"%('former', 1000.*(time.time() - start)/options.instances)
+
+    parses = config_snapshot.parses
+    start = time.time()
+    for i in range(options.instances):
+        unifiedConfiguration(path).get(parameter)
+    print "%-9s %8.3f [ms] per instance"%('snapshot', 1000.*(time.time() - start)/options.instances)
+    failed = check("parsed once for %d instances"%options.instances, config_snapshot.parses - parses == 1)
+
+    version = unifiedConfiguration(path).version
+    content = json.load(open(path))
+    content[parameter]['value'] = 'changed'
+    open(path, 'w').write( json.dumps(content, indent=2) )
+    failed |= check("parsed again once changed", unifiedConfiguration(path).get(parameter) == 'changed' and config_snapshot.parses - parses == 2)
+    failed |= check("new version", unifiedConfiguration(path).version == version + 1 and config_snapshot.parses - parses == 2)
+
+    shutil.rmtree(directory)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+    Requests per second of small GETs to a local TLS stand-in of cmsweb, with a new HTTPSConnection per query
+    as the helpers did, and through connectionPool.x509_pool. Then drops the kept-alive connections on the
+    server side, and checks that a GET is sent again on a new connection while a POST is not. Exits with an
+    error if a POST is applied twice :
+      python bench/connection_pool.py --requests 500 --threads 4
+"""
+import BaseHTTPServer
+import httplib
+import optparse
+import os
+import shutil
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base)
+import benchUtils
+from benchUtils import certificate
+
+## the stand-in has a self-signed certificate
+ssl._create_default_https_context = ssl._create_unverified_context
+
+
+class handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.sockets.append( self.connection )
+
+    def _reply(self):
+        body = '{"result": [{"%s": "ok"}]}' % self.path
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.counts['GET'] += 1
+        self._reply()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        with self.server.lock:
+            self.server.counts['POST'] += 1
+        if self.path == '/drop':
+            ## applied, but the response is lost
+            self.close_connection = 1
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self._reply()
+
+    def log_message(self, *args):
+        pass
+
+
+class standIn(benchUtils.standIn):
+    def __init__(self, certificate):
+        benchUtils.standIn.__init__(self, certificate, handler)
+        self.sockets = []
+        self.counts = {'GET' : 0, 'POST' : 0}
+
+    def drop_connections(self):
+        ## as cmsweb does with idle keep-alive connections
+        with self.lock:
+            for s in self.sockets:
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            self.sockets = []
+
+
+def run(connect, n, n_threads):
+    errors = []
+    def work(count):
+        for i in range(count):
+            try:
+                conn = connect()
+                conn.request('GET', '/reqmgr2/data/request?name=wf%d'%i, headers={"Accept": "application/json"})
+                conn.getresponse().read()
+                conn.close()
+            except Exception as e:
+                errors.append( e )
+    threads = [threading.Thread(target=work, args=(n//n_threads,)) for t in range(n_threads)]
+    start = time.time()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return (n//n_threads)*n_threads / (time.time() - start), errors
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--requests', help='number of requests', default=500, type=int)
+    parser.add_option('--threads', help='number of client threads', default=4, type=int)
+    (options, args) = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    proxy = certificate(directory)
+    os.environ['X509_USER_PROXY'] = proxy
+    server = standIn(proxy)
+    serving = threading.Thread(target=server.serve_forever)
+    serving.daemon = True
+    serving.start()
+    url = 'localhost:%d' % server.server_address[1]
+
+    from connectionPool import x509ConnectionPool
+    pool = x509ConnectionPool()
+    failed = False
+    for name, connect in [('new', lambda : httplib.HTTPSConnection(url, cert_file = proxy, key_file = proxy)),
+                          ('pooled', lambda : pool.connection(url))]:
+        rate, errors = run(connect, options.requests, options.threads)
+        failed |= bool(errors)
+        print "%-8s %8.1f requests/s, %d errors"%(name, rate, len(errors))
+
+    ## responses lost on re-used connections
+    run(lambda : pool.connection(url), 2, 1)
+    server.drop_connections()
+    gets = server.counts['GET']
+    conn = pool.connection(url)
+    conn.request('GET', '/after/drop')
+    replayed = conn.getresponse().read()
+    conn.close()
+    print "GET on a dropped connection :", "sent again" if replayed and server.counts['GET'] == gets+1 else "FAILED"
+    failed |= not (replayed and server.counts['GET'] == gets+1)
+
+    posts = server.counts['POST']
+    conn = pool.connection(url)
+    conn.request('POST', '/drop', body='{}', headers={'Content-Length' : '2'})
+    try:
+        conn.getresponse().read()
+        raised = False
+    except (httplib.HTTPException, socket.error):
+        raised = True
+    conn.close()
+    time.sleep(0.1)
+    applied = server.counts['POST'] - posts
+    print "POST with a lost response : raised %s, applied %d time(s)"%(raised, applied)
+    failed |= not raised or applied != 1
+
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(directory)
+    sys.exit(1 if failed else 0)
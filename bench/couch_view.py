@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+    HTTP requests and time of utils.getWorkflowsByOutput for the requests producing --datasets output datasets,
+    against a local threaded HTTP stand-in of the reqmgr_workload_cache views answering after --latency [s],
+    compared with the former view GET per dataset.
+    Checks that the rows are the same, that the keys are POSTed in chunks, that --threads threads asking
+    for the same keys at once make a single POST, and the _all_docs queries. Exits with an error otherwise :
+      python bench/couch_view.py --datasets 1000 --latency 0.01
+"""
+import BaseHTTPServer
+import SocketServer
+import httplib
+import json
+import optparse
+import os
+import sys
+import threading
+import time
+import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from benchUtils import check
+
+
+class fakeCouch(object):
+    """
+    the byoutputdataset view and _all_docs of reqmgr_workload_cache, counting the requests per method
+    """
+    docs = {}
+    latency = 0
+    requests = {'GET' : 0, 'POST' : 0}
+    lock = threading.Lock()
+
+    @classmethod
+    def synthetic(cls, n_datasets):
+        for i in range(n_datasets):
+            name = 'pdmvserv_task_B2G-RunIISummer20UL18wmLHEGEN-%05d__v1_T_201017_000000_%04d'%(i, i)
+            outputs = ['/Primary%d/RunIISummer20UL18-106X_v%d/%s'%(i, v, tier) for v in range(1, 1 + i % 3) for tier in ['AODSIM', 'MINIAODSIM']]
+            cls.docs[name] = {'_id' : name, 'RequestName' : name, 'OutputDatasets' : outputs}
+
+    @classmethod
+    def rows(cls, path, keys, include_docs):
+        with cls.lock:
+            if path.endswith('/_all_docs'):
+                found = [(k, cls.docs[k]) for k in keys if k in cls.docs]
+            else:
+                found = [(k, d) for k in keys for d in sorted(cls.docs.values(), key = lambda d : d['_id']) if k in d['OutputDatasets']]
+        return [dict([('id', d['_id']), ('key', k), ('value', None)] + ([('doc', d)] if include_docs else [])) for k, d in found]
+
+
+class handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self, keys):
+        url = urlparse.urlparse( self.path )
+        query = urlparse.parse_qs( url.query )
+        with fakeCouch.lock:
+            fakeCouch.requests[self.command] += 1
+        time.sleep( fakeCouch.latency )
+        body = json.dumps({'rows' : fakeCouch.rows(url.path, keys, query.get('include_docs') == ['true'])})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write( body )
+
+    def do_GET(self):
+        self.answer( [json.loads(urlparse.parse_qs( urlparse.urlparse( self.path ).query )['key'][0])] )
+
+    def do_POST(self):
+        self.answer( json.loads(self.rfile.read( int(self.headers['Content-Length']) ))['keys'] )
+
+    def log_message(self, *args):
+        pass
+
+
+class server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def former_getWorkflowByOutput( url, dataset , details=False):
+    ## a view GET per dataset
+    conn = utils.make_x509_conn(url)
+    there = '/couchdb/reqmgr_workload_cache/_design/ReqMgr/_view/byoutputdataset?key="%s"'%(dataset)
+    if details:
+        there+='&include_docs=true'
+    r1=conn.request("GET",there)
+    r2=conn.getresponse()
+    data = json.loads(r2.read())
+    items = data['rows']
+    if details:
+        return [item['doc'] for item in items]
+    else:
+        return [item['id'] for item in items]
+
+
+def timed(fn):
+    before = dict(fakeCouch.requests)
+    start = time.time()
+    r = fn()
+    return r, time.time() - start, dict([(m, fakeCouch.requests[m] - before[m]) for m in before])
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--datasets', help='number of output datasets looked up', default=1000, type=int)
+    parser.add_option('--latency', help='latency of a view request [s]', default=0.01, type=float)
+    parser.add_option('--threads', help='number of threads asking for the same keys', default=8, type=int)
+    (options, args) = parser.parse_args()
+
+    httpd = server(('127.0.0.1', 0), handler)
+    t = threading.Thread(target = httpd.serve_forever)
+    t.daemon = True
+    t.start()
+    port = httpd.server_address[1]
+    utils.make_x509_conn = lambda url=utils.reqmgr_url, max_try=5 : httplib.HTTPConnection('127.0.0.1', port)
+    url = utils.reqmgr_url
+    fakeCouch.latency = options.latency
+    fakeCouch.synthetic( options.datasets )
+    datasets = sorted(set([o for d in fakeCouch.docs.values() for o in d['OutputDatasets']]))[:options.datasets]
+
+    former, spent, requests = timed(lambda : dict([(d, former_getWorkflowByOutput(url, d, details=True)) for d in datasets]))
+    print "former  %5d datasets : %5d GET,  %5d POST, %8.3f [s]"%(len(datasets), requests['GET'], requests['POST'], spent)
+    current, spent, requests = timed(lambda : utils.getWorkflowsByOutput(url, datasets, details=True))
+    print "current %5d datasets : %5d GET,  %5d POST, %8.3f [s]"%(len(datasets), requests['GET'], requests['POST'], spent)
+    failed = check("same requests", current == former)
+    chunk = utils.couch_view(url, '/couchdb/reqmgr_workload_cache/_design/ReqMgr/_view/byoutputdataset', include_docs=True).chunk_size
+    failed |= check("keys POSTed in chunks of %d"%chunk, requests == {'GET' : 0, 'POST' : (len(datasets) + chunk - 1) // chunk})
+    failed |= check("single dataset", utils.getWorkflowByOutput(url, datasets[0]) == [d['_id'] for d in former[datasets[0]]])
+
+    ## the same keys asked by several threads at once
+    fakeCouch.latency = max(options.latency, 0.2)
+    results = []
+    asking = lambda : results.append( utils.getWorkflowsByOutput(url, datasets[:50]) )
+    threads = [threading.Thread(target = asking) for i in range(options.threads)]
+    _, spent, requests = timed(lambda : [t.start() for t in threads] + [t.join() for t in threads])
+    failed |= check("%d threads asking the same keys : %d POST"%(options.threads, requests['POST']),
+                    requests['POST'] == 1 and len(results) == options.threads and all([r == results[0] for r in results]))
+
+    names = sorted(fakeCouch.docs)[:10] + ['not_a_request']
+    docs = utils.couch_view(url, '/couchdb/reqmgr_workload_cache/_all_docs', include_docs=True).fetch( names )
+    failed |= check("_all_docs", all([[r['doc'] for r in docs[n]] == [fakeCouch.docs[n]] for n in names[:-1]]) and docs['not_a_request'] == [])
+    httpd.shutdown()
+    sys.exit(1 if failed else 0)
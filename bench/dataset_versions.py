@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+    DBS and ReqMgr queries of workflowInfo.getNextVersion, through utils.datasetVersionIndex, for the
+    workflows of an assignor cycle sharing --keys (primary dataset, acquisition era, processing string)
+    with up to --versions versions each in DBS and in ReqMgr, against stand-ins of DBS and of the
+    byoutputdataset view counting the queries, compared with the former wildcard listDatasets per output
+    and getWorkflowByOutput per candidate version.
+    Each workflow is assigned the version chosen, and forgotten from the index as reqMgrClient does.
+    Checks that the versions chosen are the same. Exits with an error otherwise :
+      python bench/dataset_versions.py --workflows 60 --keys 10 --versions 20
+"""
+import fnmatch
+import json
+import optparse
+import os
+import random
+import StringIO
+import sys
+import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from benchUtils import check, fakeConnection
+
+
+class fakeBackends(object):
+    """
+    the datasets in DBS, and the outputs of the requests in ReqMgr, counting the queries
+    """
+    def __init__(self, n_keys, n_versions, seed=1):
+        rand = random.Random(seed)
+        self.datasets = []
+        self.outputs = {}
+        self.dbs = 0
+        self.reqmgr = 0
+        self.keys = []
+        for k in range(n_keys):
+            dsn, era, ps = 'Primary%d'%k, 'RunIISummer20UL18', 'Proc%d'%(k % 3)
+            self.keys.append( (dsn, era, ps) )
+            in_dbs = rand.randint(0, n_versions)
+            for v in range(1, in_dbs + 1):
+                for tier in ['AODSIM', 'MINIAODSIM']:
+                    self.datasets.append( '/%s/%s-%s-v%d/%s'%(dsn, era, ps, v, tier) )
+            ## requests in flight, above the versions in DBS, with gaps
+            for v in range(in_dbs + 1, in_dbs + 1 + rand.randint(0, n_versions)):
+                if rand.random() < 0.8:
+                    self.outputs['request_%s_v%d'%(dsn, v)] = ['/%s/%s-%s-v%d/%s'%(dsn, era, ps, v, tier) for tier in ['AODSIM', 'MINIAODSIM']]
+
+    def getDatasets(self, pattern):
+        self.dbs += 1
+        return [{'dataset' : d} for d in self.datasets if fnmatch.fnmatchcase(d, pattern)]
+
+    def rows(self, keys=None, startkey=None, endkey=None):
+        self.reqmgr += 1
+        rows = sorted([(o, name) for name, outputs in self.outputs.items() for o in outputs])
+        if keys is not None:
+            keys = set(keys)
+            return [{'id' : name, 'key' : o, 'value' : None} for (o, name) in rows if o in keys]
+        return [{'id' : name, 'key' : o, 'value' : None} for (o, name) in rows if startkey <= o <= endkey]
+
+
+class couchConnection(fakeConnection):
+    backends = None
+    def answer(self, method, there, body):
+        assert '/_view/byoutputdataset' in there
+        if method == 'POST':
+            rows = couchConnection.backends.rows( keys = json.loads(body)['keys'] )
+        else:
+            query = urlparse.parse_qs( urlparse.urlparse( there ).query )
+            rows = couchConnection.backends.rows( startkey = json.loads(query['startkey'][0]), endkey = json.loads(query['endkey'][0]) )
+        return json.dumps({'rows' : rows})
+
+
+class fakeWorkflow(object):
+    """
+    what getNextVersion reads of a workflowInfo
+    """
+    def __init__(self, name, request_type, outputs, era, ps):
+        self.url = utils.reqmgr_url
+        self.request = {'RequestName' : name, 'RequestType' : request_type, 'ProcessingVersion' : 1, 'OutputDatasets' : outputs}
+        self.era = era
+        self.ps = ps
+    def acquisitionEra(self):
+        return self.era
+    def processingString(self):
+        return self.ps
+
+
+def cycle(backends, n_workflows, seed=2):
+    rand = random.Random(seed)
+    workflows = []
+    for i in range(n_workflows):
+        dsn, era, ps = rand.choice( backends.keys )
+        if rand.random() < 0.1:
+            ## no processing string in the output name
+            ps = 'None'
+        outputs = ['/%s/%s-%s-v1/%s'%(dsn, era, ps, tier) for tier in ['AODSIM', 'MINIAODSIM']]
+        workflows.append( fakeWorkflow('assigned_%03d_%s'%(i, dsn), rand.choice(['TaskChain', 'ReReco']), outputs, era, ps) )
+    return workflows
+
+
+## the former workflowInfo.getNextVersion
+def former_getNextVersion( self ):
+    ## returns 1 if nothing is in the way
+    if 'ProcessingVersion' in self.request:
+        version = max(0,int(self.request['ProcessingVersion'])-1)
+    else:
+        version = 0
+    outputs = self.request['OutputDatasets']
+    era = self.acquisitionEra()
+    ps = self.processingString()
+    if self.request['RequestType'] == 'TaskChain':
+        for output in outputs:
+            (_,dsn,ps,tier) = output.split('/')
+            if ps.count('-')==2:
+                (aera,aps,_) = ps.split('-')
+            elif ps.count('-')==3:
+                (aera,fn,aps,_) = ps.split('-')
+            else:
+                aera='*'
+                aps='*'
+            pattern = '/'.join(['',dsn,'-'.join([aera,aps,'v*']),tier])
+            wilds = utils.getDatasets( pattern )
+            print pattern,"->",len(wilds),"match(es)"
+            for wild in [wildd['dataset'] for wildd in wilds]:
+                (_,_,mid,_) = wild.split('/')
+                v = int(mid.split('-')[-1].replace('v',''))
+                version = max(v,version)
+        for output in outputs:
+            (_,dsn,ps,tier) = output.split('/')
+            if ps.count('-')==2:
+                (aera,aps,_) = ps.split('-')
+            elif ps.count('-')==3:
+                (aera,fn,aps,_) = ps.split('-')
+            else:
+                print "Cannot check output in reqmgr"
+                print output,"is what is in the request workload"
+                continue
+            while True:
+                predicted = '/'.join(['',dsn,'-'.join([aera,aps,'v%d'%(version+1)]),tier])
+                print "checking against",predicted
+                conflicts = utils.getWorkflowByOutput( self.url, predicted )
+                conflicts = filter(lambda wfn : wfn!=self.request['RequestName'], conflicts)
+                if len(conflicts):
+                    print "There is an output conflict for",self.request['RequestName'],"with",conflicts
+                    ## since we are not planned for pure extension and ever writing in the same dataset, go +1
+                    version += 1
+                else:
+                    break
+
+    else:
+        for output in  outputs:
+            print output
+            (_,dsn,ps,tier) = output.split('/')
+            if ps.count("-") == 2:
+                (aera,aps,_) = ps.split('-')
+            elif ps.count("-") == 3:
+                (aera,fn,aps,_) = ps.split('-')
+            else:
+                ## cannot so anything
+                print "the processing string is mal-formated",ps
+                return None
+
+            if aera == 'None' or aera == 'FAKE':
+                print "no era, using ",era
+                aera=era
+            if aps == 'None':
+                print "no process string, using wild char"
+                aps='*'
+            pattern = '/'.join(['',dsn,'-'.join([aera,aps,'v*']),tier])
+            print "looking for",pattern
+            wilds = utils.getDatasets( pattern )
+            print pattern,"->",len(wilds),"match(es)"
+            for wild in [wildd['dataset'] for wildd in wilds]:
+                (_,_,mid,_) = wild.split('/')
+                v = int(mid.split('-')[-1].replace('v',''))
+                version = max(v,version)
+        #print "version found so far",version
+        for output in  outputs:
+            print output
+            (_,dsn,ps,tier) = output.split('/')
+            if ps.count("-") == 2:
+                (aera,aps,_) = ps.split('-')
+            elif ps.count("-") == 3:
+                (aera,fn,aps,_) = ps.split('-')
+            else:
+                print "the processing string is mal-formated",ps
+                return None
+
+            if aera == 'None' or aera == 'FAKE':
+                print "no era, using ",era
+                aera=era
+            if aps == 'None':
+                print "no process string, cannot parse"
+                continue
+            while True:
+                predicted = '/'.join(['',dsn,'-'.join([aera,aps,'v%d'%(version+1)]),tier])
+                conflicts = utils.getWorkflowByOutput( self.url, predicted )
+                conflicts = filter(lambda wfn : wfn!=self.request['RequestName'], conflicts)
+                if len(conflicts):
+                    print "There is an output conflict for",self.request['RequestName'],"with",conflicts
+                    #return None
+                    ## since we are not planned for pure extension and ever writing in the same dataset, go +1
+                    version += 1
+                else:
+                    break
+
+    return version+1
+
+
+def assign(backends, next_version, workflows):
+    """
+    the versions chosen, each workflow taking the version chosen for its outputs before the next one is looked at
+    """
+    versions = []
+    stdout = sys.stdout
+    for wf in workflows:
+        sys.stdout = StringIO.StringIO()
+        try:
+            version = next_version( wf )
+        finally:
+            sys.stdout = stdout
+        versions.append( version )
+        if version:
+            backends.outputs[wf.request['RequestName']] = [o.replace('-v1/', '-v%d/'%version) for o in wf.request['OutputDatasets']]
+            utils.dataset_versions.forget( wf.request['RequestName'] )
+    return versions
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--workflows', help='number of workflows assigned in the cycle', default=60, type=int)
+    parser.add_option('--keys', help='number of (primary dataset, era, processing string)', default=10, type=int)
+    parser.add_option('--versions', help='maximum number of versions in DBS, and in ReqMgr', default=20, type=int)
+    (options, args) = parser.parse_args()
+
+    utils.make_x509_conn = lambda url=utils.reqmgr_url, max_try=5 : couchConnection()
+    results = {}
+    for name, next_version in [('former', former_getNextVersion), ('current', utils.workflowInfo.getNextVersion.im_func)]:
+        backends = couchConnection.backends = fakeBackends(options.keys, options.versions)
+        utils.getDatasets = backends.getDatasets
+        utils.dataset_versions = utils.datasetVersionIndex()
+        results[name] = assign(backends, next_version, cycle(backends, options.workflows))
+        print "%-8s %4d workflows : %5d DBS queries, %5d ReqMgr queries"%(name, options.workflows, backends.dbs, backends.reqmgr)
+    print "versions chosen", results['current']
+    sys.exit(1 if check("same versions chosen", results['current'] == results['former']) else 0)
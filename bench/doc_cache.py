@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+    Latency seen by the callers of utils.docCache with getters answering after --latency [s], when the
+    documents are missing, fresh and expired, and the time to warm up all the labels. Stand-ins of cacheInfo
+    and of the mongo lease collection are kept in memory, shared by two docCache acting as two hosts.
+    Checks that an expired document is served at once and refreshed in the background, by one host only,
+    and that the leases are released after a refresh and when the process exits. Exits with an error otherwise :
+      python bench/doc_cache.py --labels 14 --latency 0.5
+"""
+import optparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pymongo
+import utils
+from benchUtils import check, fakeCacheInfo
+
+
+class fakeResult(object):
+    def __init__(self, matched_count=0, upserted_id=None):
+        self.matched_count = matched_count
+        self.upserted_id = upserted_id
+
+
+class fakeLeases(object):
+    """
+    the cacheLease collection, for the queries of docCache, with the unique index on the key
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.docs = {}
+    def update_one(self, spec, update, upsert=False):
+        with self.lock:
+            doc = self.docs.get(spec['key'])
+            if doc is not None and (doc['expire'] < spec['$or'][0]['expire']['$lt'] or doc['owner'] == spec['$or'][1]['owner']):
+                doc.update( update['$set'] )
+                return fakeResult(matched_count=1)
+            if doc is not None:
+                raise pymongo.errors.DuplicateKeyError("E11000 duplicate key")
+            self.docs[spec['key']] = dict(update['$set'])
+            return fakeResult(upserted_id=spec['key'])
+    def delete_one(self, spec):
+        with self.lock:
+            if spec['key'] in self.docs and self.docs[spec['key']]['owner'] == spec['owner']:
+                self.docs.pop(spec['key'])
+
+
+class getter(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+            n = self.calls
+        time.sleep( self.latency )
+        return {'value' : n}
+
+
+def host(name, labels, leases, latency):
+    dc = utils.docCache()
+    dc.owner = name
+    dc._leases = lambda : leases
+    dc.cache = dict([(label, {'getter' : getter(latency), 'expiration' : 20, 'default' : {}}) for label in labels])
+    return dc
+
+
+def timed(fn):
+    start = time.time()
+    r = fn()
+    return r, time.time() - start
+
+
+def wait_for(condition, timeout):
+    start = time.time()
+    while not condition() and time.time() - start < timeout:
+        time.sleep(0.01)
+    return condition()
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--labels', help='number of labels', default=14, type=int)
+    parser.add_option('--latency', help='latency of a getter [s]', default=0.5, type=float)
+    (options, args) = parser.parse_args()
+
+    utils.cacheInfo = fakeCacheInfo
+    leases = fakeLeases()
+    labels = ['label%02d'%i for i in range(options.labels)]
+    one = host('host1-1', labels, leases, options.latency)
+    two = host('host2-1', labels, leases, options.latency)
+    fetches = lambda : sum([dc.cache[l]['getter'].calls for dc in [one, two] for l in labels])
+
+    _, spent = timed(lambda : one.warm_up(n_threads = options.labels))
+    print "warm up of %d labels %8.3f [s], %d getter calls"%(options.labels, spent, fetches())
+    failed = check("labels warmed up in parallel", spent < options.labels*options.latency/2.)
+
+    label = labels[0]
+    doc, spent = timed(lambda : one.get(label))
+    print "fresh   %8.3f [s]"%spent
+    for l in labels:
+        fakeCacheInfo().expire(l)
+    doc, spent = timed(lambda : one.get(label))
+    print "expired %8.3f [s]"%spent
+    failed |= check("expired document served at once", doc == {'value' : 1} and spent < options.latency/2.)
+    doc, spent = timed(lambda : two.get(label))
+    failed |= check("the other host does not refresh it too", wait_for(lambda : not one.refreshing and not two.refreshing, 5*options.latency)
+                    and fetches() == options.labels + 1)
+    failed |= check("refreshed in the background", fakeCacheInfo().get(label) == {'value' : 2})
+    failed |= check("lease released after the refresh", not leases.docs and not one.held)
+
+    ## a refresh still running when the process exits
+    one.cache[labels[1]]['getter'].latency = 60
+    one.get(labels[1])
+    wait_for(lambda : leases.docs, 1)
+    failed |= check("lease held while refreshing", labels[1] in leases.docs)
+    one._release_held()
+    failed |= check("lease released at exit", not leases.docs)
+    sys.exit(1 if failed else 0)
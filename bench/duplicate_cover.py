@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+    Time of utils.duplicateAnalyzer to choose the files to invalidate in synthetic datasets with duplicated
+    lumis : pairs and chains of files (bipartite), and lumis in three or more files, and of the former
+    quadratic greedy cover, which only looked at the first two files of a lumi, on a smaller sample.
+    Exits with an error if a duplicated lumi is left in more than one file :
+      python bench/duplicate_cover.py --files 100000 --former-files 3000
+"""
+import optparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import duplicateAnalyzer
+from benchUtils import check
+
+
+def synthetic(n_files, lumis_per_file=20):
+    """
+    {(run, lumi) : [files]}, with about a third of the files sharing lumis with others
+    """
+    random.seed(1)
+    files = ['/store/mc/Era/Primary/AODSIM/Processing-v1/%06d/%08d.root'%(f//1000, f) for f in range(n_files)]
+    files_per_lumis = {}
+    for f, lfn in enumerate(files):
+        for l in range(lumis_per_file):
+            files_per_lumis[(1, f*lumis_per_file + l + 1)] = [lfn]
+    f = 0
+    while f < n_files - 4:
+        kind = random.random()
+        if kind < 0.2:
+            ## a chain of files, each repeating lumis of the previous one
+            length = random.randint(2, 4)
+            for i in range(1, length):
+                for l in random.sample(range(lumis_per_file), 3):
+                    files_per_lumis[(1, (f+i-1)*lumis_per_file + l + 1)].append( files[f+i] )
+            f += length
+        elif kind < 0.3:
+            ## lumis in three or more files
+            n = random.randint(3, 4)
+            for l in random.sample(range(lumis_per_file), 2):
+                files_per_lumis[(1, f*lumis_per_file + l + 1)].extend( files[f+1:f+n] )
+            f += n
+        else:
+            f += 1
+    return files_per_lumis
+
+
+def former_cover(files_per_lumis):
+    """
+    the former greedy cover : an edge between the first two files of a lumi, the file with the most lumis
+    removed first, and all the edges scanned again after each removal
+    """
+    events = defaultdict(int)
+    for rl, fns in files_per_lumis.items():
+        for fn in fns: events[fn] += 1
+    graph = {}
+    for rl, fns in files_per_lumis.items():
+        if len(fns) < 2: continue
+        f1, f2 = fns[0], fns[1]
+        graph.setdefault(f1, {})[f2] = 1
+        graph.setdefault(f2, {})[f1] = 1
+    files = []
+    ls = sorted(graph.keys(), key=lambda x: events[x])
+    while any(graph.values()):
+        minv = ls.pop()
+        for v in graph[minv]:
+            del graph[v][minv]
+        del graph[minv]
+        files.append( minv )
+    return files
+
+
+def left(files_per_lumis, removed):
+    """
+    the duplicated lumis still in more than one file, and those left in none
+    """
+    removed = set(removed)
+    duplicated = [rl for rl, fns in files_per_lumis.items() if len(set(fns)) > 1]
+    kept = [len(set(files_per_lumis[rl]) - removed) for rl in duplicated]
+    return len(duplicated), len([k for k in kept if k > 1]), len([k for k in kept if k == 0])
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--files', help='number of files', default=100000, type=int)
+    parser.add_option('--former-files', help='number of files for the former cover', default=3000, type=int)
+    (options, args) = parser.parse_args()
+
+    failed = False
+    current_cover = lambda s : duplicateAnalyzer().files_to_remove(s)
+    for name, cover, n in [('former', former_cover, options.former_files),
+                           ('current', current_cover, options.former_files),
+                           ('current', current_cover, options.files)]:
+        sample = synthetic(n)
+        start = time.time()
+        removed = cover(sample)
+        spent = time.time() - start
+        n_files = len(set([f for fns in sample.values() for f in fns]))
+        duplicated, still, lost = left(sample, removed)
+        print "%-8s %7d files %7d duplicated lumis : %8.3f [s], %6d files removed, %d lumis still duplicated, %d lumis without a file"%(
+            name, n_files, duplicated, spent, len(removed), still, lost)
+        if name == 'current':
+            failed |= check("every duplicated lumi in a single file (%d files)"%n_files, still == 0)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+    DBS calls and time of dbs3Client.duplicateLumiFiles and duplicateRunLumiFiles on a synthetic dataset, against
+    a stand-in of DBS answering after --latency [s], compared with the former listFileLumis call per file.
+    Checks that the duplicated lumis found are the same, per run or not, and that the check stops early,
+    without fetching all blocks, once a duplicate is found, or once a block cannot be read. Exits with an error otherwise :
+      python bench/duplicate_lumis.py --blocks 100 --files 10
+"""
+import optparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dbs3Client
+from benchUtils import check, fakeDbs
+
+
+def synthetic(n_blocks, n_files, duplicated_blocks=()):
+    fakeDbs.blocks = {}
+    for b in range(n_blocks):
+        block = '/Primary/Era-Processing-v1/AODSIM#block%05d'%b
+        run = 300000 + b // 10
+        first = (b % 10) * n_files * 10 + 1
+        fakeDbs.blocks[block] = [{'logical_file_name' : '/store/mc/Era/Primary/AODSIM/Processing-v1/%05d/%03d.root'%(b, f), 'run_num' : run,
+                                  'lumi_section_num' : range(first + f*10, first + (f+1)*10)} for f in range(n_files)]
+        if b in duplicated_blocks:
+            ## a file of the block repeating lumis of another file of the block
+            fakeDbs.blocks[block][-1]['lumi_section_num'] = fakeDbs.blocks[block][0]['lumi_section_num'][:3] + fakeDbs.blocks[block][-1]['lumi_section_num']
+
+
+def former_duplicateLumiFiles(dataset):
+    ## a listFileLumis call per file
+    dbsapi = fakeDbs()
+    lumisChecked = defaultdict(set)
+    for f in dbsapi.listFiles(dataset=dataset):
+        for lumi in dbsapi.listFileLumis(logical_file_name=f['logical_file_name'])[0]['lumi_section_num']:
+            lumisChecked['%d:%d'%(0,lumi)].add( f['logical_file_name'] )
+    lumisChecked = dict([(k,sorted(v)) for k,v in lumisChecked.items() if len(v) > 1])
+    return len(lumisChecked) != 0, lumisChecked
+
+
+def expected_per_run():
+    lumisChecked = defaultdict(set)
+    for block, files in fakeDbs.blocks.items():
+        for f in files:
+            for lumi in f['lumi_section_num']:
+                lumisChecked['%d:%d'%(f['run_num'],lumi)].add( f['logical_file_name'] )
+    return dict([(k,sorted(v)) for k,v in lumisChecked.items() if len(v) > 1])
+
+
+def run(label, fn):
+    fakeDbs.calls.clear()
+    start = time.time()
+    r = fn()
+    print "%-40s %5d DBS calls %8.3f [s]"%(label, sum(fakeDbs.calls.values()), time.time() - start)
+    return r, sum(fakeDbs.calls.values())
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--blocks', help='number of blocks', default=100, type=int)
+    parser.add_option('--files', help='number of files per block', default=10, type=int)
+    parser.add_option('--latency', help='latency of a DBS call [s]', default=0.01, type=float)
+    (options, args) = parser.parse_args()
+
+    dbs3Client.DbsApi = fakeDbs
+    fakeDbs.latency = options.latency
+    dataset = '/Primary/Era-Processing-v1/AODSIM'
+    synthetic(options.blocks, options.files, duplicated_blocks = [options.blocks//2, options.blocks-1])
+    sort = lambda (r, l) : (r, dict([(k, sorted(v)) for k,v in l.items()]))
+
+    former, _ = run("former duplicateLumiFiles", lambda : former_duplicateLumiFiles(dataset))
+    current, _ = run("duplicateLumiFiles, verbose", lambda : sort(dbs3Client.duplicateLumiFiles(dataset, verbose=True)))
+    failed = check("same duplicated lumis (%d)"%len(former[1]), current == former)
+    per_run, _ = run("duplicateRunLumiFiles, all", lambda : sort(dbs3Client._duplicateLumiFiles(dataset, per_run=True)))
+    failed |= check("same duplicated lumis per run (%d)"%len(per_run[1]), per_run == (True, expected_per_run()))
+    (found, _), calls = run("duplicateRunLumiFiles", lambda : dbs3Client.duplicateRunLumiFiles(dataset))
+    ## the duplicate in the middle block, and a few blocks per thread fetched ahead
+    failed |= check("stops early (%d calls for %d blocks)"%(calls, options.blocks), found and calls < options.blocks//2 + 4*5)
+
+    synthetic(options.blocks, options.files)
+    (found, _), calls = run("duplicateRunLumiFiles, no duplicate", lambda : dbs3Client.duplicateRunLumiFiles(dataset))
+    failed |= check("no duplicate found", not found and calls == options.blocks + 1)
+
+    ## a block which cannot be read
+    fakeDbs.failing = sorted(fakeDbs.blocks)[options.blocks//10]
+    fakeDbs.calls.clear()
+    try:
+        dbs3Client.duplicateRunLumiFiles(dataset)
+        raised = False
+    except Exception:
+        raised = True
+    ## time for the workers to go through all the blocks, if they were not stopped
+    time.sleep( options.latency * options.blocks )
+    calls = sum(fakeDbs.calls.values())
+    failed |= check("stops on a failed block (%d calls for %d blocks)"%(calls, options.blocks), raised and calls < options.blocks//10 + 4*5)
+    sys.exit(1 if failed else 0)
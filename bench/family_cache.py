@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+    Queries of the byprepid view made by utils.familyCache for the families of --workflows workflows looked
+    up by --modules modules, against a stand-in of the reqmgr_workload_cache view counting the queries,
+    compared with the former getWorkflowById query per workflow and module.
+    Checks that the families and their relations are the same, that a family is queried again once one of
+    its members changed status, that an empty PrepID is never cached, and that the documents returned are
+    copies. Exits with an error otherwise :
+      python bench/family_cache.py --workflows 1000 --modules 5
+"""
+import json
+import optparse
+import os
+import random
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from benchUtils import check, fakeConnection
+
+
+class fakeCouch(object):
+    """
+    the byprepid view of reqmgr_workload_cache, over families of an original request, its clones and ACDCs
+    """
+    def __init__(self, n_workflows):
+        rand = random.Random(1)
+        self.docs = {}
+        self.queries = 0
+        self.lock = threading.Lock()
+        f = 0
+        while len(self.docs) < n_workflows:
+            pid = 'B2G-RunIISummer20UL18wmLHEGEN-%05d'%f
+            original = 'pdmvserv_task_%s__v1_T_201017_000000_%04d'%(pid, f)
+            self.add( {'RequestName' : original, 'PrepID' : pid, 'RequestType' : 'TaskChain', 'RequestStatus' : 'running-closed'} )
+            for i in range(rand.randint(0, 3)):
+                kind = rand.choice(['Resubmission', 'TaskChain'])
+                self.add( {'RequestName' : '%s_%s%d'%(original, 'ACDC' if kind == 'Resubmission' else 'clone', i), 'PrepID' : pid,
+                           'RequestType' : kind, 'OriginalRequestName' : original, 'RequestStatus' : 'running-closed'} )
+            f += 1
+
+    def add(self, doc):
+        self.docs[doc['RequestName']] = doc
+
+    def rows(self, keys):
+        with self.lock:
+            self.queries += 1
+        return [{'id' : d['RequestName'], 'key' : d['PrepID'], 'value' : None, 'doc' : json.loads(json.dumps(d))}
+                for k in keys for d in sorted(self.docs.values(), key = lambda d : d['RequestName']) if d['PrepID'] == k]
+
+
+class couchConnection(fakeConnection):
+    couch = None
+    def answer(self, method, there, body):
+        assert method == 'POST' and '/_view/byprepid' in there
+        return json.dumps({'rows' : couchConnection.couch.rows( json.loads(body)['keys'] )})
+
+
+def families(couch):
+    return dict([(d['RequestName'], d['PrepID']) for d in couch.docs.values()])
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--workflows', help='number of workflows', default=1000, type=int)
+    parser.add_option('--modules', help='number of modules looking the families up', default=5, type=int)
+    (options, args) = parser.parse_args()
+
+    url = utils.reqmgr_url
+    couch = couchConnection.couch = fakeCouch(options.workflows)
+    utils.make_x509_conn = lambda url=utils.reqmgr_url, max_try=5 : couchConnection()
+    pids = families(couch)
+    by_name = lambda docs : sorted(docs, key = lambda d : d['RequestName'])
+
+    former = {}
+    for module in range(options.modules):
+        for name, pid in pids.items():
+            former[name] = utils.getWorkflowById(url, pid, details=True, cached=False)
+    former_queries = couch.queries
+
+    couch.queries = 0
+    cache = utils.familyCache()
+    current = {}
+    for module in range(options.modules):
+        ## each module prefetches the families of the workflows it goes through
+        cache.prefetch(url, pids.values())
+        for name, pid in pids.items():
+            current[name] = cache.get(url, pid)
+    print "%d workflows of %d families, %d modules : %d view queries, against %d"%(
+        len(pids), len(set(pids.values())), options.modules, couch.queries, former_queries)
+    failed = check("same families", all([by_name(current[n]) == by_name(former[n]) for n in pids]))
+    chunk = utils.couch_view(url, '/couchdb/reqmgr_workload_cache/_design/ReqMgr/_view/byprepid', include_docs=True).chunk_size
+    failed |= check("one query per %d families"%chunk, couch.queries <= len(set(pids.values())) // chunk + 1)
+
+    acdcs = [d for d in couch.docs.values() if d['RequestType'] == 'Resubmission']
+    acdc = acdcs[0]
+    relations = cache.relations(url, acdc['PrepID'])
+    failed |= check("relations of a family", acdc['RequestName'] in relations[acdc['OriginalRequestName']]['acdcs']
+                    and relations[acdc['RequestName']]['parent'] == acdc['OriginalRequestName'])
+
+    ## a member of the family changes status
+    couch.docs[acdc['RequestName']]['RequestStatus'] = 'completed'
+    before = couch.queries
+    stale = [d['RequestStatus'] for d in cache.get(url, acdc['PrepID']) if d['RequestName'] == acdc['RequestName']]
+    cache.invalidate( workflow = acdc['RequestName'] )
+    fresh = [d['RequestStatus'] for d in cache.get(url, acdc['PrepID']) if d['RequestName'] == acdc['RequestName']]
+    failed |= check("family queried again after a status change", stale == ['running-closed'] and fresh == ['completed'] and couch.queries == before + 1)
+
+    before = couch.queries
+    cache.get(url, None)
+    cache.get(url, '')
+    failed |= check("empty PrepID not cached", couch.queries == before + 2 and not [k for k in cache.families if not k[1]])
+
+    docs = cache.get(url, acdc['PrepID'])
+    docs[0]['RequestStatus'] = 'changed by the caller'
+    failed |= check("documents returned are copies", cache.get(url, acdc['PrepID'])[0]['RequestStatus'] != 'changed by the caller')
+    sys.exit(1 if failed else 0)
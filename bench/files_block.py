@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+    Time and DBS calls to resolve the block of the recovery files of synthetic workflows, with a listFileArray
+    call per file as getRecoveryBlocks did, and with utils.getFilesBlock, against a stand-in of DBS answering
+    after --latency [s]. The lfn to block maps go to a stand-in of cacheInfo which refuses, as mongo does,
+    keys with dots. Exits with an error if a block differs, if a map cannot be stored, or if a second
+    workflow on the same files asks DBS again :
+      python bench/files_block.py --datasets 5 --files 200
+"""
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from benchUtils import check, fakeDbs, fakeCacheInfo
+
+
+def synthetic(n_datasets, n_files):
+    for d in range(n_datasets):
+        dataset = '/Primary%d/Era-Processing-v1/AODSIM'%d
+        for f in range(n_files):
+            lfn = '/store/mc/Era/Primary%d/AODSIM/Processing-v1/%05d/%08d.root'%(d, f//100, f)
+            fakeDbs.blocks.setdefault('%s#block%d'%(dataset, f//100), []).append({'logical_file_name' : lfn})
+    return sorted([f['logical_file_name'] for files in fakeDbs.blocks.values() for f in files])
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--datasets', help='number of input datasets', default=5, type=int)
+    parser.add_option('--files', help='number of recovery files per dataset', default=200, type=int)
+    parser.add_option('--latency', help='latency of a DBS call [s]', default=0.01, type=float)
+    (options, args) = parser.parse_args()
+
+    files = synthetic(options.datasets, options.files)
+    fakeDbs.latency = options.latency
+    utils.DbsApi = fakeDbs
+    utils.cacheInfo = fakeCacheInfo
+    calls = lambda : sum(fakeDbs.calls.values())
+
+    ## the former, one call per file
+    start = time.time()
+    former = dict([(f, fakeDbs().listFileArray(logical_file_name=f)[0]['block_name']) for f in files])
+    print "%-8s %6d DBS calls %8.3f [s]"%('former', calls(), time.time() - start)
+
+    fakeDbs.calls.clear()
+    start = time.time()
+    current = utils.getFilesBlock( files )
+    print "%-8s %6d DBS calls %8.3f [s]"%('bulk', calls(), time.time() - start)
+    failed = check("same blocks", current == former)
+    failed |= check("lfn to block maps stored (%d refused)"%len(fakeCacheInfo.refused), not fakeCacheInfo.refused and len(fakeCacheInfo.docs) == options.datasets)
+
+    ## another workflow on the same input
+    fakeDbs.calls.clear()
+    again = utils.getFilesBlock( files[::3] )
+    failed |= check("second workflow from the cache (%d DBS calls)"%calls(), calls() == 0 and all([again[f] == former[f] for f in files[::3]]))
+    sys.exit(1 if failed else 0)
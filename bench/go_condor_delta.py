@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+    Publishes a sequence of synthetic equalizor interfaces as equalizor does (utils.interface_publication),
+    and builds the JobRouter ads from each with go_condor : incrementally through its local configCache,
+    and from scratch with makeAds. Checks that the overflow ads rebuilt, and the time taken, grow with the number
+    of modifications changed. Then checks that a cache directory other users can write to is refused, and
+    that invocations of the hook overlapping on the same cache all get the ads of the publication.
+    Exits with an error if the ads differ :
+      python bench/go_condor_delta.py --workflows 3000 --processes 4
+"""
+import json
+import multiprocessing
+import optparse
+import os
+import random
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base)
+sys.path.insert(0, os.path.join(base, 'Unified'))
+
+SITES = ['T2_XX_Site%d'%i for i in range(30)]
+
+
+def synthetic(n):
+    config = {'mapping' : {}, 'reversed_mapping' : dict([(s, random.sample(SITES, 3)) for s in SITES[:10]]),
+              'modifications' : {}, 'memory' : {}, 'time' : {}, 'slope' : {}, 'read' : {}, 'hold' : {}, 'release' : {},
+              'resizing' : {}, 'hold_site' : [], 'release_site' : [], 'highprio' : [], 'speed_drain' : []}
+    for w in range(n):
+        wf = 'wf%05d'%w
+        config['modifications'][wf] = dict([('/%s/Task%d'%(wf, t), {'AddWhitelist' : sorted(random.sample(SITES, 2))}) for t in range(3)])
+        config['memory'].setdefault(str(random.choice([2000, 3000, 4000])), []).append('/%s/Task0'%wf)
+        config['resizing']['/%s/Task1'%wf] = {'minCores' : 1, 'maxCores' : random.choice([4, 8]), 'memoryPerThread' : 1000}
+    return config
+
+
+def changed(config, section, n):
+    config = json.loads(json.dumps(config))
+    for wf in random.sample(sorted(config['modifications']), n):
+        if section == 'modifications':
+            config['modifications'][wf]['/%s/Task0'%wf] = {'AddWhitelist' : sorted(random.sample(SITES, 2))}
+        elif section == 'memory':
+            config['memory'].setdefault('5000', []).append('/%s/Task2'%wf)
+        elif section == 'hold':
+            config['hold']['/%s/Task2'%wf] = []
+    return config
+
+
+def publish(directory, config):
+    from utils import interface_publication
+    def published(fn):
+        try:
+            return json.load(open(os.path.join(directory, fn)))
+        except IOError:
+            return None
+    interface, deltas, status = interface_publication(config,
+                                                      previous = published('equalizor.json'),
+                                                      status = published('equalizor.version.json'),
+                                                      deltas = published('equalizor.delta.json'))
+    for fn, content in [('equalizor.json', json.dumps(interface, indent=2)),
+                        ('equalizor.delta.json', json.dumps(deltas)),
+                        ('equalizor.version.json', json.dumps(status))]:
+        open(os.path.join(directory, fn), 'w').write(content)
+
+
+def from_scratch(directory):
+    import go_condor
+    start = time.time()
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        go_condor.makeAds(json.load(open(os.path.join(directory, 'equalizor.json'))))
+        ads = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    return ads, time.time() - start
+
+
+def incremental(directory, cache_directory):
+    import go_condor
+    start = time.time()
+    cache = go_condor.configCache(cache_directory)
+    try:
+        cache.update('file://%s/equalizor.json'%directory)
+        ads = cache.ads()
+    finally:
+        cache.close()
+    ## and how many groups of ads were rebuilt, out of all, for the builders made per group
+    built = [b + (' %d/%d groups'%cache.groups_built[b] if b in cache.groups_built else '') for b in cache.built]
+    return ads, time.time() - start, built
+
+
+def overlapping(directory, cache_directory, queue):
+    ## an invocation of the hook
+    queue.put( incremental(directory, cache_directory)[0] )
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--workflows', help='number of workflows', default=3000, type=int)
+    parser.add_option('--processes', help='number of overlapping invocations', default=4, type=int)
+    (options, args) = parser.parse_args()
+
+    random.seed(1)
+    directory = tempfile.mkdtemp()
+    cache_directory = os.path.join(directory, 'cache')
+    config = synthetic(options.workflows)
+    different = 0
+    growth = []
+    steps = [(None, 0), (None, 0), ('memory', 10), ('hold', 1), ('modifications', 1), ('modifications', 100), ('modifications', 1000), (None, 0)]
+    for i, (section, n) in enumerate(steps):
+        if section:
+            config = changed(config, section, n)
+        publish(directory, config)
+        full, t_full = from_scratch(directory)
+        if section == 'modifications':
+            before = os.path.join(directory, 'before')
+            shutil.copytree(cache_directory, before)
+        ads, t_incremental, built = incremental(directory, cache_directory)
+        different += (ads != full)
+        if section == 'modifications':
+            ## the best of a few runs, each from the cache as it was before the change
+            for r in range(2):
+                again = os.path.join(directory, 'again')
+                shutil.copytree(before, again)
+                t_incremental = min(t_incremental, incremental(directory, again)[1])
+                shutil.rmtree(again)
+            shutil.rmtree(before)
+            growth.append( (n, t_incremental, int(built[0].split()[1].split('/')[0])) )
+        print "%-14s %5d changes : from scratch %6.3f [s], incremental %6.3f [s], rebuilt %-30s %s"%(
+            section or '-', n, t_full, t_incremental, ','.join(built) if i else 'all', 'identical' if ads == full else 'DIFFERENT')
+
+    ## the time taken grows with the groups a change touches, and so with the number of changes
+    grows = [t for (n, t, g) in growth] == sorted([t for (n, t, g) in growth]) and [g for (n, t, g) in growth] == sorted(set([g for (n, t, g) in growth]))
+    different += not grows
+    print "incremental time and overflow groups rebuilt, for %s modifications changed :"%(','.join([str(n) for (n, t, g) in growth])),
+    print ', '.join(['%.3f [s] %d groups'%(t, g) for (n, t, g) in growth]), 'growing' if grows else 'NOT GROWING'
+
+    ## a broken chain of deltas falls back to the whole configuration
+    os.remove(os.path.join(directory, 'equalizor.delta.json'))
+    config = changed(config, 'modifications', 5)
+    publish(directory, config)
+    ads, t_incremental, built = incremental(directory, cache_directory)
+    different += (ads != from_scratch(directory)[0])
+    print "without deltas : incremental %6.3f [s], rebuilt %s"%(t_incremental, ','.join(built))
+
+    ## a directory others can write ads to
+    import go_condor
+    os.chmod(cache_directory, 0o777)
+    try:
+        go_condor.configCache(cache_directory)
+        refused = False
+    except Exception:
+        refused = True
+    os.chmod(cache_directory, 0o700)
+    different += not refused
+    print "world-writable cache directory :", "refused" if refused else "USED"
+
+    ## overlapping invocations on the same cache
+    config = changed(config, 'modifications', 100)
+    publish(directory, config)
+    full = from_scratch(directory)[0]
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=overlapping, args=(directory, cache_directory, queue)) for p in range(options.processes)]
+    for p in processes: p.start()
+    results = [queue.get() for p in processes]
+    for p in processes: p.join()
+    again = incremental(directory, cache_directory)
+    wrong = len([ads for ads in results + [again[0]] if ads != full])
+    different += wrong
+    print "%d overlapping invocations : %d with different ads, then rebuilt %s"%(options.processes, wrong, ','.join(again[2]) or 'nothing')
+
+    shutil.rmtree(directory)
+    sys.exit(1 if different else 0)
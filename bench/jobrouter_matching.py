@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+    Matching time per job of the JobRouter routes made by go_condor, evaluated locally with the classad bindings
+    against a synthetic population of idle job ads : the former routes, one per task or with member() over
+    a list of tasks, and the current ones, looking tasks up in a record. Exits with an error if any job gets
+    different attribute changes from the routes it matches :
+      python bench/jobrouter_matching.py --workflows 3000 --jobs 2000
+"""
+import optparse
+import os
+import random
+import StringIO
+import sys
+import time
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base)
+sys.path.insert(0, os.path.join(base, 'Unified'))
+
+import classad
+## as in the JobRouter hook, with htcondor loaded : it registers functions and changes the lookup of attributes
+import go_condor
+
+SITES = ['T2_XX_Site%d'%i for i in range(30)]
+
+
+def synthetic(n):
+    config = {'reversed_mapping' : dict([(s, random.sample(SITES, 3)) for s in SITES[:10]]),
+              'modifications' : {}, 'memory' : {}, 'time' : {}, 'slope' : {}, 'read' : {}, 'hold' : {}, 'release' : {},
+              'resizing' : {}, 'highprio' : []}
+    for w in range(n):
+        wf = 'wf%05d'%w
+        tasks = ['/%s/Task%d'%(wf, t) for t in range(3)]
+        config['modifications'][wf] = {tasks[0] : {'AddWhitelist' : sorted(random.sample(SITES[:10], 2))}}
+        if random.random() < 0.1:
+            config['modifications'][wf][tasks[1]] = {'ReplaceSiteWhitelist' : random.sample(SITES, 2)}
+            if w%2:
+                ## tasks differing only by case, getting the same action
+                config['modifications'][wf][tasks[1].upper()] = config['modifications'][wf][tasks[1]]
+        config['memory'].setdefault(str(random.choice([2000, 3000, 4000])), []).append(tasks[0])
+        config['time'].setdefault(str(random.choice([600, 1200])), []).append(tasks[1])
+        config['slope'].setdefault(str(random.choice([100, 200])), []).append(tasks[2])
+        config['read'].setdefault(str(random.choice([100, 500])), []).append(tasks[2])
+        config['resizing'][tasks[1]] = {'minCores' : 1, 'maxCores' : random.choice([4, 8]), 'memoryPerThread' : 1000}
+        if random.random() < 0.05:
+            config['hold'][tasks[2]] = []
+            if w%2:
+                config['hold'][tasks[2].lower()] = []
+        elif random.random() < 0.05:
+            config['release'][tasks[2]] = []
+        if random.random() < 0.01:
+            config['highprio'].append(wf)
+    return config
+
+
+def jobs(config, n):
+    workflows = sorted(config['modifications'])
+    population = []
+    for j in range(n):
+        wf = random.choice(workflows) if random.random() < 0.9 else 'unknown%05d'%j
+        job = classad.ClassAd({'WMAgent_RequestName' : wf,
+                               'WMAgent_SubTaskName' : '/%s/Task%d'%(wf, random.randint(0, 3)),
+                               'WMCore_ResizeJob' : False,
+                               'OriginalMemory' : random.choice([2000, 3000]),
+                               'EstimatedSingleCoreMins' : random.choice([300, 900]),
+                               'EstimatedInputRateKBs' : 100,
+                               'ExtraMemory' : 0})
+        which = random.random()
+        if which < 0.05:
+            ## jobs without a task name
+            del job['WMAgent_SubTaskName']
+        elif which < 0.15:
+            job['WMAgent_SubTaskName'] = random.choice([str.lower, str.upper])(job['WMAgent_SubTaskName'])
+        population.append( job )
+    return population
+
+
+def quoted_list(names):
+    ## the ClassAds trick of go_condor to create a properly-formatted ClassAd list
+    anAd = classad.ClassAd()
+    anAd["Names"] = map(str, names)
+    return anAd.lookup('Names').__repr__()
+
+
+def former(config):
+    """
+    the Requirements and attribute changes of the task routes as go_condor made them before
+    """
+    def route(exp, changes):
+        anAd = classad.ClassAd(changes)
+        anAd["Requirements"] = classad.ExprTree(str(exp))
+        return anAd
+    routes = []
+    if config.get('highprio'):
+        routes.append( route('(HasBeenRaisedHighPrio isnt true)  && member(target.WMAgent_RequestName, %s)' % quoted_list(config['highprio']),
+                             {'set_AccountingGroup' : "highprio.cmsdataops", 'set_HasBeenRaisedHighPrio' : True, 'set_HasBeenRouted' : False}) )
+    for task in sorted(config.get('hold',{})):
+        routes.append( route('(HasBeenSetHeld isnt true)  && (target.WMAgent_SubTaskName =?= %s)' % classad.quote(str(task)),
+                             {'copy_DESIRED_Sites' : "Held_DESIRED_Sites", 'set_DESIRED_Sites' : "T2_NW_NOWHERE", 'set_HasBeenRouted' : False, 'set_HasBeenSetHeld' : True}) )
+    for task in sorted(config.get('release',{})):
+        routes.append( route('(HasBeenSetHeld is true) && (target.WMAgent_SubTaskName =?= %s)' % classad.quote(str(task)),
+                             {'copy_Held_DESIRED_Sites' : "DESIRED_Sites", 'set_HasBeenRouted' : False, 'set_HasBeenSetHeld' : False}) )
+    for needs, tasks in sorted(config.get('read',{}).items()):
+        routes.append( route('member(target.WMAgent_SubTaskName, %s) && (EstimatedInputRateKBs =!= %d)' %( quoted_list(tasks), int(float(needs))),
+                             {'set_HasBeenRouted' : False, 'set_HasBeenReadTuned' : True, 'set_EstimatedInputRateKBs' : int(float(needs))}) )
+    overflow_tasks = {}
+    for workflow, tasks in sorted(config.get('modifications',{}).items()):
+        for taskname, specs in sorted(tasks.items()):
+            if "ReplaceSiteWhitelist" in specs:
+                routes.append( route('(HasBeenReplaced isnt true)  && (target.WMAgent_SubTaskName =?= %s)' % classad.quote(str(taskname)),
+                                     {'eval_set_DESIRED_Sites' : str(",".join(specs['ReplaceSiteWhitelist'])),
+                                      'set_Rank' : classad.ExprTree("stringlistmember(GLIDEIN_CMSSite, ExtDESIRED_Sites)"),
+                                      'set_HasBeenReplaced' : True, 'set_HasBeenRouted' : False}) )
+            elif specs.get("AddWhitelist"):
+                overflow_tasks.setdefault(",".join(sorted(specs["AddWhitelist"])), []).append(taskname)
+    for whitelist_sites, tasks in sorted(overflow_tasks.items()):
+        routes.append( route('member(target.WMAgent_SubTaskName, %s) && (HasBeenRouted_Overflow isnt true)' % quoted_list(tasks),
+                             {'copy_DESIRED_Sites' : "Pre_DESIRED_Sites", 'set_HasBeenRouted' : False, 'set_HasBeenRouted_Overflow' : True,
+                              'set_Rank' : classad.ExprTree("stringlistmember(GLIDEIN_CMSSite, ExtDESIRED_Sites)"),
+                              'whitelist' : whitelist_sites}) )
+    policies = {}
+    for workflow, info in sorted(config.get('resizing', {}).items()):
+        policies.setdefault((info.get("minCores", 3), info.get("maxCores", 8), info.get("memoryPerThread")), set()).add(workflow)
+    for (minCores, maxCores, memoryPerThread), workflows in sorted(policies.items()):
+        routes.append( route('(target.WMCore_ResizeJob is False) && member(target.WMAgent_SubTaskName, %s)' % quoted_list(sorted(workflows)),
+                             {'set_WMCore_ResizeJob' : True, 'set_MinCores' : minCores, 'set_MaxCores' : maxCores, 'set_HasBeenRouted' : False, 'set_ExtraMemory' : memoryPerThread}) )
+    for memory, wfs in sorted(config.get('memory',{}).items()):
+        routes.append( route('member(target.WMAgent_SubTaskName, %s) && ((target.HasBeenMemoryTuned =!= true) || (target.OriginalMemory =!= %d))' %( quoted_list(wfs), int(memory)),
+                             {'set_HasBeenMemoryTuned' : True, 'set_HasBeenRouted' : False, 'set_OriginalMemory' : int(memory)}) )
+    for timing, wfs in sorted(config.get('time',{}).items()):
+        routes.append( route('member(target.WMAgent_SubTaskName, %s) && ((target.HasBeenTimingTuned =!= true) || (target.EstimatedSingleCoreMins <= %d))' %( quoted_list(wfs), int(timing)),
+                             {'set_HasBeenTimingTuned' : True, 'set_HasBeenRouted' : False, 'set_EstimatedSingleCoreMins' : int(timing),
+                              'set_OriginalMaxWallTimeMins' : classad.ExprTree('EstimatedSingleCoreMins / OriginalCpus')}) )
+    for slope, wfs in sorted(config.get('slope',{}).items()):
+        routes.append( route('member(target.WMAgent_SubTaskName, %s) && (target.ExtraMemory =!= %d)' %( quoted_list(wfs), int(slope)),
+                             {'set_HasBeenSlopeTuned' : True, 'set_HasBeenRouted' : False, 'set_ExtraMemory' : int(slope)}) )
+    return routes
+
+
+def current(config):
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        for builder in [go_condor.makeHighPrioAds, go_condor.makeHoldAds, go_condor.makeReleaseAds, go_condor.makeReadAds,
+                        go_condor.makeOverflowAds, go_condor.makeResizeAds, go_condor.makePerformanceCorrectionsAds]:
+            builder(config)
+        text = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    routes = list(classad.parseAds(text))
+    for anAd in routes:
+        if anAd.get('Name', '').startswith('Master overflow rule to run at '):
+            ## the site mapping is the same before and after, the whitelist tells the rules apart
+            anAd['whitelist'] = anAd['Name'][len('Master overflow rule to run at '):-len(' in addition')]
+            del anAd['eval_set_DESIRED_Sites']
+    return routes
+
+
+def changes(anAd):
+    return tuple(sorted([(k, str(anAd.lookup(k))) for k in anAd.keys() if k.lower() not in ['requirements', 'name', 'gridresource', 'targetuniverse']]))
+
+
+def matching(routes, population):
+    start = time.time()
+    matched = [sorted([changes(anAd) for anAd in routes if job.matches(anAd)]) for job in population]
+    return matched, time.time() - start
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--workflows', help='number of workflows', default=3000, type=int)
+    parser.add_option('--jobs', help='number of idle jobs', default=2000, type=int)
+    (options, args) = parser.parse_args()
+
+    random.seed(1)
+    config = synthetic(options.workflows)
+    population = jobs(config, options.jobs)
+    results = {}
+    for name, maker in [('former', former), ('current', current)]:
+        routes = maker(config)
+        matched, spent = matching(routes, population)
+        results[name] = matched
+        print "%-8s %6d routes %8.3f [ms] per job, %d route matches"%(name, len(routes), 1000.*spent/len(population), sum(map(len, matched)))
+    different = [i for i in range(len(population)) if results['former'][i] != results['current'][i]]
+    for i in different[:10]:
+        print population[i].get('WMAgent_SubTaskName'), "former", results['former'][i], "current", results['current'][i]
+    print len(different), "job(s) with different attribute changes"
+    sys.exit(1 if different else 0)
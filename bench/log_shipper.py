@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+    Ships log documents with utils.logShipper to a local TLS stand-in of the elastic search _bulk api, and checks :
+      - ordering and batching, with the background flusher
+      - at-least-once delivery, with the endpoint down and answering what cannot be read, then back
+      - that the spools of several processes shipping at the same time while the endpoint is down are all replayed
+      - that a document refused by elastic search goes to the dead-letter file, and those after it are delivered
+      - that the spool keeps the newest documents within its size
+    Exits with an error if a document is lost, out of order, or a batch is too large :
+      python bench/log_shipper.py --docs 500 --batch 50
+"""
+import BaseHTTPServer
+import json
+import multiprocessing
+import optparse
+import os
+import shutil
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base)
+
+import benchUtils
+from benchUtils import check, certificate
+
+## the stand-in has a self-signed certificate
+ssl._create_default_https_context = ssl._create_unverified_context
+
+
+class handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        lines = body.splitlines()
+        docs = [json.loads(l) for l in lines[1::2]]
+        mode = self.server.mode
+        if mode == 'down':
+            reply, status = 'unavailable', 503
+        elif mode == 'garbage':
+            ## as a proxy error page with a 200
+            reply, status = '<html>bad gateway</html>', 200
+        else:
+            ## as a mapping error on the documents to refuse
+            refused = [d['id'] in self.server.refuse for d in docs]
+            with self.server.lock:
+                self.server.batches.append( [d['id'] for (d, r) in zip(docs, refused) if not r] )
+            items = [{'index' : {'status' : 400, 'error' : {'type' : 'mapper_parsing_exception'}} if r else {'status' : 201}} for r in refused]
+            reply, status = json.dumps({'errors' : any(refused), 'items' : items}), 200
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class standIn(benchUtils.standIn):
+    def __init__(self, certificate):
+        benchUtils.standIn.__init__(self, certificate, handler)
+        self.batches = []
+        self.refuse = set()
+        self.mode = 'up'
+
+    def delivered(self):
+        with self.lock:
+            return sum(self.batches, [])
+
+
+def shipper(url, spool_dir, batch_size, flush_every=10, max_spool_mb=50):
+    from utils import logShipper
+    return logShipper(host=url, batch_size=batch_size, flush_every=flush_every, spool_dir=spool_dir, header={}, max_spool_mb=max_spool_mb)
+
+
+def spools(spool_dir):
+    return [fn for fn in os.listdir(spool_dir) if fn.startswith('es_log_spool')]
+
+
+def child(url, spool_dir, batch_size, ids):
+    ## a module process logging while the endpoint is down, and exiting
+    s = shipper(url, spool_dir, batch_size)
+    for i in ids:
+        s.add({'id' : i})
+    s.flush()
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--docs', help='number of documents', default=500, type=int)
+    parser.add_option('--batch', help='batch size', default=50, type=int)
+    parser.add_option('--processes', help='number of processes spooling at the same time', default=4, type=int)
+    (options, args) = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    spool_dir = os.path.join(directory, 'spool')
+    os.makedirs(spool_dir)
+    server = standIn(certificate(directory))
+    serving = threading.Thread(target=server.serve_forever)
+    serving.daemon = True
+    serving.start()
+    url = 'localhost:%d' % server.server_address[1]
+    failed = False
+
+    ## ordering and batching from the background flusher
+    s = shipper(url, spool_dir, options.batch, flush_every=0.2)
+    s.start()
+    ids = ['live-%d'%i for i in range(options.docs)]
+    start = time.time()
+    for i in ids:
+        s.add({'id' : i})
+    while len(server.delivered()) < len(ids) and time.time() - start < 30:
+        time.sleep(0.05)
+    print "%d documents in %d bulk calls, %.3f [s]"%(len(server.delivered()), len(server.batches), time.time() - start)
+    failed |= check("documents delivered in order", server.delivered() == ids)
+    failed |= check("batches of at most %d documents"%options.batch, max(map(len, server.batches)) <= options.batch)
+
+    ## at-least-once with the endpoint down, then answering garbage, then back
+    server.batches = []
+    ids = ['retry-%d'%i for i in range(3*options.batch)]
+    for mode in ['down', 'garbage']:
+        server.mode = mode
+        for i in ids[:len(ids)//2] if mode == 'down' else ids[len(ids)//2:]:
+            s.add({'id' : i})
+        s.flush()
+    failed |= check("nothing taken while down or unreadable", server.delivered() == [])
+    server.mode = 'up'
+    s.flush()
+    failed |= check("spooled documents delivered in order once back", server.delivered() == ids)
+
+    ## processes spooling at the same time
+    server.batches = []
+    server.mode = 'down'
+    per_process = [['process%d-%d'%(p, i) for i in range(options.docs//options.processes)] for p in range(options.processes)]
+    processes = [multiprocessing.Process(target=child, args=(url, spool_dir, options.batch, p_ids)) for p_ids in per_process]
+    for p in processes: p.start()
+    for p in processes: p.join()
+    print len(spools(spool_dir)), "spool files left by", options.processes, "processes"
+    server.mode = 'up'
+    s.add({'id' : 'last'})
+    s.flush()
+    delivered = server.delivered()
+    failed |= check("documents of all the processes delivered", all([i in delivered for i in sum(per_process, [])]))
+    failed |= check("each process in order", all([[i for i in delivered if i in set(p_ids)] == p_ids for p_ids in per_process]))
+    failed |= check("no spool left", spools(spool_dir) == [])
+
+    ## a document refused, in the first batch
+    server.batches = []
+    ids = ['refused-%d'%i for i in range(3*options.batch)]
+    server.refuse = set([ids[1]])
+    for i in ids:
+        s.add({'id' : i})
+    s.flush()
+    server.refuse = set()
+    s.add({'id' : 'next'})
+    s.flush()
+    dead_letter = os.path.join(spool_dir, 'es_log_rejected.json')
+    dead = [json.loads(l)['doc']['id'] for l in open(dead_letter)] if os.path.isfile(dead_letter) else []
+    failed |= check("documents after a refused one delivered in order", server.delivered() == ids[:1] + ids[2:] + ['next'])
+    failed |= check("refused document in the dead-letter file only", dead == [ids[1]] and spools(spool_dir) == [])
+
+    ## the spool within its size, while the endpoint is down
+    server.batches = []
+    server.mode = 'down'
+    ## its own directory, the spool file being the one of the process
+    small_dir = os.path.join(directory, 'small')
+    os.makedirs(small_dir)
+    small = shipper(url, small_dir, options.batch, max_spool_mb=0.01)
+    ids = ['capped-%d'%i for i in range(options.docs)]
+    for i in ids:
+        small.add({'id' : i, 'text' : 'x'*100})
+    small.flush()
+    size = sum([os.path.getsize(os.path.join(small_dir, fn)) for fn in spools(small_dir)])
+    server.mode = 'up'
+    small.flush()
+    delivered = server.delivered()
+    print "%d documents spooled in %d bytes, %d dropped"%(len(delivered), size, small.dropped)
+    failed |= check("spool within its size", 0 < size <= small.max_spool)
+    failed |= check("newest documents kept", delivered == ids[len(ids)-len(delivered):] and small.dropped == len(ids) - len(delivered))
+
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(directory)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+    Time and peak RSS to build, cache (serialise and read back) and look for duplicate lumis in the run/lumi to
+    files content of a synthetic dataset, with the former "run:lumi" dicts of lists and with utils.lumiFileIndex.
+    Then checks on a smaller dataset that the index gives the same lumis, files and duplicates as the former
+    dicts. Exits with an error otherwise :
+      python bench/lumi_index.py --lumis 5000000
+"""
+import json
+import optparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from benchUtils import check
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic(n_lumis, per_file=100, duplicates=0.01):
+    """
+    listFileLumis records, aggregated per (run, file), with a fraction of the lumis in a second file
+    """
+    random.seed(1)
+    records = []
+    n_files = max(1, n_lumis // per_file)
+    for f in range(n_files):
+        run = 300000 + f // 500
+        first = (f % 500) * per_file + 1
+        lfn = '/store/data/Run2018A/Primary/AOD/Processing-v1/%06d/%08d-0000-0000-0000-000000000000.root'%(f//1000, f)
+        lumis = range(first, first + per_file)
+        if random.random() < duplicates*per_file/10.:
+            ## a few lumis of the previous file again
+            lumis += random.sample(range(max(1, first - per_file), first), 10) if first > 1 else []
+        records.append({'logical_file_name' : lfn, 'run_num' : run, 'lumi_section_num' : lumis})
+    return records
+
+
+def former(records):
+    full_lumi_json = defaultdict(set)
+    files_per_lumi = defaultdict(set)
+    for f in records:
+        full_lumi_json[ str(f['run_num']) ].update( f['lumi_section_num'])
+        for lumi in f['lumi_section_num']:
+            files_per_lumi['{}:{}'.format(f['run_num'], lumi)].add( f['logical_file_name'])
+    for k,v in full_lumi_json.items():
+        full_lumi_json[k] = list(v)
+    for k,v in files_per_lumi.items():
+        files_per_lumi[k] = list(v)
+    return full_lumi_json, files_per_lumi
+
+
+def former_duplicated(files_per_lumi):
+    duplicated = {}
+    for rl, files in files_per_lumi.items():
+        if len(files) > 1:
+            r,l = rl.split(':')
+            duplicated[(int(r), int(l))] = sorted(files)
+    return duplicated
+
+
+def measure(n_lumis, mode):
+    records = synthetic(n_lumis)
+    timings = []
+    start = time.time()
+    if mode == 'former':
+        lumis, files = former(records)
+        timings.append(('build', time.time() - start))
+        start = time.time()
+        payload = json.dumps({'files' : files, 'lumis' : lumis})
+        timings.append(('serialise', time.time() - start))
+        start = time.time()
+        cached = json.loads( payload )
+        timings.append(('read back', time.time() - start))
+        start = time.time()
+        former_duplicated( cached['files'] )
+        timings.append(('duplicates', time.time() - start))
+    else:
+        from utils import lumiFileIndex
+        index = lumiFileIndex.from_file_lumis( records )
+        timings.append(('build', time.time() - start))
+        start = time.time()
+        payload = index.serialize()
+        timings.append(('serialise', time.time() - start))
+        start = time.time()
+        cached = lumiFileIndex.deserialize( payload )
+        timings.append(('read back', time.time() - start))
+        start = time.time()
+        cached.duplicated()
+        timings.append(('duplicates', time.time() - start))
+    del records
+    print "%-7s %s, cached %7.1f [MB], peak RSS %7.1f [MB]"%(mode, ', '.join(['%s %6.2f [s]'%t for t in timings]), len(payload)/1024.**2,
+                                                            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+
+
+def compare(n_lumis):
+    from utils import lumiFileIndex
+    records = synthetic(n_lumis)
+    lumis, files = former(records)
+    index = lumiFileIndex.deserialize( lumiFileIndex.from_file_lumis( records ).serialize() )
+    failed = check("lumis per run", dict([(int(r), sorted(l)) for r,l in lumis.items()]) == dict([(r, sorted(l)) for r,l in index.lumis_per_run().items()]))
+    failed |= check("files per lumi", dict([(tuple(map(int, rl.split(':'))), sorted(f)) for rl,f in files.items()]) == dict([(rl, sorted(f)) for rl,f in index.files_per_lumi().items()]))
+    duplicated = former_duplicated( files )
+    failed |= check("%d duplicated lumis"%len(duplicated), duplicated == dict([(rl, sorted(f)) for rl,f in index.duplicated().items()]))
+    some = random.sample(sorted(duplicated), min(100, len(duplicated)))
+    failed |= check("lookups", all([sorted(index.files_for(r, l)) == duplicated[(r,l)] for (r,l) in some]))
+    runs = sorted(set([r['run_num'] for r in records]))[:2]
+    failed |= check("lumis of some runs", index.lumis_per_run( runs ) == dict([(r, sorted(lumis[str(r)])) for r in runs]))
+    return failed
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--lumis', help='number of lumis of the dataset', default=1000000, type=int)
+    parser.add_option('--mode', help=optparse.SUPPRESS_HELP, default=None)
+    (options, args) = parser.parse_args()
+
+    if options.mode:
+        measure(options.lumis, options.mode)
+        sys.exit(0)
+    ## each in its own process, for a clean peak RSS
+    for mode in ['former', 'index']:
+        subprocess.call([sys.executable, os.path.abspath(__file__), '--lumis', str(options.lumis), '--mode', mode])
+    sys.exit(1 if compare(min(options.lumis, 200000)) else 0)
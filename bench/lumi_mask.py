@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+    Time and peak RSS to find the lumis of an input dataset missing from its output, streaming through the
+    listFileLumis records of both, with the former sets of lumis per run and with lumiMask.LumiMask.
+    Then checks on smaller datasets that the masks give the same difference, union, intersection and counts
+    as the sets, and the same content back from the lumi-mask json. Exits with an error otherwise :
+      python bench/lumi_mask.py --lumis 10000000
+"""
+import optparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lumiMask import LumiMask
+from benchUtils import check
+
+
+def records(n_lumis, missing=0.0, seed=1, per_file=200):
+    """
+    yields listFileLumis records of a dataset of runs of 5000 lumis, without a fraction of the files,
+    and with some lumis missing here and there
+    """
+    rand = random.Random(seed)
+    for f in range(n_lumis // per_file):
+        if rand.random() < missing:
+            continue
+        run = 300000 + (f*per_file) // 5000
+        first = (f*per_file) % 5000 + 1
+        lumis = range(first, first + per_file)
+        if rand.random() < missing:
+            lumis = [l for l in lumis if rand.random() > 0.1]
+        yield {'logical_file_name' : '/store/data/Run2018A/Primary/AOD/v1/%08d.root'%f, 'run_num' : run, 'lumi_section_num' : lumis}
+
+
+def sets(stream):
+    content = {}
+    for r in stream:
+        content.setdefault(r['run_num'], set()).update( r['lumi_section_num'] )
+    return content
+
+
+def diff_sets(a, b):
+    diff = {}
+    for run in a:
+        d = a[run] - b.get(run, set())
+        if d:
+            diff[run] = d
+    return diff
+
+
+def measure(n_lumis, mode):
+    start = time.time()
+    if mode == 'sets':
+        inputs, outputs = sets(records(n_lumis)), sets(records(n_lumis, missing=0.05, seed=2))
+        built = time.time() - start
+        start = time.time()
+        n_missing = sum(map(len, diff_sets(inputs, outputs).values()))
+    else:
+        inputs, outputs = LumiMask.from_file_lumis(records(n_lumis)), LumiMask.from_file_lumis(records(n_lumis, missing=0.05, seed=2))
+        built = time.time() - start
+        start = time.time()
+        n_missing = len(inputs - outputs)
+    print "%-5s %9d lumis missing : built in %6.2f [s], diff in %6.3f [s], peak RSS %7.1f [MB]"%(mode, n_missing, built, time.time() - start,
+                                                                                             resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+
+
+def as_sets(mask):
+    return dict([(run, set(lumis)) for run, lumis in mask.lumis_per_run().items()])
+
+
+def compare(n_lumis):
+    a_sets, b_sets = sets(records(n_lumis, missing=0.01)), sets(records(n_lumis, missing=0.1, seed=2))
+    a, b = LumiMask.from_file_lumis(records(n_lumis, missing=0.01)), LumiMask.from_file_lumis(records(n_lumis, missing=0.1, seed=2))
+    failed = check("content", as_sets(a) == a_sets and as_sets(b) == b_sets)
+    failed |= check("difference", as_sets(a - b) == diff_sets(a_sets, b_sets))
+    union = dict([(run, a_sets.get(run, set()) | b_sets.get(run, set())) for run in set(a_sets) | set(b_sets)])
+    failed |= check("union", as_sets(a | b) == union)
+    intersection = dict([(run, a_sets[run] & b_sets[run]) for run in set(a_sets) & set(b_sets) if a_sets[run] & b_sets[run]])
+    failed |= check("intersection", as_sets(a & b) == intersection)
+    failed |= check("count", len(a) == sum(map(len, a_sets.values())))
+    run, lumis = sorted(b_sets.items())[0]
+    failed |= check("membership", all([((run, l) in b) == (l in lumis) for l in range(1, 5001)]))
+    failed |= check("lumi-mask json", LumiMask.from_json(a.to_json()) == a)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--lumis', help='number of lumis of the datasets', default=2000000, type=int)
+    parser.add_option('--mode', help=optparse.SUPPRESS_HELP, default=None)
+    (options, args) = parser.parse_args()
+
+    if options.mode:
+        measure(options.lumis, options.mode)
+        sys.exit(0)
+    ## each in its own process, for a clean peak RSS
+    for mode in ['sets', 'mask']:
+        subprocess.call([sys.executable, os.path.abspath(__file__), '--lumis', str(options.lumis), '--mode', mode])
+    sys.exit(1 if compare(min(options.lumis, 200000)) else 0)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+    Requests fetched in detail, and bytes read from ReqMgr, by utils.reqmgrSnapshot over the cycles of the
+    modules, against a stand-in of ReqMgr2 of which --changed requests per cycle move to another status,
+    change priority or are new, with the snapshot collections in mongomock as when replaying a cassette.
+    Compared with the former getWorkflows in detail of every status at every cycle.
+    Checks that the snapshot serves the same requests as ReqMgr, that only the changed ones are fetched,
+    that another module within max_age does not list the status again, and that a request changed from
+    here is served as it is at once after forget. Exits with an error otherwise :
+      python bench/reqmgr_snapshot.py --requests 2000 --changed 50 --cycles 5
+"""
+import json
+import optparse
+import os
+import random
+import sys
+import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mongomock
+import utils
+from benchUtils import check, fakeConnection
+
+
+class fakeReqMgr(object):
+    """
+    the requests of ReqMgr2, answering the queries of getWorkflows and getWorkflowsByName
+    """
+    def __init__(self, n_requests, payload=5000):
+        self.rand = random.Random(1)
+        self.payload = payload
+        self.requests = {}
+        self.detailed = 0
+        self.bytes = 0
+        self.tick = 0
+        for i in range(n_requests):
+            self.new( self.rand.choice(STATUSES) )
+
+    def new(self, status):
+        name = 'pdmvserv_task_B2G-RunIISummer20UL18wmLHEGEN-%05d__v1_T_201017_000000_%04d'%(len(self.requests), len(self.requests) % 10000)
+        self.requests[name] = {'RequestName' : name, 'RequestStatus' : status, 'RequestPriority' : 85000,
+                               'RequestTransition' : [{'Status' : status, 'UpdateTime' : self.tick}],
+                               'Payload' : 'x' * self.payload}
+        return name
+
+    def move(self, name, status):
+        self.tick += 1
+        self.requests[name]['RequestStatus'] = status
+        self.requests[name]['RequestTransition'].append({'Status' : status, 'UpdateTime' : self.tick})
+
+    def mutate(self, n_changed):
+        for name in self.rand.sample(sorted(self.requests), n_changed):
+            kind = self.rand.random()
+            if kind < 0.4:
+                self.move( name, self.rand.choice(STATUSES) )
+            elif kind < 0.8:
+                self.requests[name]['RequestPriority'] += 1
+            else:
+                self.new( self.rand.choice(STATUSES) )
+
+    def with_status(self, status):
+        return dict([(n, r) for n, r in self.requests.items() if r['RequestStatus'] == status])
+
+    def answer(self, go_to):
+        query = urlparse.parse_qs( urlparse.urlparse( go_to ).query )
+        if 'name' in query:
+            found = dict([(n, self.requests[n]) for n in query['name'] if n in self.requests])
+        else:
+            found = self.with_status( query['status'][0] )
+        if 'mask' in query:
+            found = dict([(n, dict([(k, r[k]) for k in query['mask'] if k in r])) for n, r in found.items()])
+        elif query.get('detail') == ['true']:
+            self.detailed += len(found)
+        else:
+            return json.dumps({'result' : sorted(found)})
+        return json.dumps({'result' : [found]})
+
+
+class reqmgrConnection(fakeConnection):
+    reqmgr = None
+    def answer(self, method, go_to, body):
+        answer = reqmgrConnection.reqmgr.answer( go_to )
+        reqmgrConnection.reqmgr.bytes += len(answer)
+        return answer
+
+
+STATUSES = ['assignment-approved', 'running-open', 'running-closed', 'completed', 'closed-out']
+
+
+def measure(reqmgr, fn):
+    detailed, read = reqmgr.detailed, reqmgr.bytes
+    r = fn()
+    return r, reqmgr.detailed - detailed, reqmgr.bytes - read
+
+
+def same(served, reqmgr, status):
+    return sorted(served, key = lambda r : r['RequestName']) == sorted(reqmgr.with_status( status ).values(), key = lambda r : r['RequestName'])
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--requests', help='number of requests in ReqMgr', default=2000, type=int)
+    parser.add_option('--changed', help='number of requests changed per cycle', default=50, type=int)
+    parser.add_option('--cycles', help='number of cycles', default=5, type=int)
+    (options, args) = parser.parse_args()
+
+    client = mongomock.MongoClient()
+    utils.mongo_client = lambda : client
+    utils.make_x509_conn = lambda url=utils.reqmgr_url, max_try=5 : reqmgrConnection()
+    reqmgr = reqmgrConnection.reqmgr = fakeReqMgr(options.requests)
+    snapshot = utils.reqmgrSnapshot( max_age = 0 )
+
+    failed = False
+    for cycle in range(options.cycles):
+        if cycle:
+            reqmgr.mutate( options.changed )
+        detailed = read = former_detailed = former_read = 0
+        ok = True
+        for status in STATUSES:
+            served, d, b = measure(reqmgr, lambda : snapshot.get( status ))
+            _, fd, fb = measure(reqmgr, lambda : utils.getWorkflows(utils.reqmgr_url, status, details=True))
+            ok &= same(served, reqmgr, status)
+            detailed, read, former_detailed, former_read = detailed + d, read + b, former_detailed + fd, former_read + fb
+        print "cycle %d : %5d requests in detail, %8.1f [kB] read, against %5d in detail, %8.1f [kB] read"%(
+            cycle, detailed, read / 1024., former_detailed, former_read / 1024.)
+        failed |= check("cycle %d : same requests as ReqMgr"%cycle, ok)
+        failed |= check("cycle %d : only the changed requests fetched"%cycle, detailed <= (len(reqmgr.requests) if cycle == 0 else options.changed))
+
+    ## another module, or host, within max_age
+    status = STATUSES[0]
+    served, d, b = measure(reqmgr, lambda : utils.getWorkflows(utils.reqmgr_url, status, details=True, snapshot=True))
+    failed |= check("another module within max_age reads the snapshot only", same(served, reqmgr, status) and b == 0)
+
+    ## a request moved from here, to a status listed less than max_age ago
+    snapshot = utils.reqmgrSnapshot()
+    name = sorted(reqmgr.with_status( status ))[0]
+    reqmgr.move( name, STATUSES[1] )
+    snapshot.forget( name, STATUSES[1] )
+    failed |= check("forgotten request out of its former status", same(snapshot.get( status ), reqmgr, status))
+    failed |= check("forgotten request in its new status", same(snapshot.get( STATUSES[1] ), reqmgr, STATUSES[1]))
+    sys.exit(1 if failed else 0)
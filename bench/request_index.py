@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+    Cost of ranking and looking up workflows in a cycle, with the former linear scans
+    over the getWorkflows list and with utils.RequestIndex, on synthetic requests :
+      python bench/request_index.py --requests 20000
+"""
+import optparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import RequestIndex
+
+
+def synthetic(n):
+    requests = []
+    for i in range(n):
+        campaign = 'Campaign%d'%(i%50)
+        requests.append({'RequestName' : 'pdmvserv_task_%s-%05d_%d'%(campaign, i, i),
+                         'RequestType' : random.choice(['TaskChain','StepChain','ReReco']),
+                         'RequestStatus' : random.choice(['running-open','running-closed']),
+                         'RequestPriority' : random.randint(1, 500000),
+                         'PrepID' : '%s-%05d'%(campaign, i),
+                         'Campaign' : campaign,
+                         'OutputDatasets' : ['/Primary%d/%s-v1/AODSIM'%(i, campaign)]})
+    return requests
+
+
+def timed(label, fn):
+    start = time.time()
+    fn()
+    print "%-40s %8.3f [s]"%(label, time.time() - start)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--requests', help='number of synthetic requests', default=20000, type=int)
+    parser.add_option('--lookups', help='number of workflows looked up', default=2000, type=int)
+    (options, args) = parser.parse_args()
+
+    random.seed(1)
+    requests = synthetic(options.requests)
+    names = [r['RequestName'] for r in random.sample(requests, min(options.lookups, len(requests)))]
+    print len(requests), "requests", len(names), "workflows"
+
+    def scan_lookup():
+        for name in names:
+            filter(lambda d : d['RequestName']==name, requests)
+    def scan_rank():
+        cache = [r['RequestName'] for r in sorted(requests, key = lambda r : r['RequestPriority'])]
+        def rank( wfn ):
+            return cache.index( wfn ) if wfn in cache else 0
+        sorted(names, key = rank, reverse=True)
+
+    index = RequestIndex( requests )
+    def index_lookup():
+        for name in names:
+            index.get( name )
+    def index_rank():
+        sorted(names, key = index.rank, reverse=True)
+
+    timed("build index", lambda : RequestIndex( requests ).rank(names[0]))
+    timed("lookup, linear scan", scan_lookup)
+    timed("lookup, index", index_lookup)
+    timed("rank, list.index", scan_rank)
+    timed("rank, index", index_rank)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+    Runs one Unified module cycle against a cassette (see cassette.py) and reports
+    the wall time, the number of calls per service and the peak RSS.
+    Record a cassette once against the live services :
+      python bench/run_cycle.py --record --cassette checkor.json.gz checkor.py
+    then replay it as many times as needed :
+      python bench/run_cycle.py --cassette checkor.json.gz --latency 50 checkor.py
+    A module given with its path is run as it is, for the synthetic cycle of bench/cassettes :
+      python bench/run_cycle.py --cassette bench/cassettes/campaign.json.gz bench/cassettes/campaign_cycle.py
+"""
+import optparse
+import os
+import resource
+import runpy
+import sys
+import time
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] module.py [module arguments]")
+    parser.disable_interspersed_args()
+    parser.add_option('--cassette', help='the cassette file', default='cassette.json.gz')
+    parser.add_option('--record', help='record instead of replaying', default=False, action='store_true')
+    parser.add_option('--latency', help='latency in [ms] added to each replayed call', default=0, type=float)
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("a module to run is needed")
+
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.environ['UNIFIED_CASSETTE'] = os.path.abspath( options.cassette )
+    os.environ['UNIFIED_CASSETTE_MODE'] = 'record' if options.record else 'replay'
+    os.environ['UNIFIED_CASSETTE_LATENCY'] = str(options.latency)
+
+    module = os.path.abspath(args[0]) if os.path.sep in args[0] else os.path.join(base, 'Unified', args[0])
+    ## the modules are run from the top directory, with the Unified one in the path
+    os.chdir( base )
+    sys.path.insert(0, os.path.join(base, 'Unified'))
+    sys.argv = [module] + args[1:]
+
+    start = time.time()
+    status = 0
+    try:
+        runpy.run_path( module, run_name = '__main__')
+    except SystemExit as e:
+        status = e.code
+    wall = time.time() - start
+
+    import cassette
+    c = cassette.active()
+    print "=" * 40
+    print "module       :", args[0], "exit", status
+    print "mode         :", c.mode if c else None
+    print "wall time    : %.2f [s]" % wall
+    for service, n in sorted((c.counts() if c else {}).items()):
+        print "calls %-7s: %d" % (service, n)
+    print "peak RSS     : %.1f [MB]" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
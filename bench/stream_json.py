@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+    Parse time and peak RSS of a synthetic wmstats requestcache document,
+    decoded whole with json.loads and streamed with utils.jsonResultStream keeping a few fields.
+    Checks first, on a small document read by chunks down to a byte, that the stream yields the same
+    (name, projected document) pairs as json.loads, escaped strings and numbers split across chunks
+    included. Exits with an error otherwise :
+      python bench/stream_json.py --size 200
+"""
+import StringIO
+import collections
+import json
+import optparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from benchUtils import check
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base)
+
+FIELDS = ['RequestName', 'RequestStatus', 'RequestPriority', 'Campaign', 'OutputDatasets', 'RequestTransition']
+
+
+def synthetic(path, size_mb):
+    ## requests of about 50 kB, with a bulky AgentJobInfo as in the real requestcache
+    out = open(path, 'w')
+    out.write('{"result": [{')
+    written = 0
+    i = 0
+    while written < size_mb * 1024 * 1024:
+        name = 'pdmvserv_task_Campaign%d-%05d_%d'%(i%50, i, i)
+        doc = {'RequestName' : name,
+               'RequestStatus' : random.choice(['running-open','running-closed']),
+               'RequestPriority' : random.randint(1, 500000),
+               'Campaign' : 'Campaign%d'%(i%50),
+               'OutputDatasets' : ['/Primary%d/Campaign%d-v1/AODSIM'%(i, i%50)],
+               'RequestTransition' : [{'Status' : 'new', 'UpdateTime' : 1500000000 + i}],
+               'AgentJobInfo' : dict([('agent%d.cern.ch'%a, {'tasks' : dict([('/%s/Task%d'%(name, t), {'sites' : dict([('T2_XX_Site%d'%s, {'success' : s, 'failure' : t}) for s in range(20)])}) for t in range(5)])}) for a in range(3)])}
+        chunk = '%s%s: %s'%(',' if i else '', json.dumps(name), json.dumps(doc))
+        out.write( chunk )
+        written += len(chunk)
+        i += 1
+    out.write('}]}')
+    out.close()
+    return i
+
+
+def small():
+    ## escaped strings, unicode and numbers of all forms, and bare numbers decoded on their own, which a chunk may cut
+    docs = collections.OrderedDict()
+    for i in range(5):
+        name = u'pdmvserv_task_Escaped%d_"quoted"_\\_\u00e9_%d'%(i, i)
+        docs[name] = collections.OrderedDict([('RequestName', name),
+                                              ('AgentJobInfo', {'agent"%d"'%i : [1.5e-7, -0.0, 10**12, {'}' : ']', '{' : '['}]}),
+                                              ('RequestStatus', 'running-open\n\t"new"\\' if i%2 else u'running-closed \u2713'),
+                                              ('Campaign', 'Campaign%d/\u005c'%i),
+                                              ('OutputDatasets', ['/Primary%d/C-v1/AODSIM'%i] * i),
+                                              ('RequestTransition', [{'Status' : 'new', 'UpdateTime' : 1500000000.125 + i}]),
+                                              ('RequestPriority', -123456789 * (i+1) if i%2 else 98765.4321e3 * i)])
+    return '{"count" : 123456789, "other" : {"result" : [1, 2.5]}, "result": [%s, {}, {"bare" : -98765.4321e-2}], "after" : -1e10}'%(json.dumps(docs))
+
+
+def same_pairs(text, fields, chunk_size):
+    from utils import jsonResultStream
+    loaded = json.loads(text, object_pairs_hook = collections.OrderedDict)['result']
+    expected = [(name, dict([(k, doc[k]) for k in fields if k in doc]) if fields and isinstance(doc, dict) else doc)
+                for part in loaded for name, doc in part.items()]
+    return list(jsonResultStream(StringIO.StringIO(text), fields, chunk_size = chunk_size)) == expected
+
+
+def parse(path, mode):
+    from utils import jsonResultStream
+    start = time.time()
+    if mode == 'loads':
+        n = len(json.loads(open(path).read())['result'][0])
+    else:
+        n = len(dict(jsonResultStream(open(path), FIELDS)))
+    print "%-8s %6d requests %8.2f [s] peak RSS %8.1f [MB]"%(mode, n, time.time() - start,
+                                                            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--size', help='size of the document in [MB]', default=200, type=int)
+    parser.add_option('--file', help='where to write the document', default='/tmp/requestcache.json')
+    parser.add_option('--parse', help=optparse.SUPPRESS_HELP, default=None)
+    (options, args) = parser.parse_args()
+
+    if options.parse:
+        parse(options.file, options.parse)
+        sys.exit(0)
+
+    text = small()
+    failed = False
+    for chunk_size in [1, 2, 3, 7, 64, 1<<20]:
+        failed |= check("same pairs as json.loads, chunks of %d bytes"%chunk_size, same_pairs(text, FIELDS, chunk_size))
+    failed |= check("same documents without fields, chunks of 1 byte", same_pairs(text, None, 1))
+    failed |= check("empty result", same_pairs('{"result": []}', FIELDS, 1) and same_pairs('{"result" : [ { } ] }', FIELDS, 1))
+
+    random.seed(1)
+    n = synthetic(options.file, options.size)
+    print n, "requests in", options.file, "%.1f [MB]"%(os.path.getsize(options.file) / 1024. / 1024.)
+    ## each in its own process, for a clean peak RSS
+    for mode in ['loads', 'stream']:
+        subprocess.call([sys.executable, os.path.abspath(__file__), '--file', options.file, '--parse', mode])
+    os.remove(options.file)
+    sys.exit(1 if failed else 0)
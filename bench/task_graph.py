@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+    Construction time and peak RSS of the task information of a batch of synthetic TaskChain specs,
+    unpickling the full spec and loading the json task graph extracted by utils.specTaskGraph.
+    Checks first that workflowInfo walking the task graph through taskSection reads the same splitting,
+    output modules, config ids and pileup as walking the pickled spec, without loading the spec, and that
+    what the graph lacks is read from the full spec, loaded then. Exits with an error otherwise :
+      python bench/task_graph.py --specs 50 --tasks 10
+"""
+import json
+import optparse
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from benchUtils import check
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base)
+
+
+class section(object):
+    """
+    stands for the WMCore ConfigSection of the spec
+    """
+    def __init__(self, name, **settings):
+        self._internal_name = name
+        self._internal_settings = []
+        for k, v in settings.items():
+            self.set(k, v)
+
+    def set(self, k, v):
+        setattr(self, k, v)
+        self._internal_settings.append(k)
+
+    def dictionary_(self):
+        return dict([(k, getattr(self, k)) for k in self._internal_settings])
+
+
+def synthetic(name, n_tasks, config_kb):
+    tasks = section('tasks', tasklist=[])
+    parent = None
+    for i in range(n_tasks):
+        tname = 'Task%d'%i
+        path = (parent.pathName if parent else '/%s'%name) + '/' + tname
+        om = 'AODSIMoutput'
+        t = section(tname,
+                    pathName=path,
+                    taskType='Production' if i == 0 else 'Processing',
+                    prepID='CMP-Campaign-%05d'%i,
+                    input=section('input', splitting=section('splitting', algorithm='EventAwareLumiBased', events_per_job=1000, events_per_lumi=100)),
+                    subscriptions=section('subscriptions', outputModules=[om]),
+                    steps=section('steps', cmsRun1=section('cmsRun1',
+                                                           application=section('application', configuration=section('configuration', configId='%032x'%i, psetTweak='x'*config_kb*1024)),
+                                                           pileup=section('pileup', mc=section('mc', dataset=['/MinBias/Campaign-v1/GEN-SIM'])))),
+                    tree=section('tree', childNames=[], children=section('children')))
+        t.subscriptions.set(om, section(om, dataset='/Primary/Campaign-%s-v1/AODSIM'%tname))
+        if parent:
+            parent.tree.childNames.append(tname)
+            parent.tree.children.set(tname, t)
+        else:
+            tasks.tasklist.append(tname)
+            tasks.set(tname, t)
+        parent = t
+    return section(name, tasks=tasks)
+
+
+def walk(tasks):
+    ## what getOutputPerTask and getSplittings read
+    n = 0
+    for t in tasks:
+        n += len(t.subscriptions.outputModules) + t.input.splitting.events_per_job
+        for child in t.tree.childNames:
+            n += walk([getattr(t.tree.children, child)])
+    return n
+
+
+def outputs(spec):
+    ## all but the output of the last task, as when an output is not kept
+    tasks = []
+    t = getattr(spec.tasks, spec.tasks.tasklist[0])
+    while t:
+        tasks.append( t )
+        t = getattr(t.tree.children, t.tree.childNames[0]) if t.tree.childNames else None
+    return [getattr(t.subscriptions, om).dataset for t in tasks[:-1] for om in t.subscriptions.outputModules]
+
+
+def counted(spec, graph):
+    """
+    a workflowInfo over the given spec, and task graph if any, counting the loads of the full spec
+    """
+    import utils
+    class countedInfo(utils.workflowInfo):
+        __slots__ = ['spec', 'loads']
+        def get_spec(self):
+            self.loads += 1
+            return self.spec
+    class formerInfo(countedInfo):
+        ## walking the tasks of the unpickled spec, as before the task graph
+        __slots__ = []
+        def _tasks(self):
+            return self.get_spec().tasks.tasklist
+        def _taskNode(self, task):
+            return getattr(self.get_spec().tasks, task)
+    name = spec._internal_name
+    wfi = (countedInfo if graph else formerInfo)('https://cmsweb.cern.ch', name,
+                                                 request = {'RequestName' : name, 'RequestType' : 'TaskChain', 'OutputDatasets' : outputs(spec)})
+    wfi.spec = spec
+    wfi.loads = 0
+    wfi.task_graph = graph
+    return wfi
+
+
+def read(wfi):
+    return {'splittings' : wfi.getSplittings(),
+            'outputs' : wfi.getOutputPerTask(),
+            'config ids' : wfi.getConfigCacheID(),
+            'pileup' : [(t.pathName, t.steps.cmsRun1.pileup.mc.dataset, sorted(t.steps.cmsRun1.pileup.dictionary_())) for t in wfi.getAllTasks()],
+            'types' : [(t._internal_name, t.taskType, t.prepID) for t in wfi.getAllTasks(select={'taskType' : 'Processing'})]}
+
+
+def construct(directory, mode):
+    from utils import taskSection
+    start = time.time()
+    ## kept, as the workflowInfo objects of a module cycle
+    kept = []
+    for fn in sorted(os.listdir(directory)):
+        if not fn.endswith('.' + mode): continue
+        if mode == 'pickle':
+            spec = pickle.loads(open(os.path.join(directory, fn)).read())
+            walk([getattr(spec.tasks, t) for t in spec.tasks.tasklist])
+            kept.append(spec)
+        else:
+            graph = json.loads(open(os.path.join(directory, fn)).read())
+            walk([taskSection(graph['tasks'][t]) for t in graph['tasklist']])
+            kept.append(graph)
+    print "%-8s %8.2f [s] peak RSS %8.1f [MB]"%(mode, time.time() - start,
+                                                 resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--specs', help='number of specs', default=50, type=int)
+    parser.add_option('--tasks', help='number of tasks per spec', default=10, type=int)
+    parser.add_option('--config', help='size of the configuration of a task in [kB]', default=500, type=int)
+    parser.add_option('--construct', help=optparse.SUPPRESS_HELP, default=None)
+    parser.add_option('--dir', help=optparse.SUPPRESS_HELP, default=None)
+    (options, args) = parser.parse_args()
+
+    if options.construct:
+        construct(options.dir, options.construct)
+        sys.exit(0)
+
+    from utils import specTaskGraph
+    spec = synthetic('wf', options.tasks, 1)
+    ## through json, as the graph is read from the artifact cache
+    graph = json.loads(json.dumps(specTaskGraph( pickle.loads(pickle.dumps(spec)) )))
+    former = counted(spec, None)
+    current = counted(spec, graph)
+    expected, got = read(former), read(current)
+    failed = False
+    for what in sorted(expected):
+        failed |= check("same %s from the task graph"%what, got[what] == expected[what])
+    failed |= check("spec not loaded for the task graph", current.loads == 0)
+    ## the configuration is not in the graph
+    tweaks = [t.steps.cmsRun1.application.configuration.psetTweak for t in current.getAllTasks()]
+    failed |= check("fallback to the full spec", current.loads > 0 and
+                    tweaks == [t.steps.cmsRun1.application.configuration.psetTweak for t in former.getAllTasks()])
+    try:
+        current.getAllTasks()[0].notInTheSpec
+        failed |= check("missing in the spec too", False)
+    except AttributeError:
+        failed |= check("missing in the spec too", True)
+
+    directory = tempfile.mkdtemp()
+    for i in range(options.specs):
+        spec = synthetic('wf%d'%i, options.tasks, options.config)
+        open(os.path.join(directory, 'wf%d.pickle'%i), 'w').write(pickle.dumps(spec))
+        open(os.path.join(directory, 'wf%d.json'%i), 'w').write(json.dumps(specTaskGraph(spec)))
+    ## each in its own process, for a clean peak RSS
+    for mode in ['pickle', 'json']:
+        subprocess.call([sys.executable, os.path.abspath(__file__), '--dir', directory, '--construct', mode])
+    for fn in os.listdir(directory):
+        os.remove(os.path.join(directory, fn))
+    os.rmdir(directory)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+    Compute time of the performance of tasks from synthetic gwmsmon histograms, one task at a time
+    as the former equalizor.getPerf did (without its printouts), and for all tasks at once with
+    taskPerformance.performances ; exits with an error if any task gets different values :
+      python bench/task_performance.py --tasks 2000
+"""
+import optparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base)
+
+
+def synthetic(n_memory, n_cores):
+    cores = sorted(random.sample([1,2,4,8,16], n_cores))
+    memory = {'aggregations' : {'2' : {'buckets' : []}}}
+    for m in sorted(random.sample(range(200, 8000, 50), n_memory)):
+        memory['aggregations']['2']['buckets'].append( {'key' : m, '3' : {'buckets' : [{'key' : c, 'doc_count' : random.randint(0, 500)} for c in cores]}})
+    io = {'aggregations' : {'2' : {'buckets' : [{'InputGB' : {'value' : 100.}, 'RequestCpus' : {'buckets' : [
+        {'key' : c, 'InputGB' : {'value' : random.uniform(1, 1000)}, 'CoreHr' : {'value' : random.uniform(1, 100)}} for c in cores]}}]}}}
+    p = random.uniform(1, 50)
+    timing = {'aggregations' : {'2' : {'values' : {'95.0' : p, '99.0' : p*random.choice([1.5, 3])}}}, 'hits' : {'total' : random.randint(0, 2000)}}
+    return {'memory' : memory, 'io' : io, 'time' : timing}
+
+
+def former(h, stats_to_go, original_ncore=1):
+    io_data = h['io']
+    read_need = None
+    binned_io = defaultdict( lambda : defaultdict(float))
+    denom = 'CoreHr'
+    if io_data and 'aggregations' in io_data and io_data["aggregations"]["2"]["buckets"]:
+        buckets = io_data["aggregations"]["2"]["buckets"][0].get('RequestCpus',{}).get('buckets',[])
+        for bucket in buckets:
+            ncore = bucket['key']
+            igb = bucket.get('InputGB',{}).get('value',0)
+            d = bucket.get(denom,{}).get('value',0)
+            if d:
+                binned_io[ncore] = (igb *1024.*1024.) / (d*60*60)
+    if binned_io:
+        read_need = int(max([ v for k,v in binned_io.items()]))
+
+    perf_data = h['memory']
+    inflate_memory = 1.2
+    binned_memory = defaultdict( lambda : defaultdict(float))
+    buckets = filter(lambda i:i['key']!=0,perf_data['aggregations']["2"]["buckets"]) if 'aggregations' in perf_data else []
+    for bucket in buckets:
+        sub_buckets = filter(lambda i:i['key']!=0, bucket["3"]["buckets"])
+        for sub_bucket in sub_buckets:
+            memory = int(float(bucket["key"])*inflate_memory)
+            ncore = int(sub_bucket["key"])
+            binned_memory[ncore][memory] += sub_bucket["doc_count"]
+
+    def weighted_percentile( values , bins , percentile):
+        cumsum = [ sum(values[:i+1]) for i in range(len(values)) ]
+        above = (cumsum[-1]*percentile/100.)
+        index = 0
+        for i in range(len(cumsum)):
+            if cumsum[i]>above:
+                index=i
+                break
+        if index==0: return bins[index]
+        x1=bins[index-1]
+        x2=bins[index]
+        y1=cumsum[index-1]
+        y2=cumsum[index]
+        return x1+(x2-x1)/(y2-y1)*(above-y1)
+
+    percentiles = defaultdict(float)
+    for core_count in binned_memory:
+        bins = sorted(binned_memory[core_count].keys())
+        values = [binned_memory[core_count][k] for k in bins]
+        if sum(values) < stats_to_go: continue
+        if values:
+            percentiles[core_count] = weighted_percentile( values, bins, 90)
+    slopes = []
+    lever = []
+    baseline = percentiles[original_ncore] if original_ncore in percentiles else None
+    if baseline:
+        for ncore,v in percentiles.items():
+            if ncore == original_ncore: continue
+            slopes.append( (v-baseline) / float((ncore - original_ncore)) )
+            lever.append( abs(ncore - original_ncore) )
+        baseline = int(baseline)
+    slope = max(0,int(sum([l*v for (l,v) in zip(lever,slopes)])/sum(lever))) if slopes else None
+    b_m = None
+    if baseline:
+        b_m = baseline*1.1
+
+    percentile_data = h['time']
+    p_t = percentile_data['aggregations']["2"]["values"].get("95.0",None) if 'aggregations' in percentile_data else None
+    bck_p_t = percentile_data['aggregations']["2"]["values"].get("99.0",None) if 'aggregations' in percentile_data else None
+    if p_t=="NaN":p_t=None
+    if bck_p_t=="NaN":p_t=None
+    if p_t: p_t*=60.
+    if bck_p_t: bck_p_t*=60
+    w_t = percentile_data.get("hits",{}).get("total",0)
+    b_t = None
+    if w_t > stats_to_go and p_t:
+        if bck_p_t and bck_p_t > 2*p_t:
+            b_t = int(bck_p_t)
+        else:
+            b_t = int(p_t)
+    return (b_m,slope,b_t, read_need)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--tasks', help='number of tasks', default=2000, type=int)
+    parser.add_option('--bins', help='number of memory bins per task', default=60, type=int)
+    parser.add_option('--stats', help='minimum statistics', default=1000, type=int)
+    (options, args) = parser.parse_args()
+
+    import taskPerformance
+    random.seed(1)
+    histograms = dict([('wf%05d/Task'%i, synthetic(options.bins, random.randint(1,5))) for i in range(options.tasks)])
+    tasks = dict([(t, random.choice([1,2,4,8])) for t in histograms])
+
+    start = time.time()
+    expected = dict([(t, former(histograms[t], options.stats, tasks[t])) for t in tasks])
+    print "%-8s %6d tasks %8.3f [s]"%('former', len(expected), time.time() - start)
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    results = taskPerformance.performances(histograms, tasks, options.stats)
+    spent = time.time() - start
+    sys.stdout = stdout
+    print "%-8s %6d tasks %8.3f [s]"%('batch', len(results), spent)
+
+    different = [t for t in tasks if results[t] != expected[t]]
+    for t in different[:10]:
+        print t, "former", expected[t], "batch", results[t]
+    print len(different), "task(s) with different values"
+    sys.exit(1 if different else 0)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+    Wall time and peak number of threads of short I/O-like tasks run with a thread per task, as the busters
+    did, and through utils.WorkerPool. Then checks that tasks cancelled while the workers pick them up are
+    either cancelled or run, never both, that submit() blocks on the bounded queue instead of holding every
+    pending task, and that a task over its deadline is not waited for. Exits with an error otherwise :
+      python bench/worker_pool.py --tasks 2000 --threads 10
+"""
+import optparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import WorkerPool
+from benchUtils import check
+
+
+class counter(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.n = 0
+        self.peak = 0
+    def task(self, wait):
+        with self.lock:
+            self.n += 1
+            self.peak = max(self.peak, threading.active_count())
+        time.sleep( wait )
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--tasks', help='number of tasks', default=2000, type=int)
+    parser.add_option('--threads', help='number of workers', default=10, type=int)
+    parser.add_option('--wait', help='duration of a task [s]', default=0.005, type=float)
+    (options, args) = parser.parse_args()
+
+    ## a thread per task, started by chunks of the number of workers
+    c = counter()
+    start = time.time()
+    for i in range(0, options.tasks, options.threads):
+        threads = [threading.Thread(target=c.task, args=(options.wait,)) for t in range(min(options.threads, options.tasks-i))]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    print "%-8s %8.3f [s] peak %d threads"%('threads', time.time() - start, c.peak)
+
+    c = counter()
+    start = time.time()
+    pool = WorkerPool( n_threads = options.threads, label = 'bench')
+    pool.map( lambda i : c.task(options.wait), range(options.tasks))
+    pool.shutdown()
+    print "%-8s %8.3f [s] peak %d threads"%('pool', time.time() - start, c.peak)
+
+    failed = check("all the tasks ran", c.n == options.tasks)
+
+    ## cancelled while being picked up
+    ran = set()
+    lock = threading.Lock()
+    def record(i):
+        with lock:
+            ran.add( i )
+        time.sleep( options.wait/10 )
+    pool = WorkerPool( n_threads = options.threads, max_queue = 0, label = 'bench')
+    futures = pool.map( record, range(options.tasks) )
+    cancelled = set([i for i, f in enumerate(futures) if f.cancel()])
+    pool.shutdown()
+    print "%d cancelled, %d ran"%(len(cancelled), len(ran))
+    failed |= check("cancelled or run, never both", not (cancelled & ran) and len(cancelled | ran) == options.tasks)
+    failed |= check("cancelled() agrees with cancel()", all([futures[i].cancelled() == (i in cancelled) for i in range(options.tasks)]))
+
+    ## the bounded queue
+    release = threading.Event()
+    pool = WorkerPool( n_threads = 2, label = 'bench')
+    submitted = []
+    def submit():
+        for i in range(100):
+            submitted.append( pool.submit(release.wait) )
+    t = threading.Thread(target=submit)
+    t.daemon = True
+    t.start()
+    time.sleep(0.5)
+    held = len(submitted)
+    release.set()
+    t.join()
+    pool.shutdown()
+    failed |= check("submit blocks on the bounded queue (%d held for 2 workers)"%held, held <= 2 + pool.queue.maxsize + 1)
+
+    ## over the deadline
+    pool = WorkerPool( n_threads = 1, deadline = 0.2, label = 'bench')
+    stuck = threading.Event()
+    pool.submit( stuck.wait, 10 )
+    start = time.time()
+    left = pool.shutdown()
+    failed |= check("a task over its deadline is not waited for", time.time() - start < 5 and len(left) == 1)
+    stuck.set()
+    sys.exit(1 if failed else 0)
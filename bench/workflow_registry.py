@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+    Remote fetches, construction time and peak RSS of the workflowInfo of synthetic workflows,
+    built twice per cycle as checkor/closor/showError do, through utils.workflow_registry,
+    and with the former eager construction (request fetched and deep-copied each time).
+    Then checks that threads sharing the instances fetch each request once, each over its own connection,
+    and that the registry builds again what was modified or got too old. Exits with an error otherwise :
+      python bench/workflow_registry.py --workflows 5000 --threads 8
+"""
+import copy
+import json
+import optparse
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from benchUtils import check, fakeConnection
+
+base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base)
+
+
+def synthetic(name):
+    return {'RequestName' : name,
+            'RequestStatus' : 'running-open',
+            'RequestType' : 'TaskChain',
+            'RequestPriority' : 100000,
+            'RequestTransition' : [{'Status' : 'new', 'UpdateTime' : 1500000000}],
+            'OutputDatasets' : ['/Primary/Campaign-%s-v%d/AODSIM'%(name, i) for i in range(5)],
+            'Task1' : {'TaskName' : 'Task1', 'Campaign' : 'Campaign', 'ConfigCacheID' : 'x'*32, 'Memory' : 4000},
+            'SiteWhitelist' : ['T2_XX_Site%d'%i for i in range(50)]}
+
+
+class reqmgrConnection(fakeConnection):
+    """
+    answers the request queries, counting them
+    """
+    fetches = 0
+    lock = threading.Lock()
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.thread = None
+    def answer(self, method, url, body):
+        with reqmgrConnection.lock:
+            reqmgrConnection.fetches += 1
+        ## a connection is not to be used by two threads
+        self.thread = threading.current_thread()
+        name = url.split('/')[-1]
+        return json.dumps({'result' : [{name : synthetic(name)}]})
+    def getresponse(self):
+        time.sleep(self.delay)
+        if self.thread is not threading.current_thread():
+            raise Exception("connection used from another thread")
+        return fakeConnection.getresponse(self)
+
+
+def cycle(n, mode):
+    import utils
+    utils.make_x509_conn = lambda url : reqmgrConnection()
+    names = ['pdmvserv_task_wf%05d'%i for i in range(n)]
+    start = time.time()
+    kept = []
+    for step in range(2):
+        for name in names:
+            if mode == 'registry':
+                wfi = utils.workflow_registry.get('cmsweb.cern.ch', name)
+                wfi.request['RequestStatus']
+            else:
+                ## the former constructor : fetched, and deep-copied
+                wfi = utils.workflowInfo('cmsweb.cern.ch', name, request = copy.deepcopy(synthetic(name)))
+                reqmgrConnection().request('GET', '/reqmgr2/data/request/'+name)
+                wfi.request['RequestStatus']
+            kept.append( wfi )
+    print "%-9s %6d fetches %8.2f [s] peak RSS %8.1f [MB]"%(mode, reqmgrConnection.fetches, time.time() - start,
+                                                            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+
+
+def threads(n, n_threads):
+    import utils
+    utils.make_x509_conn = lambda url : reqmgrConnection(delay=0.001)
+    utils.workflow_registry.clear()
+    reqmgrConnection.fetches = 0
+    names = ['pdmvserv_task_wf%05d'%i for i in range(n)]
+    seen = {}
+    errors = []
+    def work():
+        for name in names:
+            try:
+                seen.setdefault(name, set()).add( id(utils.workflow_registry.get('cmsweb.cern.ch', name)) )
+                utils.workflow_registry.get('cmsweb.cern.ch', name).request['RequestStatus']
+            except Exception as e:
+                errors.append( e )
+    workers = [threading.Thread(target=work) for t in range(n_threads)]
+    for t in workers: t.start()
+    for t in workers: t.join()
+    failed = check("%d threads : no error"%n_threads, not errors)
+    failed |= check("%d threads : one instance per workflow"%n_threads, all([len(ids) == 1 for ids in seen.values()]))
+    failed |= check("%d threads : one fetch per workflow (%d for %d)"%(n_threads, reqmgrConnection.fetches, n), reqmgrConnection.fetches == n)
+
+    held = utils.workflow_registry.get('cmsweb.cern.ch', names[0])
+    utils.workflow_registry.forget( names[0] )
+    failed |= check("a forgotten workflow is built again", utils.workflow_registry.get('cmsweb.cern.ch', names[0]) is not held)
+    held = utils.workflow_registry.get('cmsweb.cern.ch', names[1])
+    utils.workflow_registry.built_at[('cmsweb.cern.ch', names[1])] -= utils.workflow_registry.max_age + 1
+    failed |= check("an instance older than max_age is built again", utils.workflow_registry.get('cmsweb.cern.ch', names[1]) is not held)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--workflows', help='number of workflows', default=5000, type=int)
+    parser.add_option('--threads', help='number of threads sharing the instances', default=8, type=int)
+    parser.add_option('--mode', help=optparse.SUPPRESS_HELP, default=None)
+    (options, args) = parser.parse_args()
+
+    if options.mode == 'threads':
+        sys.exit(1 if threads(min(options.workflows, 500), options.threads) else 0)
+    if options.mode:
+        cycle(options.workflows, options.mode)
+        sys.exit(0)
+    ## each in its own process, for a clean peak RSS
+    for mode in ['eager', 'registry']:
+        subprocess.call([sys.executable, os.path.abspath(__file__), '--workflows', str(options.workflows), '--mode', mode])
+    sys.exit(subprocess.call([sys.executable, os.path.abspath(__file__), '--workflows', str(options.workflows), '--threads', str(options.threads), '--mode', 'threads']))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+    Record and replay of the remote calls made by Unified, to run a module cycle offline.
+    Configured through the environment :
+      UNIFIED_CASSETTE         the gzipped json file holding the request -> response pairs
+      UNIFIED_CASSETTE_MODE    record | replay
+      UNIFIED_CASSETTE_LATENCY latency in [ms] added to each replayed call
+    The x509 https connections, the DbsApi and RucioClient calls and the mongo content are covered.
+    When recording, the module runs against a mongomock copy of the whole unified database, which is saved
+    with the cassette : the calls it answers from a cache are replayed the same, and nothing is written back.
+"""
+
+import atexit
+import base64
+import copy
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+class Cassette(object):
+    def __init__(self, path, mode, latency=0):
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.entries = defaultdict(list)
+        self.served = defaultdict(int)
+        self.calls = defaultdict(int)
+        self.mongo = {}
+        self.mongo_indexes = {}
+        self.mongo_client = None
+        if self.mode == 'replay':
+            self.load()
+
+    def _key(self, service, call):
+        return json.dumps([service, call], sort_keys=True, default=str)
+
+    def load(self):
+        content = json.loads( gzip.open( self.path ).read() )
+        for key, responses in content['entries'].items():
+            self.entries[key] = responses
+        self.mongo = content.get('mongo', {})
+        self.mongo_indexes = content.get('mongo_indexes', {})
+
+    def save(self):
+        with self.lock:
+            content = {'entries' : dict(self.entries),
+                       'mongo' : self.mongo,
+                       'mongo_indexes' : self.mongo_indexes}
+            f = gzip.open( self.path, 'wb')
+            f.write( json.dumps( content, default=str ))
+            f.close()
+
+    def record(self, service, call, response):
+        key = self._key(service, call)
+        with self.lock:
+            self.calls[service] += 1
+            self.entries[key].append( copy.deepcopy( response ))
+
+    def replay(self, service, call):
+        """
+        identical calls are answered in the order they were recorded, the last answer being repeated
+        """
+        key = self._key(service, call)
+        with self.lock:
+            self.calls[service] += 1
+            responses = self.entries.get(key)
+            if not responses:
+                raise KeyError("%s call not in cassette: %s"%(service, key))
+            i = min(self.served[key], len(responses)-1)
+            self.served[key] += 1
+        if self.latency:
+            time.sleep( self.latency / 1000. )
+        return copy.deepcopy( responses[i] )
+
+    def counts(self):
+        with self.lock:
+            return dict(self.calls)
+
+
+class cassetteResponse(object):
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.closed = False
+
+    def read(self, amt=None):
+        if amt is None:
+            body, self.body = self.body, ''
+        else:
+            body, self.body = self.body[:amt], self.body[amt:]
+        self.closed = not self.body
+        return body
+
+    def getheader(self, name, default=None):
+        return dict(self.headers).get(name.lower(), default)
+
+    def getheaders(self):
+        return self.headers
+
+    def isclosed(self):
+        return self.closed
+
+
+class cassetteConnection(object):
+    """
+    Behaves as an httplib connection, recording through the real connection or replaying from the cassette
+    """
+    def __init__(self, cassette, url, conn=None):
+        self.cassette = cassette
+        self.url = url
+        self.conn = conn
+        self.call = None
+
+    def request(self, method, url, body=None, headers={}):
+        self.call = [self.url, method, url, body]
+        if self.conn is not None:
+            self.conn.request(method, url, body, headers)
+
+    def getresponse(self):
+        if self.cassette.mode == 'replay':
+            r = self.cassette.replay('http', self.call)
+            return cassetteResponse(r['status'], r['reason'], r['headers'], base64.b64decode( r['body'] ))
+        response = self.conn.getresponse()
+        body = response.read()
+        ## any payload, json or not
+        r = {'status' : response.status,
+             'reason' : response.reason,
+             'headers' : response.getheaders(),
+             'body' : base64.b64encode( body )}
+        self.cassette.record('http', self.call, r)
+        return cassetteResponse(r['status'], r['reason'], r['headers'], body)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def wrap_api(cls, service):
+    """
+    a class which records or replays all the method calls made on instances of cls
+    """
+    class cassetteApi(object):
+        def __init__(self, *args, **kwargs):
+            c = active()
+            self.api = None if (c and c.mode == 'replay') else cls(*args, **kwargs)
+
+        def __getattr__(self, name):
+            c = active()
+            if c is None:
+                return getattr(self.api, name)
+            def call(*args, **kwargs):
+                signature = [name, list(args), kwargs]
+                if c.mode == 'replay':
+                    return c.replay(service, signature)
+                response = getattr(self.api, name)(*args, **kwargs)
+                if hasattr(response, 'next'):
+                    response = list(response)
+                c.record(service, signature, response)
+                return response
+            return call
+    cassetteApi.__name__ = cls.__name__
+    return cassetteApi
+
+
+def connection(url, factory):
+    c = active()
+    if c is None:
+        return factory()
+    if c.mode == 'replay':
+        return cassetteConnection(c, url)
+    return cassetteConnection(c, url, factory())
+
+
+def _portable(doc):
+    ## the generated ids are left to mongomock
+    return dict((k,v) for k,v in doc.items() if not (k == '_id' and type(v).__name__ == 'ObjectId'))
+
+
+def _unique_indexes(collection):
+    return [info['key'] for name, info in collection.index_information().items() if info.get('unique')]
+
+
+def mongo(factory):
+    """
+    the mongo client, a mongomock one with the content of the unified database as it was when recording started
+    """
+    c = active()
+    if c is None:
+        return factory()
+    with c.lock:
+        if c.mongo_client is not None:
+            return c.mongo_client
+        import mongomock
+        if c.mode == 'record':
+            db = factory().unified
+            names = db.list_collection_names() if hasattr(db, 'list_collection_names') else db.collection_names()
+            for name in names:
+                if name.startswith('system.'): continue
+                c.mongo[name] = [_portable( d ) for d in db[name].find()]
+                c.mongo_indexes[name] = _unique_indexes( db[name] )
+        client = mongomock.MongoClient()
+        for name, docs in c.mongo.items():
+            for keys in c.mongo_indexes.get(name, []):
+                client.unified[name].create_index( [tuple(k) for k in keys], unique = True)
+            if docs: client.unified[name].insert_many( copy.deepcopy( docs ))
+        c.mongo_client = client
+        return client
+
+
+_active = []
+_active_lock = threading.Lock()
+def active():
+    with _active_lock:
+        if not _active:
+            path = os.getenv('UNIFIED_CASSETTE')
+            mode = os.getenv('UNIFIED_CASSETTE_MODE')
+            if path and mode in ['record', 'replay']:
+                c = Cassette( path, mode, latency = float(os.getenv('UNIFIED_CASSETTE_LATENCY', 0)))
+                if mode == 'record':
+                    atexit.register( c.save )
+                _active.append( c )
+            else:
+                _active.append( None )
+        return _active[0]
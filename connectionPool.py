@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+    Keep-alive pool of x509 authenticated HTTPS connections.
+    All the cmsweb helpers (utils.make_x509_conn, utils.GET, reqMgrClient, WebTools)
+    take their connections from the process-wide x509_pool, so that the threads
+    of a module cycle re-use warm TLS sessions instead of doing a full handshake
+    with the grid certificate for every single query.
+    The plain http monitoring services (gwmsmon) use the http_pool the same way.
+"""
+
+import errno
+import httplib
+import os
+import socket
+import ssl
+import threading
+import time
+from collections import defaultdict
+
+## socket errors which mean that the server dropped an idle keep-alive connection
+_STALE_ERRNOS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED, errno.EBADF)
+
+def _stale(e):
+    ## the TLS layer reports a connection closed without notice as an ssl error, and not by errno
+    if isinstance(e, ssl.SSLError):
+        return e.errno in (ssl.SSL_ERROR_EOF, ssl.SSL_ERROR_ZERO_RETURN, ssl.SSL_ERROR_SYSCALL) or 'unexpected eof' in str(e).lower()
+    return e.errno in _STALE_ERRNOS
+
+## the requests which can be sent again when the response was lost : the server may have applied any other
+_REPLAYABLE = ('GET', 'HEAD')
+
+
+class pooledConnection(object):
+    """
+    Behaves as an httplib.HTTPSConnection, hands the connection back to
+    its pool on close() or when the object goes away, and re-connects
+    transparently once if a re-used connection was dropped by the server.
+    Only GET and HEAD are sent again when the response to them was lost.
+    """
+    def __init__(self, pool, url, conn, reused):
+        self.pool = pool
+        self.url = url
+        self.conn = conn
+        self.reused = reused
+        self.last_request = None
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def _reconnect(self):
+        self.conn.close()
+        self.conn = self.pool.new_connection(self.url)
+        self.reused = False
+
+    def request(self, method, url, body=None, headers={}):
+        if self.conn is None:
+            self.conn, self.reused = self.pool.checkout(self.url)
+        self.last_request = (method, url, body, headers)
+        try:
+            self.conn.request(method, url, body, headers)
+        except (socket.error, httplib.CannotSendRequest) as e:
+            if isinstance(e, socket.error) and not _stale(e):
+                raise
+            self._reconnect()
+            self.conn.request(method, url, body, headers)
+
+    def getresponse(self, *args, **kwargs):
+        try:
+            return self.conn.getresponse(*args, **kwargs)
+        except (httplib.BadStatusLine, socket.error) as e:
+            ## only a connection taken from the pool can have gone stale
+            if not self.reused or self.last_request is None:
+                raise
+            if isinstance(e, socket.error) and not _stale(e):
+                raise
+            if self.last_request[0].upper() not in _REPLAYABLE:
+                ## the server may have applied it already : never to be sent twice
+                self.conn.close()
+                raise
+            self._reconnect()
+            self.conn.request(*self.last_request)
+            return self.conn.getresponse(*args, **kwargs)
+
+    def close(self):
+        if self.conn is not None:
+            self.pool.release(self.url, self.conn)
+            self.conn = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class x509ConnectionPool(object):
+    """
+    Thread-safe, per-host stacks of idle keep-alive connections.
+    At most max_size idle connections are kept per host,
+    and connections idle for more than max_idle seconds are dropped.
+    """
+    def __init__(self, max_size=10, max_idle=60):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = defaultdict(list)
+
+    def new_connection(self, url):
+        proxy = os.getenv('X509_USER_PROXY')
+        return httplib.HTTPSConnection(url, cert_file = proxy, key_file = proxy)
+
+    def _evict(self, url, now):
+        ## to be called with the lock held
+        stack = self.idle[url]
+        fresh = [(t, c) for (t, c) in stack if now - t < self.max_idle]
+        for (t, c) in stack:
+            if now - t >= self.max_idle:
+                c.close()
+        self.idle[url] = fresh
+        return fresh
+
+    def checkout(self, url):
+        with self.lock:
+            stack = self._evict(url, time.time())
+            if stack:
+                _, conn = stack.pop()
+                return conn, True
+        return self.new_connection(url), False
+
+    def connection(self, url):
+        conn, reused = self.checkout(url)
+        return pooledConnection(self, url, conn, reused)
+
+    def _reusable(self, conn):
+        if conn.sock is None:
+            return False
+        if getattr(conn, '_HTTPConnection__state', None) != httplib._CS_IDLE:
+            return False
+        response = getattr(conn, '_HTTPConnection__response', None)
+        return response is None or response.isclosed()
+
+    def release(self, url, conn):
+        if not self._reusable(conn):
+            ## do not close it : a response still being read owns the socket
+            return
+        with self.lock:
+            stack = self._evict(url, time.time())
+            if len(stack) < self.max_size:
+                stack.append((time.time(), conn))
+                return
+        conn.close()
+
+    def clear(self):
+        with self.lock:
+            for url, stack in self.idle.items():
+                for (t, c) in stack:
+                    c.close()
+            self.idle.clear()
+
+    def __len__(self):
+        with self.lock:
+            return sum(map(len, self.idle.values()))
+
+
+class httpConnectionPool(x509ConnectionPool):
+    """
+    Same, for plain http services which take no certificate
+    """
+    def new_connection(self, url):
+        return httplib.HTTPConnection(url)
+
+
+x509_pool = x509ConnectionPool()
+http_pool = httpConnectionPool()
@@ -11,9 +11,11 @@
 import urllib2,urllib, httplib, sys, re, os, json, datetime
 from xml.dom.minidom import getDOMImplementation
 from dbs.apis.dbsClient import DbsApi
+import cassette
+DbsApi = cassette.wrap_api(DbsApi, 'dbs')
 from collections import defaultdict
 
-from utils import aggregateListFileLumis
+from utils import aggregateListFileLumis, WorkerPool, forgetFilesContent
 
 #das_host='https://das.cern.ch'
 das_host='https://cmsweb.cern.ch'
@@ -46,63 +48,51 @@ def duplicateRunLumiFiles(dataset, verbose=False, skipInvalid=False):
     Verbose: if true prints details
     skipInvalid: if true skips invalid files, by default is False because is faster
     """  
+    return _duplicateLumiFiles(dataset, per_run=True, skipInvalid=skipInvalid, stop_early=not verbose)
+
+def _duplicateLumiFiles(dataset, per_run=True, skipInvalid=False, stop_early=False, n_threads=5):
+    """
+    fetches the lumis block by block, with n_threads in parallel, and keeps only the
+    first file of each (run, lumi) seen. With stop_early, returns at the first duplicate found.
+    Without per_run, the same lumi number in two runs counts as a duplicate.
+    """
     dbsapi = DbsApi(url=dbs3_url)
-    duplicated = False
-    #check each run
-    runs = getRunsDataset(dataset)
-    #if only one run in the list
-    if len(runs) == 1:
-        if verbose:
-            print "only one run:",runs
-        return duplicateLumiFiles(dataset, verbose, skipInvalid)
-
-    #if verbose:        print len(runs),"runs to look at"
-    lumisChecked=defaultdict(set)
-    for irun,run in enumerate(runs):
-        #if verbose:            print "Checking run",run
-        # retrieve files for that run
-        reply = dbsapi.listFiles(dataset=dataset, detail=skipInvalid,run_num=run)
-        files = [f['logical_file_name'] for f in reply]
-        if skipInvalid:
-            files = [f['logical_file_name'] for f in reply if f['is_file_valid'] == 1]
-        #if verbose: print len(files),"files in run",run," %d/%d"%(irun+1, len(runs))
-        start = 0
-        bucket = 100
-        rreply=[]
-        ## this is really retarded ...
-        #for f in files:
-        #    rreply.extend( dbsapi.listFileLumis(logical_file_name=f, run_num=run))
-        while True:
-            these = files[start:start+bucket]
-            #print run,start,"=>",start+bucket
-            if len(these)==0: break
-            #rreply.extend( dbsapi.listFileLumiArray(logical_file_name=these,run_num=run))
-            rreply.extend( aggregateListFileLumis(dbsapi.listFileLumiArray(logical_file_name=these,run_num=run)))
-            start+=bucket
-            
-        #if verbose: print len(rreply),"files with their lumi info"
-        not_found = set(files) - set([f['logical_file_name'] for f in rreply])
-        if not_found:
-            print "no lumi info for"
-            print '\n'.join( sorted(not_found))
-        #if verbose:
-        #    print len(reply),"files in the run"
-        #    print json.dumps(reply[0], indent=2)
-
-        for f in rreply:
-            lumis = f['lumi_section_num']
-            for lumi in lumis:
-                lumisChecked['%d:%d'%(run,lumi)].add( f['logical_file_name'] )
+    blocks = [b['block_name'] for b in dbsapi.listBlocks(dataset=dataset)]
 
+    def blockLumis(block):
+        return DbsApi(url=dbs3_url).listFileLumis(block_name=block, validFileOnly=int(skipInvalid))
 
-    ## reduce to those with duplicates
-    for rl in lumisChecked.keys():
-        if len(lumisChecked[rl])<=1:
-            lumisChecked.pop( rl )
+    ## all the blocks queued at once, for the loop below to start, and stop, early
+    pool = WorkerPool( n_threads = n_threads, max_queue = 0, label = 'duplicateLumiFiles')
+    futures = pool.map( blockLumis, blocks )
 
-    #print lumisChecked
-    lumisChecked = dict([(k,list(v)) for k,v in lumisChecked.iteritems()])
+    file_ids = {}
+    files = []
+    first_file = {}
+    lumisChecked = defaultdict(set)
+    try:
+        for future in futures:
+            for f in future.result():
+                logical_file_name = f['logical_file_name']
+                if not logical_file_name in file_ids:
+                    file_ids[logical_file_name] = len(files)
+                    files.append( logical_file_name )
+                fid = file_ids[logical_file_name]
+                run = f['run_num'] if per_run else 0 ## fake run number
+                lumis = f['lumi_section_num']
+                for lumi in (lumis if isinstance(lumis, list) else [lumis]):
+                    first = first_file.setdefault( (run,lumi), fid )
+                    if first != fid:
+                        lumisChecked['%d:%d'%(run,lumi)].update( [files[first], logical_file_name] )
+            if stop_early and lumisChecked:
+                break
+    finally:
+        ## nothing else to fetch, either way, also when a block could not be read
+        for future in futures:
+            future.cancel()
+        pool.shutdown( wait = False )
 
+    lumisChecked = dict([(k,list(v)) for k,v in lumisChecked.iteritems()])
     r = len(lumisChecked)!=0
     return (r,lumisChecked)
 
@@ -121,27 +111,7 @@ def duplicateLumiFiles(dataset, verbose=False, skipInvalid=False):
     Verbose: if true prints details, id "dict" it will return also the lumi -> files dictionary
     skipInvalid: if true skips invalid files, by default is False because is faster
    """
-    # initialize API to DBS3
-    dbsapi = DbsApi(url=dbs3_url)
-    duplicated = False
-    lumisChecked=defaultdict(set)
-    run = 0 ## fake run number
-    reply = dbsapi.listFiles(dataset=dataset, detail=skipInvalid)
-    for f in reply:
-        logical_file_name = f['logical_file_name']
-        #skip invalid files
-        if skipInvalid and f['is_file_valid'] != 1 :
-            continue
-        reply2 = dbsapi.listFileLumis(logical_file_name=logical_file_name)
-        #retrieve lumis for each file
-        lumis = reply2[0]['lumi_section_num']
-        #check that each lumi is only in one file
-        for lumi in lumis:
-            lumisChecked['%d:%d'%(run,lumi)].add( logical_file_name )
-
-    for rl in lumisChecked.keys():
-        if len(lumisChecked[rl])<=1:
-            lumisChecked.pop( rl )
+    r,lumisChecked = _duplicateLumiFiles(dataset, per_run=False, skipInvalid=skipInvalid, stop_early=not verbose)
 
     #return the dictionary if asked
     if verbose:
@@ -149,8 +119,6 @@ def duplicateLumiFiles(dataset, verbose=False, skipInvalid=False):
             run,lumi = rl.split(':')
             print 'Lumi',lumi,'in run',run,'is in these files'
             print '\n'.join( lumisChecked[rl] )
-    r = len(lumisChecked)!=0
-    lumisChecked = dict([(k,list(v)) for k,v in lumisChecked.iteritems()])
     return (r,lumisChecked)
 
 
@@ -189,6 +157,7 @@ def setFileStatus(files, newstatus):
     dbsapi = DbsApi(url=dbs3_url_writer)
     for f in files:
         dbsapi.updateFileStatus(logical_file_name=f, is_file_valid=newstatus)
+    forgetFilesContent( files )
 
 def setDatasetStatus(dataset, newStatus, files=True):
     """
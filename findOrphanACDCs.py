@@ -2,6 +2,7 @@
 import json
 import httplib, os
 import reqMgrClient as reqMgrClient
+from utils import couch_view
 
 """
     Filters through the list of ACDC's that are in "completed" which ones
@@ -55,20 +56,26 @@ def getAcdcs(url, requests):
     return acdcs
 
 def filterOrphanAcdc(url, acdcs):
-
+    """
+    the request documents of the acdcs, then of their original workflows,
+    each in bulk from reqmgr_workload_cache
+    """
+    all_docs = couch_view(url, '/couchdb/reqmgr_workload_cache/_all_docs', include_docs=True)
+    docs = all_docs.fetch( acdcs )
+    origins = {}
+    for wfname in acdcs:
+        for row in docs[wfname]:
+            if row.get('doc') and row['doc'].get('OriginalRequestName'):
+                origins[wfname] = row['doc']['OriginalRequestName']
+    origin_docs = all_docs.fetch( sorted(set(origins.values())) )
     orphans = []
     for wfname in acdcs:
-        acdc = reqMgrClient.Workflow(wfname)
-        origwf = None
-        #original workflow
-        if 'OriginalRequestName' in acdc.info:
-            origwf = acdc.info['OriginalRequestName']
-        elif 'OriginalRequestName' in acdc.cache:
-            origwf = acdc.cache['OriginalRequestName']
-        if origwf:
-            origwf = reqMgrClient.Workflow(origwf)
-            if origwf.status != 'completed':
-                orphans.append((origwf.name, origwf.status, acdc.name))
+        if not wfname in origins: continue
+        origwf = origins[wfname]
+        for row in origin_docs[origwf]:
+            status = row['doc'].get('RequestStatus') if row.get('doc') else None
+            if status != 'completed':
+                orphans.append((origwf, status, wfname))
     return orphans
 
 
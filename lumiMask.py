@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+    Run-keyed lumi section masks, kept as sorted, non-overlapping [start, end] ranges per run.
+    Union, difference and intersection cost O(ranges) instead of O(lumis),
+    and the content converts to and from the CMS lumi-mask json {"run" : [[start, end], ...]}.
+"""
+
+import bisect
+import json
+
+
+def _compress(lumis):
+    ranges = []
+    for lumi in sorted(set(lumis)):
+        if ranges and lumi == ranges[-1][1] + 1:
+            ranges[-1][1] = lumi
+        else:
+            ranges.append([lumi, lumi])
+    return ranges
+
+
+def _merge(ranges):
+    ## sorts and merges overlapping or adjacent ranges
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _intersect(a, b):
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start <= end:
+            out.append([start, end])
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+
+def _subtract(a, b):
+    out = []
+    j = 0
+    for start, end in a:
+        while j < len(b) and b[j][1] < start:
+            j += 1
+        k = j
+        while k < len(b) and b[k][0] <= end:
+            if b[k][0] > start:
+                out.append([start, b[k][0] - 1])
+            start = max(start, b[k][1] + 1)
+            if start > end:
+                break
+            k += 1
+        if start <= end:
+            out.append([start, end])
+    return out
+
+
+class LumiMask(object):
+    """
+    {run : [[start, end], ...]} with the ranges of each run sorted and disjoint
+    """
+    def __init__(self, ranges=None):
+        self.ranges = {}
+        self.pending = {}
+        self.n_pending = 0
+        for run, r in (ranges or {}).items():
+            r = _merge([list(x) for x in r])
+            if r:
+                self.ranges[int(run)] = r
+
+    @classmethod
+    def from_lumis(cls, lumis_per_run):
+        """
+        from {run : [lumis]}, as returned by getDatasetLumis
+        """
+        mask = cls()
+        for run, lumis in lumis_per_run.items():
+            mask.add(run, lumis)
+        return mask
+
+    @classmethod
+    def from_json(cls, content):
+        if isinstance(content, basestring):
+            content = json.loads(content)
+        return cls(content)
+
+    @classmethod
+    def from_file_lumis(cls, records):
+        """
+        streaming construction from the output of DBS listFileLumis, either
+        one lumi per record or a list of lumis per record
+        """
+        mask = cls()
+        for record in records:
+            lumis = record['lumi_section_num']
+            mask.add(record['run_num'], lumis if isinstance(lumis, list) else [lumis])
+        return mask
+
+    def add(self, run, lumis, flush_every=10000):
+        """
+        lumis are buffered and compressed into ranges by chunks, of all the runs together
+        """
+        run = int(run)
+        buffered = self.pending.setdefault(run, [])
+        buffered.extend(lumis)
+        self.n_pending += len(lumis)
+        if self.n_pending > flush_every:
+            self._flush()
+
+    def _flush(self):
+        for r, buffered in self.pending.items():
+            if buffered:
+                self.ranges[r] = _merge(self.ranges.get(r, []) + _compress(buffered))
+        self.pending = {}
+        self.n_pending = 0
+
+    def _runs(self):
+        self._flush()
+        return self.ranges
+
+    def runs(self):
+        return sorted(self._runs().keys())
+
+    def __len__(self):
+        return sum([end - start + 1 for r in self._runs().values() for (start, end) in r])
+
+    def __nonzero__(self):
+        return any(self._runs().values())
+
+    def __contains__(self, run_lumi):
+        run, lumi = map(int, run_lumi)
+        r = self._runs().get(run, [])
+        i = bisect.bisect_right(r, [lumi, float('inf')]) - 1
+        return i >= 0 and r[i][0] <= lumi <= r[i][1]
+
+    def __eq__(self, other):
+        return self._runs() == other._runs()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __or__(self, other):
+        a, b = self._runs(), other._runs()
+        out = LumiMask()
+        for run in set(a) | set(b):
+            out.ranges[run] = _merge(a.get(run, []) + b.get(run, []))
+        return out
+
+    def __and__(self, other):
+        a, b = self._runs(), other._runs()
+        out = LumiMask()
+        for run in set(a) & set(b):
+            r = _intersect(a[run], b[run])
+            if r:
+                out.ranges[run] = r
+        return out
+
+    def __sub__(self, other):
+        a, b = self._runs(), other._runs()
+        out = LumiMask()
+        for run in a:
+            r = _subtract(a[run], b[run]) if run in b else [list(x) for x in a[run]]
+            if r:
+                out.ranges[run] = r
+        return out
+
+    def lumis(self, run=None):
+        """
+        yields the (run, lumi) in order
+        """
+        content = self._runs()
+        for r in ([run] if run is not None else sorted(content)):
+            for start, end in content.get(r, []):
+                for lumi in xrange(start, end + 1):
+                    yield (r, lumi)
+
+    def lumis_per_run(self):
+        return dict([(run, [l for (_, l) in self.lumis(run)]) for run in self.runs()])
+
+    def to_json(self):
+        return dict([(str(run), [list(x) for x in r]) for run, r in sorted(self._runs().items())])
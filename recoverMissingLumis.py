@@ -9,6 +9,7 @@ from WMCore.Services.RequestDB.RequestDBReader import RequestDBReader
 from WMCore.Services.CRIC.CRIC import CRIC
 from WMCore.WMSpec.WMWorkload import WMWorkloadHelper
 from pprint import pprint
+from lumiMask import LumiMask
 
 import json
 import logging
@@ -400,43 +401,24 @@ def diffDatasets(inputDataset, outputDataset):
     but not in the output.
     """
 
-    inputRunInfo = {}
-    # make a set of input run-lumis.
-    for inputLFN in inputDataset:
-        for inputRun in inputDataset[inputLFN]["runs"]:
-            if inputRun not in inputRunInfo:
-                inputRunInfo[inputRun] = set()
+    def datasetMask(dataset):
+        mask = LumiMask()
+        for lfn in dataset:
+            for run in dataset[lfn]["runs"]:
                 # if type is list or [list]
-            if type(inputDataset[inputLFN]["runs"][inputRun][0]) is list:
-                inputRunInfo[inputRun].update(inputDataset[inputLFN]["runs"][inputRun][0])
-            elif type(inputDataset[inputLFN]["runs"][inputRun]) is list:
-                inputRunInfo[inputRun].update(inputDataset[inputLFN]["runs"][inputRun])
-            else:
-                raise RuntimeError("Don't know what this is:" + str(inputDataset[inputLFN]["runs"][inputRun]))
-
-    outputRunInfo = {}
-    # make a set of input run-lumis.
-    for outputLFN in outputDataset:
-        for outputRun in outputDataset[outputLFN]["runs"]:
-            if outputRun not in outputRunInfo:
-                outputRunInfo[outputRun] = set()
-            # if type is list or [list]
-            if type(outputDataset[outputLFN]["runs"][outputRun][0]) is list:
-                outputRunInfo[outputRun].update(outputDataset[outputLFN]["runs"][outputRun][0])
-            elif type(outputDataset[outputLFN]["runs"][outputRun]) is list:
-                outputRunInfo[outputRun].update(outputDataset[outputLFN]["runs"][outputRun])
-            else:
-                raise RuntimeError("Don't know what this is:" + str(outputDataset[outputLFN]["runs"][outputRun]))
+                if type(dataset[lfn]["runs"][run][0]) is list:
+                    mask.add(run, dataset[lfn]["runs"][run][0])
+                elif type(dataset[lfn]["runs"][run]) is list:
+                    mask.add(run, dataset[lfn]["runs"][run])
+                else:
+                    raise RuntimeError("Don't know what this is:" + str(dataset[lfn]["runs"][run]))
+        return mask
 
+    # make the range difference for each run
+    diffMask = datasetMask(inputDataset) - datasetMask(outputDataset)
     diffRunInfo = {}
-    # make set difference for each run
-    for inputRun in inputRunInfo:
-        if inputRun not in outputRunInfo:
-            diffRunInfo[inputRun] = inputRunInfo[inputRun]
-        else:
-            diffLumis = inputRunInfo[inputRun] - outputRunInfo[inputRun]
-            if diffLumis:
-                diffRunInfo[inputRun] = diffLumis
+    for run, lumis in diffMask.lumis_per_run().items():
+        diffRunInfo[run] = set(lumis)
 
     return diffRunInfo
 
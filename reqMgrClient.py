@@ -16,6 +16,8 @@ import time
 import urllib
 
 import dbs3Client as dbs3
+from connectionPool import x509_pool
+import cassette
 
 # default headers for PUT and POST methods
 def_headers={"Content-type": "application/json", "Accept": "application/json"}
@@ -336,23 +338,24 @@ def requestManagerGet(url, request, retries=4):
     request: the request suffix url
     retries: number of retries
     """
-    conn  =  httplib.HTTPSConnection(url, cert_file = CERT_FILE,
-                                            key_file = KEY_FILE)
+    conn  =  cassette.connection(url, lambda : x509_pool.connection(url))
     headers = {"Accept": "application/json"}
     r1=conn.request("GET",request, headers=headers)
     r2=conn.getresponse()
-    request = json.loads(r2.read())  
+    result = json.loads(r2.read())  
     #try until no exception
-    while 'exception' in request and retries > 0:
-        conn  =  httplib.HTTPSConnection(url, cert_file = CERT_FILE,
-                                                key_file = KEY_FILE)
+    while 'exception' in result and retries > 0:
+        ## a connection which got an error goes back to the pool only if it is still usable
+        conn.close()
+        conn  =  cassette.connection(url, lambda : x509_pool.connection(url))
         r1=conn.request("GET",request, headers=headers)
         r2=conn.getresponse()
-        request = json.loads(r2.read())
+        result = json.loads(r2.read())
         retries-=1
-    if 'exception' in request:
-        raise Exception('Maximum queries to ReqMgr exceeded',str(request))
-    return request
+    conn.close()
+    if 'exception' in result:
+        raise Exception('Maximum queries to ReqMgr exceeded',str(result))
+    return result
 
 #def _convertToRequestMgrPostCall(url, request, params, head):
 #    header = {"Content-type": "application/json", "Accept": "application/json"}
@@ -396,14 +399,27 @@ def requestManagerPost(url, request, params, head = def_headers):
     return data
 
 def _put(url, request, params, head=def_headers, encode=urllib.urlencode):
+    from utils import family_cache, dataset_versions, reqmgrSnapshot, workflow_registry
+    workflow = params.get('requestName', request.rstrip('/').split('/')[-1])
+    ## the shared workflowInfo holds the request as it was
+    workflow_registry.forget( workflow )
+    if 'RequestStatus' in params:
+        ## the families and dataset versions of the request are to be fetched again
+        family_cache.invalidate( workflow = workflow )
+        dataset_versions.forget( workflow )
+    try:
+        ## any change of the request : the snapshot is not to serve it as it was
+        reqmgrSnapshot(url).forget( workflow, status = params.get('RequestStatus'))
+    except Exception as e:
+        print "could not forget",workflow,"from the request snapshot"
+        print str(e)
     return _httpsRequest("PUT", url, request, params, head, encode)
 
 def _post(url, request, params, head=def_headers, encode=urllib.urlencode):
     return _httpsRequest("POST", url, request, params, head, encode)
 
 def _httpsRequest(verb, url, request, params, head, encode):
-    conn  =  httplib.HTTPSConnection(url, cert_file = CERT_FILE,
-                                    key_file = KEY_FILE)
+    conn  =  cassette.connection(url, lambda : x509_pool.connection(url))
     headers = head
     if encode:
         encodedParams = encode(params)
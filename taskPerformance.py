@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+    Performance of production tasks from their gwmsmon histograms (utils.gwmsmon_history), as used by
+    equalizor to tune the memory, the memory per thread, the runtime and the read rate of the jobs.
+    The weighted memory percentiles per core count, and the fit of the memory against the core count,
+    are computed with numpy for all the tasks of a batch at once.
+"""
+
+import numpy as np
+
+INFLATE_MEMORY = 1.2
+MEMORY_PERCENTILE = 90
+TIME_PERCENTILE = 95
+BACKUP_TIME_PERCENTILE = 99
+
+failed_out = (None,None,None,None)
+
+
+def read_need(io_data, denom='CoreHr'):
+    """
+    the highest read rate per core [MB/s] over the core counts, None without data
+    """
+    binned_io = {}
+    if io_data and 'aggregations' in io_data and io_data["aggregations"]["2"]["buckets"]:
+        buckets = io_data["aggregations"]["2"]["buckets"][0].get('RequestCpus',{}).get('buckets',[])
+        for bucket in buckets:
+            ncore = bucket['key']
+            igb = bucket.get('InputGB',{}).get('value',0)
+            d = bucket.get(denom,{}).get('value',0)
+            if d:
+                binned_io[ncore] = (igb *1024.*1024.) / (d*60*60) ## MB/s
+    if not binned_io:
+        return None
+    if denom == 'CoreHr':
+        per_core_io = binned_io.values()
+    else:
+        per_core_io = [ v/k for k,v in binned_io.items()]
+    return int(max( per_core_io ))
+
+
+def memory_columns(perf_data, inflate_memory=INFLATE_MEMORY):
+    """
+    the core counts, memory values and populations of the memory histogram, as flat lists
+    """
+    ncores = []
+    memories = []
+    populations = []
+    buckets = filter(lambda i:i['key']!=0,perf_data['aggregations']["2"]["buckets"]) if 'aggregations' in perf_data else [] ## fail safe on ES missing data
+    for bucket in buckets:
+        sub_buckets = [sub_bucket for sub_bucket in bucket["3"]["buckets"] if sub_bucket['key']!=0]
+        ncores.extend([sub_bucket['key'] for sub_bucket in sub_buckets])
+        populations.extend([sub_bucket['doc_count'] for sub_bucket in sub_buckets])
+        memories.extend([int(float(bucket["key"])*inflate_memory)]*len(sub_buckets))
+    return ncores, memories, populations
+
+
+def time_need(percentile_data, stats_to_go):
+    """
+    the runtime percentile [min] of the core-hours, None without enough statistics
+    """
+    ## the returned value is the commitedcorehours ~ walltime * 4
+    p_t = percentile_data['aggregations']["2"]["values"].get("%.1f"%TIME_PERCENTILE,None) if 'aggregations' in percentile_data else None
+    bck_p_t = percentile_data['aggregations']["2"]["values"].get("%.1f"%BACKUP_TIME_PERCENTILE,None) if 'aggregations' in percentile_data else None
+    if p_t=="NaN":p_t=None
+    if bck_p_t=="NaN":p_t=None
+
+    if p_t: p_t*=60. ## convert in mins
+    if bck_p_t: bck_p_t*=60 ## convert in min
+    w_t = 0
+    if "hits" in percentile_data and "total" in percentile_data["hits"]:
+        w_t = percentile_data["hits"]["total"]
+
+    if w_t > stats_to_go and p_t:
+        if bck_p_t and bck_p_t > 2*p_t:
+            return int(bck_p_t)
+        return int(p_t)
+    return None
+
+
+def weighted_percentiles(groups, bins, counts, percentile):
+    """
+    The percentile of the population counts over bins, for each group, linearly interpolated to the previous bin.
+    The arrays are sorted by group, then by bin. Returns the groups, their total population and percentile.
+    """
+    n = len(groups)
+    if not n:
+        return np.zeros(0, dtype=int), np.zeros(0), np.zeros(0)
+    starts = np.flatnonzero( np.r_[True, groups[1:] != groups[:-1]] )
+    cumsum = np.cumsum( counts )
+    ## the cumulative sum within each group
+    offsets = np.r_[0., cumsum[starts[1:]-1]]
+    sizes = np.diff( np.r_[starts, n] )
+    cumsum -= np.repeat( offsets, sizes )
+    totals = cumsum[np.r_[starts[1:], n]-1]
+    above = totals*percentile/100.
+    ## first bin above the percentile, or the first bin if there is none
+    position = np.where( cumsum > np.repeat( above, sizes ), np.arange(n), n)
+    index = np.minimum.reduceat( position, starts )
+    index = np.where( index == n, starts, index )
+    first = index == starts
+    previous = np.where( first, index, index-1 )
+    x1 = bins[previous]
+    x2 = bins[index]
+    y1 = cumsum[previous]
+    y2 = cumsum[index]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interp = x1+(x2-x1)/(y2-y1)*(above-y1)
+    return groups[starts], totals, np.where( first, x2, interp )
+
+
+def performances(histograms, tasks, stats_to_go):
+    """
+    {task : (base memory [MB], memory per thread [MB], runtime [min], read rate [MB/s])} for
+    tasks {task : original core count}, and histograms {task : {'io', 'memory', 'time'}} as from gwmsmonHistory.get
+    """
+    results = {}
+    names = []
+    columns = ([], [], [], []) ## task index, ncore, memory, population
+    for task, original_ncore in tasks.items():
+        h = histograms.get(task, {})
+        if h.get('memory') is None or h.get('time') is None:
+            results[task] = failed_out
+            continue
+        ncores, memories, populations = memory_columns( h['memory'] )
+        columns[0].extend( [len(names)]*len(ncores) )
+        columns[1].extend( ncores )
+        columns[2].extend( memories )
+        columns[3].extend( populations )
+        names.append( task )
+
+    ## memory percentiles of all the (task, core count) at once
+    i_tasks, ncores, memories = [np.array(c, dtype=np.int64) for c in columns[:3]]
+    populations = np.array(columns[3], dtype=float)
+    ## one sort key for (task, core count, memory), stable to sum up the populations of the same memory in order
+    key = (i_tasks << 40) | (ncores << 32) | memories
+    order = np.argsort( key, kind='mergesort' )
+    key = key[order]
+    distinct = np.flatnonzero( np.r_[True, key[1:] != key[:-1]] ) if len(key) else np.zeros(0, dtype=int)
+    populations = np.add.reduceat( populations[order], distinct ) if len(key) else populations
+    key = key[distinct]
+    groups = key >> 32
+    g, totals, percentiles = weighted_percentiles( groups, (key & 0xffffffff).astype(float), populations, MEMORY_PERCENTILE )
+    g_task = g >> 8
+    g_ncore = g & 0xff
+    enough = totals >= stats_to_go
+
+    ## the baseline at the original core count, and the lever-weighted slope against the others
+    original = np.array([tasks[name] for name in names], dtype=int)
+    at_original = enough & (g_ncore == original[g_task])
+    baseline = np.zeros(len(names))
+    baseline[g_task[at_original]] = percentiles[at_original]
+    others = enough & ~at_original & (baseline[g_task] != 0)
+    lever = np.abs( g_ncore[others] - original[g_task[others]] )
+    slopes = (percentiles[others] - baseline[g_task[others]]) / (g_ncore[others] - original[g_task[others]]).astype(float)
+    weighted = np.bincount( g_task[others], weights = lever*slopes, minlength=len(names))
+    levers = np.bincount( g_task[others], weights = lever, minlength=len(names))
+
+    for i_task, task in enumerate(names):
+        h = histograms[task]
+        b_m = None
+        slope = None
+        if baseline[i_task]:
+            if levers[i_task]:
+                slope = max(0,int(weighted[i_task]/levers[i_task]))
+            if int(baseline[i_task]):
+                b_m = int(baseline[i_task])*1.1 ## put 10% on top for safety
+        b_t = time_need( h['time'], stats_to_go )
+        results[task] = (b_m, slope, b_t, read_need( h['io'] ))
+        print task,"base memory",b_m,"slope",slope,"time",b_t,"read",results[task][-1]
+    return results
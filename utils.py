@@ -5,16 +5,24 @@ from dbs.apis.dbsClient import DbsApi
 import httplib
 import os
 import socket
+import errno
 import json
 import collections
 from collections import defaultdict
 import random
 import copy
 import pickle
+import cPickle
 import time
 import math
 import threading
+import Queue
 import glob
+import array
+import bisect
+import zlib
+import base64
+import hashlib
 import datetime
 import smtplib
 from email.MIMEMultipart import MIMEMultipart
@@ -23,60 +31,136 @@ from email.Utils import COMMASPACE, formatdate
 from email.utils import make_msgid
 
 from RucioClient import RucioClient
+from connectionPool import x509_pool, http_pool
+from artifactCache import artifactCache
+import cassette
+
+## record/replay of the remote calls, when configured (see cassette.py)
+DbsApi = cassette.wrap_api(DbsApi, 'dbs')
+RucioClient = cassette.wrap_api(RucioClient, 'rucio')
 
 ## add local python paths
 for p in ['/usr/lib64/python2.7/site-packages','/usr/lib/python2.7/site-packages']:
     if not p in sys.path: sys.path.append(p)
 
 
+_mongo_client = {}
+_mongo_client_lock = threading.Lock()
 def mongo_client():
+    ## one client per process, created lazily and re-created in a forked child
     import pymongo, ssl
-    return pymongo.MongoClient('mongodb://%s/?ssl=true' % mongo_db_url,
-                               ssl_cert_reqs=ssl.CERT_NONE)
+    with _mongo_client_lock:
+        if _mongo_client.get('pid') != os.getpid():
+            _mongo_client['client'] = cassette.mongo(lambda : pymongo.MongoClient('mongodb://%s/?ssl=true' % mongo_db_url,
+                                                                                  ssl_cert_reqs=ssl.CERT_NONE,
+                                                                                  connect=False))
+            _mongo_client['pid'] = os.getpid()
+        return _mongo_client['client']
+
 
+class configSnapshot:
+    """
+    Process-wide parsed content of the configuration files and of the mongo configuration.
+    A file is parsed again only when its modification time or size changes,
+    and the mongo content is reloaded after max_age seconds.
+    """
+    def __init__(self, max_age=300):
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        self.max_age = max_age
+        self.parses = 0
+
+    def load_file(self, configFile):
+        path = os.path.abspath( configFile )
+        st = os.stat( path )
+        stamp = (st.st_mtime, st.st_size)
+        with self.lock:
+            snap = self.snapshots.get( path )
+            if snap and snap['stamp'] == stamp:
+                return snap
+            configs = json.loads(open(path).read())
+            self.parses += 1
+            snap = {'stamp' : stamp,
+                    'version' : (snap['version']+1) if snap else 1,
+                    'configs' : configs}
+            self.snapshots[path] = snap
+            return snap
+
+    def load_db(self):
+        now = time.time()
+        with self.lock:
+            snap = self.snapshots.get( None )
+            if snap and (now - snap['stamp']) < self.max_age:
+                return snap
+            db = mongo_client().unified.unifiedConfiguration
+            configs = {}
+            for o in db.find():
+                o.pop("_id")
+                configs[o.pop("name")] = o
+            self.parses += 1
+            snap = {'stamp' : now,
+                    'version' : (snap['version']+1) if snap else 1,
+                    'configs' : configs}
+            self.snapshots[None] = snap
+            return snap
+
+    def clear(self):
+        with self.lock:
+            self.snapshots = {}
+
+config_snapshot = configSnapshot()
 
 class unifiedConfiguration:
+    """
+    Reads from the process-wide configSnapshot. The values returned by get are shared
+    between all instances and must not be modified ; use the typed accessors or copy them.
+    """
     def __init__(self, configFile='unifiedConfiguration.json'):
         # Explicitly set configFile to 'None' once you want to read from MongoDB
         self.configFile = configFile
-        if self.configFile is None:
-            self.configs = self.configFile
-        else:
-            try:
-                self.configs = json.loads(open(self.configFile).read())
-            except Exception as ex:
+        self.from_db = self.configFile is None
+        try:
+            if self.from_db:
+                snap = config_snapshot.load_db()
+            else:
+                snap = config_snapshot.load_file( self.configFile )
+        except Exception as ex:
+            if self.from_db:
+                print ("Could not reach pymongo.\n Exception: \n%s" % str(ex))
+            else:
                 print("Could not read configuration file: %s\nException: %s" %
                       (self.configFile, str(ex)))
-                sys.exit(124)
-
-        if self.configs is None:
-            try:
-                self.client = mongo_client()
-                self.db = self.client.unified.unifiedConfiguration
-            except Exception as ex:
-                print ("Could not reach pymongo.\n Exception: \n%s" % str(ex))
-                # self.configs = json.loads(open(self.configFile).read())
-                sys.exit(124)
+            sys.exit(124)
+        self.configs = snap['configs']
+        self.version = snap['version']
 
     def get(self, parameter):
-        if self.configs:
-            if parameter in self.configs:
-                return self.configs[parameter]['value']
-            else:
-                print parameter, 'is not defined in global configuration'
-                print ','.join(self.configs.keys()), 'possible'
-                sys.exit(124)
+        if parameter in self.configs:
+            if self.from_db:
+                return self.configs[parameter]
+            return self.configs[parameter]['value']
         else:
-            found = self.db.find_one({"name": parameter})
-            if found:
-                found.pop("_id")
-                found.pop("name")
-                return found
-            else:
-                availables = [o['name'] for o in self.db.find_one()]
-                print parameter, 'is not defined in mongo configuration'
-                print ','.join(availables), 'possible'
-                sys.exit(124)
+            print parameter, 'is not defined in %s configuration'%('mongo' if self.from_db else 'global')
+            print ','.join(self.configs.keys()), 'possible'
+            sys.exit(124)
+
+    def get_int(self, parameter):
+        return int(self.get(parameter))
+
+    def get_float(self, parameter):
+        return float(self.get(parameter))
+
+    def get_bool(self, parameter):
+        return bool(self.get(parameter))
+
+    def get_str(self, parameter):
+        return str(self.get(parameter))
+
+    def get_list(self, parameter):
+        return list(self.get(parameter))
+
+    def get_dict(self, parameter):
+        return copy.deepcopy(dict(self.get(parameter)))
 
 
 SC = unifiedConfiguration('serviceConfiguration.json')
@@ -100,6 +184,7 @@ unified_url = unified_url_eos
 url_eos = unified_url_eos
 unified_pub_url = os.getenv('UNIFIED_URL', SC.get('unified_pub_url'))
 cache_dir = SC.get('cache_dir')
+artifact_cache = artifactCache(cache_dir, budget_mb = SC.get('artifact_cache_mb'))
 
 FORMAT = "%(module)s.%(funcName)s(%(lineno)s) => %(message)s (%(asctime)s)"
 DATEFMT = "%Y-%m-%d %H:%M:%S"
@@ -149,12 +234,15 @@ def _searchLog( q, actor, limit, conn, prefix, h = None):
     hits =  o['hits']['hits']
     return hits
 
+_es_header = {}
 def es_header():
-    entrypointname,password = open('Unified/secret_es.txt').readline().split(':')
-    import base64
-    auth = base64.encodestring(('%s:%s' % (entrypointname, password)).replace('\n', '')).replace('\n', '')
-    header = { "Authorization":  "Basic %s"% auth, "Content-Type": "application/json"}
-    return header
+    ## the secret is read once per process
+    if not _es_header:
+        entrypointname,password = open('Unified/secret_es.txt').readline().split(':')
+        import base64
+        auth = base64.encodestring(('%s:%s' % (entrypointname, password)).replace('\n', '')).replace('\n', '')
+        _es_header.update({ "Authorization":  "Basic %s"% auth, "Content-Type": "application/json"})
+    return dict(_es_header)
 
 def new_sendLog( subject, text , wfi = None, show=True, level='info'):
     conn = httplib.HTTPSConnection( 'es-unified7.cern.ch' )
@@ -209,13 +297,239 @@ def new_sendLog( subject, text , wfi = None, show=True, level='info'):
 
     _try_sendLog( subject, text, wfi, show, level, conn = conn, prefix='/es/unified-logs', h = es_header())
 
+class logShipper(threading.Thread):
+    """
+    Collects the log documents in memory and ships them in batches to the _bulk api of elastic search,
+    from a background thread, every batch_size documents or every flush_every seconds.
+    Documents that cannot be delivered are spooled to a local file of the process, and replayed at the next
+    successful flush, together with the spool files left behind by the processes of the host that are gone.
+    The spool keeps the newest max_spool_mb of documents. Documents refused by elastic search itself, which
+    would be refused again, go to the es_log_rejected.json dead-letter file instead, of at most max_spool_mb too.
+    """
+    def __init__(self, host='es-unified7.cern.ch', prefix='/es/unified-logs', batch_size=100, flush_every=10, spool_dir=None, header=None, max_spool_mb=50):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.host = host
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.spool_dir = spool_dir if spool_dir else cache_dir
+        self.header = header
+        self.max_spool = int(max_spool_mb*1024*1024)
+        self.docs = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.conn = None
+        self.sent = 0
+        self.bulks = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def add(self, doc):
+        with self.lock:
+            self.docs.append( doc )
+            n = len(self.docs)
+        if n >= self.batch_size:
+            self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait( self.flush_every )
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print "failed to flush the logs to elastic search"
+                print str(e)
+
+    def _headers(self):
+        h = dict(self.header) if self.header is not None else es_header()
+        h["Content-Type"] = "application/x-ndjson"
+        return h
+
+    def _bulk(self, docs):
+        """
+        (retry, rejected) : the documents to send again, all of them when elastic search cannot be reached
+        or its answer read, and the (document, item) it refused, which would be refused again
+        """
+        if not docs: return [],[]
+        body = ''.join(['{"index":{}}\n%s\n'%json.dumps(doc) for doc in docs])
+        try:
+            if self.conn is None:
+                self.conn = httplib.HTTPSConnection( self.host )
+            self.conn.request("POST", self.prefix+'/_bulk', body, headers = self._headers())
+            response = self.conn.getresponse()
+            data = response.read()
+        except Exception as e:
+            print "failed to reach elastic search"
+            print str(e)
+            if self.conn: self.conn.close()
+            self.conn = None
+            return docs,[]
+        if response.status == 429 or response.status >= 500:
+            print "elastic search bulk failed with",response.status
+            return docs,[]
+        if response.status >= 300:
+            print "elastic search bulk refused with",response.status
+            return [],[(doc, {'status' : response.status, 'error' : data[:1000]}) for doc in docs]
+        try:
+            items = json.loads( data ).get('items',[])
+        except Exception as e:
+            ## nothing tells which documents went in
+            print "elastic search bulk response cannot be read"
+            print str(e)
+            return docs,[]
+        if len(items) != len(docs):
+            print "elastic search bulk response has",len(items),"items for",len(docs),"documents"
+            return docs,[]
+        retry = []
+        rejected = []
+        for (doc,item) in zip(docs, items):
+            item = item.get('index',{})
+            status = item.get('status',200)
+            if status == 429 or status >= 500:
+                ## overloaded
+                retry.append( doc )
+            elif status >= 300:
+                rejected.append( (doc, item) )
+        return retry,rejected
+
+    ## spool files are es_log_spool.<host>.<pid>.json, and es_log_spool.<host>.<pid>.adopted<n>.json once taken over
+    def _spool(self, suffix=''):
+        return os.path.join( self.spool_dir, 'es_log_spool.%s.%d%s.json'%( socket.gethostname(), os.getpid(), suffix))
+
+    def _orphans(self):
+        ## the spool files of the processes of this host which are gone, and the one shared before
+        orphans = []
+        host = socket.gethostname()
+        for fn in glob.glob( os.path.join( self.spool_dir, 'es_log_spool*.json')):
+            name = os.path.basename( fn )
+            if name == 'es_log_spool.json':
+                orphans.append( fn )
+                continue
+            owner = name[len('es_log_spool.'):-len('.json')]
+            if '.adopted' in owner:
+                owner = owner[:owner.rindex('.adopted')]
+            f_host,_,pid = owner.rpartition('.')
+            if f_host != host or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill( int(pid), 0)
+            except OSError as e:
+                if e.errno == errno.ESRCH:
+                    orphans.append( fn )
+        return orphans
+
+    def _adopt(self):
+        ## moved first, so that only one process replays them
+        adopted = []
+        for fn in self._orphans():
+            mine = self._spool('.adopted%d'%len(adopted))
+            try:
+                os.rename( fn, mine )
+                adopted.append( mine )
+            except OSError:
+                pass
+        return adopted
+
+    def _read_spool(self, fn):
+        if not os.path.isfile( fn ): return []
+        docs = []
+        for line in open( fn ):
+            try:
+                docs.append( json.loads( line ) )
+            except:
+                pass
+        return docs
+
+    def _write_spool(self, docs):
+        fn = self._spool()
+        lines = ['%s\n'%json.dumps(doc) for doc in docs]
+        size = sum(map(len, lines))
+        dropped = 0
+        while dropped < len(lines) and size > self.max_spool:
+            ## the oldest go first
+            size -= len(lines[dropped])
+            dropped += 1
+        if dropped:
+            print "dropping the",dropped,"oldest spooled logs, over",self.max_spool,"bytes"
+            lines = lines[dropped:]
+            self.dropped += dropped
+        if lines:
+            tmp = '%s.tmp'%fn
+            with open( tmp, 'w') as f:
+                f.write(''.join(lines))
+            os.rename( tmp, fn )
+        elif os.path.isfile( fn ):
+            os.remove( fn )
+
+    def _dead_letter(self, rejected):
+        ## shared by the processes of the host, appended to in one write, and started again once over max_spool
+        if not rejected: return
+        print len(rejected),"logs refused by elastic search, kept in the dead-letter file"
+        self.rejected += len(rejected)
+        fn = os.path.join( self.spool_dir, 'es_log_rejected.json')
+        try:
+            if os.path.isfile( fn ) and os.path.getsize( fn ) > self.max_spool:
+                os.rename( fn, '%s.old'%fn )
+            with open( fn, 'a') as f:
+                f.write(''.join(['%s\n'%json.dumps({'doc' : doc, 'item' : item}) for (doc,item) in rejected]))
+        except Exception as e:
+            print "cannot write the dead-letter file",fn
+            print str(e)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                docs, self.docs = self.docs, []
+            ## older, spooled documents go out first
+            adopted = self._adopt()
+            spooled = []
+            for fn in adopted + [self._spool()]:
+                spooled.extend( self._read_spool( fn ))
+            pending = spooled + docs
+            failed = []
+            down = False
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start+self.batch_size]
+                if down:
+                    ## do not knock again on an unreachable endpoint
+                    failed.extend( batch )
+                    continue
+                retry,rejected = self._bulk( batch )
+                down = len(retry) == len(batch)
+                failed.extend( retry )
+                self._dead_letter( rejected )
+                self.sent += len(batch) - len(retry) - len(rejected)
+                self.bulks += 1
+            if failed or spooled:
+                ## written before the adopted files go away
+                self._write_spool( failed )
+            for fn in adopted:
+                os.remove( fn )
+
+_es_shipper = []
+_es_shipper_lock = threading.Lock()
+def es_shipper():
+    with _es_shipper_lock:
+        if not _es_shipper:
+            import atexit
+            shipper = logShipper()
+            shipper.start()
+            atexit.register( shipper.flush )
+            _es_shipper.append( shipper )
+    return _es_shipper[0]
+
 def try_sendLog( subject, text , wfi = None, show=True, level='info'):
 
-    re_conn = httplib.HTTPSConnection( 'es-unified7.cern.ch' )
-    _try_sendLog( subject, text, wfi, show, level, conn = re_conn, prefix='/es/unified-logs', h = es_header())
+    doc = _log_doc( subject, text, wfi, level)
+    if show:
+        print text
+    es_shipper().add( doc )
 
 
-def _try_sendLog( subject, text , wfi = None, show=True, level='info', conn= None, prefix= '/es/unified-logs', h =None):
+def _log_doc( subject, text , wfi = None, level='info'):
 
     meta_text="level:%s\n"%level
     if wfi:
@@ -240,7 +554,11 @@ def _try_sendLog( subject, text , wfi = None, show=True, level='info', conn= Non
            "meta" : meta_text,
            "timestamp" : now,
            "date" : now_d}
+    return doc
+
+def _try_sendLog( subject, text , wfi = None, show=True, level='info', conn= None, prefix= '/es/unified-logs', h =None):
 
+    doc = _log_doc( subject, text, wfi, level)
     if show:
         print text
     encodedParams = urllib.urlencode( doc )
@@ -313,10 +631,11 @@ def url_encode_params(params = {}):
     return urllib.urlencode(params_list)
 
 def make_x509_conn(url=reqmgr_url,max_try=5):
+    ## connections are taken from, and given back to, the process-wide keep-alive pool
     tries = 0
     while tries<max_try:
         try:
-            conn = httplib.HTTPSConnection(url, cert_file = os.getenv('X509_USER_PROXY'), key_file = os.getenv('X509_USER_PROXY'))
+            conn = cassette.connection(url, lambda : x509_pool.connection(url))
             return conn
         except:
             tries+=1
@@ -750,6 +1069,54 @@ class eosFile(object):
         print(msg)
         return False
 
+def interface_hashes(interface):
+    """
+    {section : sha1} of a json interface, and the sha1 of those, as checked by the consumers of its deltas (go_condor)
+    """
+    sections = dict([(section, hashlib.sha1( json.dumps(content, sort_keys=True) ).hexdigest()) for section, content in interface.items() if not section in ['version','hash']])
+    return sections, hashlib.sha1( json.dumps(sections, sort_keys=True) ).hexdigest()
+
+def interface_delta(previous, current, previous_hashes, current_hashes):
+    """
+    {section : change} from previous to current : the keys set and unset in dictionaries, or the new content,
+    with the hashes of the section before and after, for the consumers to check what they apply the change to
+    """
+    delta = {}
+    for section in set(previous_hashes.keys() + current_hashes.keys()):
+        if previous_hashes.get(section) == current_hashes.get(section): continue
+        before = previous.get(section)
+        after = current.get(section)
+        if not section in current_hashes:
+            change = {'remove' : True}
+        elif isinstance(before, dict) and isinstance(after, dict):
+            change = {'set' : dict([(k,v) for k,v in after.items() if not k in before or before[k] != v]),
+                      'unset' : [k for k in before if not k in after]}
+        else:
+            change = {'replace' : after}
+        change.update( {'from' : previous_hashes.get(section), 'to' : current_hashes.get(section)} )
+        delta[section] = change
+    return delta
+
+def interface_publication(interface, previous=None, status=None, deltas=None, keep=20):
+    """
+    The versioned interface, its delta document with the changes of the last keep versions, and its version document,
+    from the ones currently published. The version document is to be written last, once the two others are in place.
+    """
+    current = json.loads( json.dumps( interface ))
+    previous = previous if previous else {}
+    status = status if status else {}
+    sections, digest = interface_hashes( current )
+    version = max(int(status.get('version',0)), int(previous.get('version',0))) + 1
+    chain = []
+    if previous.get('version') and previous.get('version') == status.get('version') and previous.get('hash') == status.get('hash'):
+        ## changes are only chained from a consistent previous publication
+        chain = [d for d in (deltas if deltas else {}).get('deltas',[]) if d['version'] <= previous['version']][-(keep-1):] if keep > 1 else []
+        chain.append( {'from_version' : previous['version'], 'version' : version, 'hash' : digest,
+                       'sections' : interface_delta(previous, current, status.get('sections',{}), sections)} )
+    current['version'] = version
+    current['hash'] = digest
+    return current, {'version' : version, 'deltas' : chain}, {'version' : version, 'hash' : digest, 'sections' : sections, 'time' : time.time()}
+
 class batchInfo:
     def __init__(self):
         self.client = mongo_client()
@@ -981,11 +1348,97 @@ def userLock(component=None):
             return True
     return False
 
-def getWMStats(url):
+class jsonResultStream:
+    """
+    Incremental decoding of the {"result" : [ {key : document, ...}, ...]} responses of ReqMgr2 and wmstats.
+    The response is read by chunks and the (key, document) pairs are yielded one at a time,
+    so that only one document, projected on the given fields, is held in memory at once.
+    """
+    def __init__(self, response, fields=None, chunk_size=1<<20):
+        self.response = response
+        self.fields = fields
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+
+    def _more(self):
+        data = self.response.read( self.chunk_size )
+        if not data:
+            raise ValueError("truncated json response")
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self._more()
+
+    def _expect(self, chars):
+        c = self._peek()
+        if not c in chars:
+            raise ValueError("unexpected %r in json response, expected one of %r"%(c, chars))
+        self.pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode( self.buf, self.pos )
+                ## a value running up to the end of the buffer may be a truncated number,
+                ## and so may a number cut before its fraction or exponent, as '-98765' of '-98765.4321e-2'
+                if end < len(self.buf) and not self.buf[end] in '.eE':
+                    self.pos = end
+                    return value
+            except ValueError:
+                pass
+            self._more()
+
+    def _project(self, doc):
+        if not self.fields or not isinstance(doc, dict):
+            return doc
+        return dict([(k, doc[k]) for k in self.fields if k in doc])
+
+    def _members(self):
+        ## the members of the object starting at the current position
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def __iter__(self):
+        for key in self._members():
+            if key != 'result' or self._peek() != '[':
+                self._value()
+                continue
+            self._expect('[')
+            if self._peek() == ']':
+                self.pos += 1
+                continue
+            while True:
+                for name in self._members():
+                    yield name, self._project( self._value() )
+                if self._expect(',]') == ']':
+                    break
+
+def getWMStats(url, fields=None):
     conn = make_x509_conn(url)
     url = '/wmstatsserver/data/requestcache'
     r1=conn.request("GET",url,headers={"Accept":"application/json"})
     r2=conn.getresponse()
+    if fields:
+        ## the requestcache has no mask argument : stream it and keep only the fields
+        return dict( jsonResultStream(r2, fields) )
     return json.loads(r2.read())['result'][0]
 
 def get_dashbssb(path_name, ssb_metric):
@@ -1118,6 +1571,188 @@ class ThreadHandler(threading.Thread):
                 last_talk = now
                 get_eta()
 
+class WorkerTimeout(Exception):
+    pass
+
+_worker_local = threading.local()
+def task_cancelled():
+    """
+    to be polled by long running tasks of a WorkerPool, for cooperative cancellation
+    """
+    future = getattr(_worker_local, 'future', None)
+    return future is not None and (future.cancel_requested or future.expired())
+
+class WorkerFuture(object):
+    def __init__(self, fn, args, kwargs, deadline=None):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.deadline = deadline
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self._cancelled = False
+        self._result = None
+        self._exception = None
+        self._done = threading.Event()
+        ## a task is either cancelled before it starts, or started
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """
+        a pending task is dropped, a running one is asked to stop through task_cancelled()
+        """
+        with self._lock:
+            self.cancel_requested = True
+            if self.started is None:
+                self._cancelled = True
+                self._done.set()
+            return self._cancelled
+
+    def cancelled(self):
+        return self._cancelled
+
+    def running(self):
+        return self.started is not None and not self._done.is_set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def expired(self, now=None):
+        if self.deadline is None or self.started is None or self._done.is_set(): return False
+        now = now if now else time.time()
+        return (now - self.started) > self.deadline
+
+    def _run(self):
+        with self._lock:
+            if self._cancelled: return
+            self.started = time.time()
+        _worker_local.future = self
+        try:
+            self._result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            import traceback
+            self._exception = e
+            self.traceback = traceback.format_exc()
+        finally:
+            _worker_local.future = None
+            self.finished = time.time()
+            self._done.set()
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise WorkerTimeout("task did not complete in %s [s]"%timeout)
+        if self._cancelled:
+            raise WorkerTimeout("task was cancelled")
+        return self._exception
+
+    def result(self, timeout=None):
+        e = self.exception(timeout)
+        if e is not None:
+            raise e
+        return self._result
+
+class WorkerPool(object):
+    """
+    Fixed number of worker threads pulling tasks from a bounded queue, of 4 tasks per worker unless max_queue is given
+    (0 for no bound) : submit() blocks while the queue is full.
+    submit() returns a WorkerFuture holding the result or the exception of the task.
+    Tasks running for more than deadline [s] are asked to stop and are not waited for.
+    ramp_up [s] staggers the start of the workers instead of sleeping after each task.
+    """
+    def __init__(self, n_threads=10, max_queue=None, deadline=None, ramp_up=0, label='WorkerPool', verbose=False, show_eta=10):
+        self.n_threads = n_threads
+        self.deadline = deadline
+        self.ramp_up = ramp_up
+        self.label = label
+        self.verbose = verbose
+        self.show_eta = show_eta
+        self.queue = Queue.Queue( maxsize = 4*n_threads if max_queue is None else max_queue )
+        self.futures = []
+        self.workers = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _start_workers(self):
+        with self.lock:
+            if self.workers: return
+            for i in range(self.n_threads):
+                w = threading.Thread(target = self._work, args = (i*self.ramp_up,))
+                w.daemon = True
+                w.start()
+                self.workers.append( w )
+
+    def _work(self, delay):
+        if delay: time.sleep( delay )
+        while True:
+            future = self.queue.get()
+            try:
+                if future is None: return
+                future._run()
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        if self.closed:
+            raise Exception("[%s] cannot submit to a closed pool"%self.label)
+        self._start_workers()
+        future = WorkerFuture(fn, args, kwargs, deadline = self.deadline)
+        self.futures.append( future )
+        ## blocks when the queue is full
+        self.queue.put( future )
+        return future
+
+    def map(self, fn, items):
+        return [self.submit(fn, item) for item in items]
+
+    def _eta(self, start_now):
+        n_done = sum([f.done() for f in self.futures])
+        ntotal = len(self.futures)
+        spend = time.time() - start_now
+        eta = (spend / float(n_done)) * (ntotal - n_done) if n_done else None
+        print "[%s] Will finish in about %s. %d/%d. spend %s"%(
+            self.label,
+            display_time(eta) if eta else "N/A",
+            n_done, ntotal,
+            display_time(spend))
+
+    def wait(self, timeout=None, poll=1):
+        """
+        wait for all submitted tasks, up to timeout [s]. Tasks still pending at the timeout are cancelled.
+        returns the futures that did not complete
+        """
+        start_now = time.time()
+        last_talk = start_now
+        print "[%s] Processing %d tasks with %d workers and timeout %s [s]"%( self.label, len(self.futures), self.n_threads, timeout)
+        while True:
+            now = time.time()
+            pending = [f for f in self.futures if not f.done() and not f.expired(now)]
+            if not pending: break
+            if timeout and (now - start_now) > timeout:
+                print "[%s] Stopping because the time out is over %s"%(self.label,time.asctime(time.gmtime()))
+                break
+            if self.verbose and now - last_talk > self.show_eta:
+                last_talk = now
+                self._eta( start_now )
+            pending[0]._done.wait( poll )
+        left = [f for f in self.futures if not f.done()]
+        for f in left:
+            if f.expired():
+                print "[%s] a task went over its deadline of %s [s]"%(self.label, self.deadline)
+            f.cancel()
+        return left
+
+    def shutdown(self, wait=True, timeout=None):
+        self.closed = True
+        left = self.wait( timeout ) if wait else []
+        for w in self.workers:
+            try:
+                self.queue.put_nowait( None )
+            except Queue.Full:
+                ## the workers are daemons, stuck on tasks over their deadline
+                break
+        return left
+
 class docCache:
     def __init__(self):
         self.cache = {}        
@@ -1231,7 +1866,7 @@ class docCache:
             'data' : None,
             'timestamp' : time.mktime( time.gmtime()),
             'expiration' : default_expiration(),
-            'getter' : lambda : getWMStats('cmsweb.cern.ch'),
+            'getter' : lambda : getWMStats('cmsweb.cern.ch', fields=['RequestName','RequestStatus','AgentJobInfo']),
             'cachefile' : None,
             'default' : {}
             }
@@ -1239,6 +1874,97 @@ class docCache:
         for src in self.cache:
             self.cache[src]['cachefile'] = '.'+src+'.cache.json'
 
+        self.owner = "%s-%s"%( socket.gethostname(), os.getpid())
+        self.lease_minutes = 10
+        self.refreshing = set()
+        self.held = set()
+        self.lock = threading.Lock()
+        ## the refreshing threads are daemons, they do not get to release their lease at exit
+        import atexit
+        atexit.register( self._release_held )
+
+    def _leases(self):
+        db = mongo_client().unified.cacheLease
+        if not getattr(docCache, '_lease_index', False):
+            db.create_index('key', unique=True)
+            docCache._lease_index = True
+        return db
+
+    def _acquire(self, label):
+        """
+        single-flight across hosts : only the owner of the lease refreshes the document
+        """
+        import pymongo
+        now = time.mktime(time.gmtime())
+        try:
+            r = self._leases().update_one({'key' : label,
+                                           '$or' : [{'expire' : {'$lt' : now}}, {'owner' : self.owner}]},
+                                          {'$set' : {'owner' : self.owner,
+                                                     'expire' : now + 60*self.lease_minutes}},
+                                          upsert = True)
+            if r.matched_count or r.upserted_id:
+                with self.lock:
+                    self.held.add( label )
+                return True
+            return False
+        except pymongo.errors.DuplicateKeyError:
+            ## somebody else holds the lease
+            return False
+        except Exception as e:
+            print "could not get the lease for",label
+            print str(e)
+            return True
+
+    def _release(self, label):
+        try:
+            self._leases().delete_one({'key' : label, 'owner' : self.owner})
+            with self.lock:
+                self.held.discard( label )
+        except Exception as e:
+            print str(e)
+
+    def _release_held(self):
+        with self.lock:
+            held = list(self.held)
+        for label in held:
+            self._release( label )
+
+    def _fetch(self, label, cache):
+        o = self.cache[label]
+        data =  o['getter']()
+        cache.store( label,
+                     data = data,
+                     lifetime_min = o['expiration'] )
+        return data
+
+    def _revalidate(self, label):
+        with self.lock:
+            if label in self.refreshing: return
+            self.refreshing.add( label )
+        def refresh():
+            try:
+                if not self._acquire( label ):
+                    print "another host is refreshing",label
+                    return
+                try:
+                    self._fetch( label, cacheInfo() )
+                finally:
+                    self._release( label )
+            except Exception as e:
+                print "failed to refresh",label
+                print str(e)
+            finally:
+                with self.lock:
+                    self.refreshing.discard( label )
+        t = threading.Thread( target = refresh )
+        t.daemon = True
+        t.start()
+
+    def warm_up(self, labels=None, n_threads=8):
+        labels = labels if labels else self.cache.keys()
+        pool = WorkerPool( n_threads = n_threads, label = 'docCache')
+        pool.map( self.get, labels )
+        pool.shutdown()
 
     def get(self, label, fresh=False, lastdoc=True):
         if not label in self.cache:
@@ -1248,25 +1974,89 @@ class docCache:
         cached = cache.get( label ) if not fresh else None
         if cached:
             return cached
-        else:
-            o = self.cache[label]
-            try:
-                data =  o['getter']()
-            except Exception as e:
-                sendLog('doccache','Failed to get {}\n{}\n{}'.format(label,type(e),str(e)), level='critical')
-                print "failed to get",label
-                print str(e)
-                if lastdoc:
-                    last_doc = cache.get( label, no_expire=True)
-                    print "last document in cache for",label,"is",last_doc
-                    if last_doc:
-                        print "returning the last doc in cache"
-                        return last_doc
-                data = o['default']
-            cache.store( label, 
+        if not fresh:
+            ## stale while revalidate : serve the last document and refresh it in the background
+            last_doc = cache.get( label, no_expire=True)
+            if last_doc:
+                self._revalidate( label )
+                return last_doc
+        o = self.cache[label]
+        try:
+            data = self._fetch( label, cache )
+        except Exception as e:
+            sendLog('doccache','Failed to get {}\n{}\n{}'.format(label,type(e),str(e)), level='critical')
+            print "failed to get",label
+            print str(e)
+            if lastdoc:
+                last_doc = cache.get( label, no_expire=True)
+                print "last document in cache for",label,"is",last_doc
+                if last_doc:
+                    print "returning the last doc in cache"
+                    return last_doc
+            data = o['default']
+            cache.store( label,
                          data = data,
                          lifetime_min = o['expiration'] )
-            return data
+        return data
+
+class gwmsmonHistory(object):
+    """
+    The prodview history histograms of tasks from gwmsmon : input read (io), memory per core count (memory)
+    and runtime percentiles (time). All histograms of a batch of tasks are fetched in parallel over
+    pooled keep-alive connections, and kept for lifetime seconds.
+    """
+    paths = {'io' : '/prodview/json/historynew/highio720/%s',
+             'memory' : '/prodview/json/historynew/memorycpu720/%s/success',
+             'time' : '/prodview/json/historynew/percentileruntime720/%s'}
+
+    def __init__(self, url='cms-gwmsmon.cern.ch', lifetime=10*60, n_threads=10):
+        self.url = url
+        self.lifetime = lifetime
+        self.n_threads = n_threads
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.fetches = 0
+
+    def _get(self, path):
+        conn = cassette.connection(self.url, lambda : http_pool.connection(self.url))
+        r1=conn.request("GET", path, headers={"Accept" : "application/json"})
+        r2=conn.getresponse()
+        data = r2.read()
+        if r2.status != 200:
+            raise Exception("%s failed with %s"%(path, r2.status))
+        with self.lock:
+            self.fetches += 1
+        return json.loads( data )
+
+    def _fetch(self, kind, task):
+        try:
+            data = runWithRetries(self._get, [self.paths[kind]%task], {}, retries =5, wait=1)
+        except Exception as e:
+            print "No good",kind,"data for",task
+            print str(e)
+            data = None
+        with self.lock:
+            self.histograms[(kind, task)] = (time.time(), data)
+        return data
+
+    def get(self, tasks, kinds=None):
+        """
+        {task : {kind : histogram, or None if it could not be fetched}} for tasks as workflow/task
+        """
+        kinds = kinds if kinds else sorted(self.paths.keys())
+        now = time.time()
+        with self.lock:
+            missing = sorted(set([(kind, task) for task in tasks for kind in kinds
+                                  if not (kind, task) in self.histograms or (now - self.histograms[(kind, task)][0]) > self.lifetime]))
+        if missing:
+            pool = WorkerPool( n_threads = min(self.n_threads, len(missing)), label = 'gwmsmonHistory')
+            for future in pool.map( lambda (kind, task) : self._fetch(kind, task), missing):
+                future.result()
+            pool.shutdown()
+        with self.lock:
+            return dict([(task, dict([(kind, self.histograms[(kind, task)][1]) for kind in kinds])) for task in tasks])
+
+gwmsmon_history = gwmsmonHistory()
 
 def getSiteStorage(url):
     conn = make_x509_conn(url)
@@ -1305,6 +2095,12 @@ class siteInfo:
 
         UC = unifiedConfiguration()
 
+        ## fetch in parallel whatever is missing from the cache
+        dataCache.warm_up(['ssb_prod_status', 'site_storage', 'mcore_ready',
+                           'gwmsmon_totals', 'gwmsmon_prod_maxused', 'gwmsmon_prod_site_summary',
+                           'site_queues', 'detox_sites',
+                           'ssb_core_max_used', 'ssb_core_production', 'ssb_core_cpu_intensive'])
+
         try:
             ## get all sites from SSB readiness
             self.sites_ready = []
@@ -1881,21 +2677,76 @@ class reportInfo:
                 'tasks' : { task : {field_name : content}}}
         self._put( doc )
 
+class lruCache:
+    """
+    Bounded, thread-safe in-memory cache of (expiration, data), evicting the least recently used key
+    once there are more than max_size keys, or more than max_bytes of data.
+    The data is kept pickled : encoded once when put, each get decodes a copy of its own for the caller.
+    """
+    def __init__(self, max_size=200, max_bytes=256*1024*1024):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.items = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, no_expire=False):
+        now = time.mktime(time.gmtime())
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is None or not (no_expire or item[0] > now):
+                self.misses += 1
+                if item is not None: self.items[key] = item
+                return None
+            self.items[key] = item
+            self.hits += 1
+        return cPickle.loads( item[1] )
+
+    def put(self, key, data, expire):
+        blob = cPickle.dumps( data, cPickle.HIGHEST_PROTOCOL )
+        with self.lock:
+            self._pop( key )
+            if len(blob) > self.max_bytes:
+                return
+            self.items[key] = (expire, blob)
+            self.bytes += len(blob)
+            while len(self.items) > self.max_size or self.bytes > self.max_bytes:
+                self.bytes -= len(self.items.popitem( last = False )[1][1])
+
+    def _pop(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.bytes -= len(item[1])
+
+    def pop(self, key):
+        with self.lock:
+            self._pop( key )
+
+cache_lru = lruCache()
+
 class cacheInfo:
     def __init__(self):
         self.client = mongo_client()
         self.db = self.client.unified.cacheInfo
 
     def get(self, key, no_expire=False):
+        in_memory = cache_lru.get( key, no_expire=no_expire )
+        if in_memory is not None:
+            return in_memory
         now = time.mktime(time.gmtime())
         o =self.db.find_one({'key':key})
         if o:
             if no_expire or (o['expire'] > now):
                 if not 'data' in o:
-                    return self.from_file(key)
+                    data = self.from_file(key, o.get('time'))
                 else:
                     print "cache hit",key
-                    return o['data']
+                    data = o['data']
+                if data is not None and o['expire'] > now:
+                    cache_lru.put( key, data, o['expire'] )
+                return data
             else:
                 print "expired doc",key
                 return None
@@ -1907,7 +2758,12 @@ class cacheInfo:
         cache_file = '{}/{}'.format(cache_dir, key.replace('/','_'))
         return cache_file
 
-    def from_file(self, key):
+    def from_file(self, key, revision=None):
+        data = artifact_cache.get_json('cacheInfo', key, revision)
+        if data is not None:
+            print "file cache hit",key
+            return data
+        ## written before the artifact cache
         fn = self._file_key(key)
         if os.path.isfile( fn):
             print "file cache hit",key
@@ -1923,13 +2779,14 @@ class cacheInfo:
                    'time' : int(now),
                    'expire' : int(now + 60*lifetime_min),
                    'lifetime' : lifetime_min}
+        cache_lru.put( key, data, content['expire'] )
         try:
             self.db.update_one({'key': key},
                                {"$set": content},
                                upsert = True)
         except (pymongo.errors.WriteError,pymongo.errors.DocumentTooLarge) as e:
             print ("cannot go in mongo. in file instead")
-            open(self._file_key(key),'w').write( json.dumps( content.pop('data') ))
+            artifact_cache.put_json('cacheInfo', key, content.pop('data'), revision = content['time'])
             self.db.update_one({'key': key},
                                {"$set": content},
                                upsert = True)
@@ -1937,6 +2794,10 @@ class cacheInfo:
             print type(e)
             print str(e)
 
+    def remove(self, key):
+        cache_lru.pop( key )
+        self.db.delete_one({'key':key})
+
     def purge(self, grace = 2):
         limit = time.mktime(time.gmtime())
         # delete all documents with passed expiration time
@@ -2286,6 +3147,109 @@ def _getFileBlock( f ):
     r = dbsapi.listFileArray( logical_file_name = f, detail=True)
     return [df['block_name'] for df in r][0] if r else None
 
+def _lfn_dataset_dir( lfn ):
+    ## /store/<type>/<era>/<primary>/<tier>/<processed-version> identifies the dataset of a file
+    return '/'.join(lfn.split('/')[:7])
+
+def getFilesBlock( files, chunk_size=200, n_threads=4, cache_timeout=12*60):
+    """
+    the block of each file, looked up in bulk in DBS by chunks of lfns.
+    The lfn to block map of each dataset is kept in cacheInfo and re-used across workflows,
+    as a list of [lfn, block] : lfns have dots, which mongo does not take in the keys of a document
+    """
+    cache = cacheInfo()
+    per_dir = defaultdict(list)
+    for f in set(files):
+        per_dir[_lfn_dataset_dir(f)].append( f )
+
+    file_blocks = {}
+    block_maps = {}
+    to_query = []
+    for d,fs in per_dir.items():
+        block_maps[d] = dict( cache.get( 'lfn_block_map_%s'%d ) or [] )
+        for f in fs:
+            if f in block_maps[d]:
+                file_blocks[f] = block_maps[d][f]
+            else:
+                to_query.append( f )
+
+    if to_query:
+        print len(to_query),"files to look up in",int(math.ceil(len(to_query)/float(chunk_size))),"bulk calls"
+        chunks = [to_query[i:i+chunk_size] for i in range(0, len(to_query), chunk_size)]
+        pool = WorkerPool( n_threads = n_threads, label = 'getFilesBlock')
+        futures = pool.map( lambda chunk : runWithRetries(_getFilesBlock, [chunk],{}), chunks)
+        pool.shutdown()
+        updated = set()
+        for future in futures:
+            for f,b in future.result().items():
+                file_blocks[f] = b
+                block_maps[_lfn_dataset_dir(f)][f] = b
+                updated.add( _lfn_dataset_dir(f) )
+        for d in updated:
+            cache.store( 'lfn_block_map_%s'%d, sorted(block_maps[d].items()), lifetime_min=cache_timeout)
+
+    return file_blocks
+
+def _getFilesBlock( files ):
+    dbsapi = DbsApi(url=dbs_url)
+    r = dbsapi.listFileArray( logical_file_name = files, detail=True)
+    return dict([(df['logical_file_name'], df['block_name']) for df in r])
+
+## the labels of the block contents that depend on the validity of the files
+block_content_labels = ['listFile', 'listFileArray', 'listFileLumis', 'listFileLumis_all']
+
+def getDatasetBlocksContent( dataset, label, getter, n_threads=5, lifetime_min=30, fresh=False):
+    """
+    {block : getter(block)} for all blocks of the dataset.
+    The content of each block is kept in cacheInfo with the block last_modification_date,
+    so that only the new or modified blocks are fetched again.
+    Changing the validity of files does not modify the block : forgetFilesContent drops the blocks of the
+    files changed from here, and the short lifetime bounds the staleness for changes made elsewhere
+    """
+    dbsapi = DbsApi(url=dbs_url)
+    blocks = dbsapi.listBlocks( dataset = dataset, detail = True)
+    cache = cacheInfo()
+    content = {}
+    to_fetch = []
+    for block in blocks:
+        name = block['block_name']
+        modified = block.get('last_modification_date')
+        cached = cache.get( 'block_{}_{}'.format( label, name )) if not fresh else None
+        if cached and cached['modified'] == modified:
+            content[name] = cached['data']
+        else:
+            to_fetch.append( (name, modified) )
+
+    if to_fetch:
+        print "fetching",len(to_fetch),"/",len(blocks),"new or modified blocks of",dataset,"for",label
+        pool = WorkerPool( n_threads = n_threads, label = 'getDatasetBlocksContent')
+        futures = pool.map( lambda b : runWithRetries(getter, [b[0]],{}), to_fetch)
+        pool.shutdown()
+        for (name, modified),future in zip(to_fetch, futures):
+            data = future.result()
+            content[name] = data
+            cache.store( 'block_{}_{}'.format( label, name ),
+                         {'modified' : modified, 'data' : data},
+                         lifetime_min = lifetime_min)
+    return content
+
+def forgetFilesContent( files ):
+    """
+    drop the cached content of the blocks and datasets of the files, after their validity changed
+    """
+    try:
+        cache = cacheInfo()
+        blocks = set(filter(None, getFilesBlock( files ).values()))
+        for block in blocks:
+            for label in block_content_labels:
+                cache.remove( 'block_{}_{}'.format( label, block ))
+        for dataset in set([block.split('#')[0] for block in blocks]):
+            for key in ['dbs_listFile_{}', 'dbs_listFileArray_{}', 'lumi_index_{}']:
+                cache.remove( key.format( dataset ))
+    except Exception as e:
+        print "could not forget the cached content of",len(files),"files"
+        print str(e)
+
 def getDatasetFileArray( dataset, validFileOnly=0, detail=False, cache_timeout=30, use_array=False):
     ## check for cache content
     call = 'listFileArray' if use_array else 'listFile'
@@ -2297,11 +3261,13 @@ def getDatasetFileArray( dataset, validFileOnly=0, detail=False, cache_timeout=3
         print ("{} {} taken from cache".format(call, dataset ))
         all_files = cached
     else:
-        dbsapi = DbsApi(url=dbs_url)
         if use_array:
-            all_files = dbsapi.listFileArray( dataset= dataset, detail=True)
+            getter = lambda b : DbsApi(url=dbs_url).listFileArray( block_name = b, detail=True)
         else:
-            all_files = dbsapi.listFiles( dataset = dataset, detail = True)
+            getter = lambda b : DbsApi(url=dbs_url).listFiles( block_name = b, detail = True)
+        all_files = []
+        for block,files in getDatasetBlocksContent( dataset, call, getter ).items():
+            all_files.extend( files )
         cache.store( cache_key, all_files)
     
     if validFileOnly:
@@ -2529,211 +3495,286 @@ class duplicateAnalyzer:
         credits to whoever implemented this in the first place
         """
     def _buildGraph(self, lumis):
-        graph = {}
-
+        """
+        files sharing a lumi are all connected to each other
+        """
+        graph = defaultdict(set)
         for lumi in lumis:
-            files = lumis[lumi]
-            #text lines with file names
-            f1 = files[0]
-            f2 = files[1]
-            #create edge (f1, f2)
-            if f1 not in graph:
-                graph[f1] = {}
-            if f2 not in graph[f1]:
-                graph[f1][f2] = 0
-                graph[f1][f2] += 1
-            #create edge (f2, f1)
-            if f2 not in graph:
-                graph[f2] = {}
-            if f1 not in graph[f2]:
-                graph[f2][f1] = 0
-                graph[f2][f1] += 1
+            files = sorted(set(lumis[lumi]))
+            for i,f1 in enumerate(files):
+                for f2 in files[i+1:]:
+                    graph[f1].add(f2)
+                    graph[f2].add(f1)
         return graph
 
-    def _hasEdges(self,graph):
+    def _components(self, graph):
         """
-        True if at least one edge is between to vertices,
-        that is, there is at least one lumi present in two different
-        files
+        connected components of the graph, with a union-find
         """
-        for v in graph.values():
-            if v:
-                return True
-        return False
-
-    def _colorBipartiteGraph(self, graph, events):
+        parent = dict([(f,f) for f in graph])
+        def find(f):
+            root = f
+            while parent[root] != root:
+                root = parent[root]
+            while parent[f] != root:
+                parent[f], f = root, parent[f]
+            return root
+        for f1 in graph:
+            for f2 in graph[f1]:
+                r1, r2 = find(f1), find(f2)
+                if r1 != r2:
+                    parent[r2] = r1
+        components = defaultdict(list)
+        for f in graph:
+            components[find(f)].append( f )
+        return components.values()
+
+    def _colorBipartiteGraph(self, graph, events, component=None):
         """
         Removes duplication by identifying a bipartite graph and removing
         the smaller side
         """
-        red = set()
-        green = set()
-
-        for f1, f2d in graph.items():
-            f1red = f1 in red
-            f1green = f1 in green
-            for f2 in f2d.keys():
-                f2red = f2 in red
-                f2green = f2 in green
-                #both have no color
-                if not(f1red or f1green or f2red or f1green):
-                    red.add(f1)
-                    green.add(f2)
-                #some has two colors:
-                elif (f1red and f1green) or (f2red and f2green):
-                    print "NOT BIPARTITE GRAPH"
-                    raise Exception("Not a bipartite graph, cannot use this algorithm for removing")
-                #have same color
-                elif (f1red and f2red) or (f1green and f2green):
-                    print "NOT BIPARTITE GRAPH"
-                    raise Exception("Not a bipartite graph, cannot use this algorithm for removing")
-
-                #both are colored but different
-                elif f1red != f2red and f1green != f2green:
-                    continue
-                #color opposite
-                elif f1red:
-                    green.add(f2)
-                elif f1green:
-                    red.add(f2)
-                elif f2red:
-                    green.add(f1)
-                elif f2green:
-                    green.add(f1)
+        component = component if component is not None else graph.keys()
+        color = {}
+        for start in component:
+            if start in color: continue
+            color[start] = True
+            queue = collections.deque([start])
+            while queue:
+                f1 = queue.popleft()
+                for f2 in graph[f1]:
+                    if not f2 in color:
+                        color[f2] = not color[f1]
+                        queue.append( f2 )
+                    elif color[f2] == color[f1]:
+                        raise Exception("Not a bipartite graph, cannot use this algorithm for removing")
+        red = [f for f in component if color[f]]
+        green = [f for f in component if not color[f]]
         #validate against the # of events of the files
         eventsRed = sum(events[f] for f in red)
         eventsGreen = sum(events[f] for f in green)
         if eventsRed < eventsGreen:
-            return list(red)
+            return red
         else:
-            return list(green)
+            return green
 
-    def _deleteSmallestVertexFirst(self, graph, events):
+    def _deleteSmallestVertexFirst(self, graph, events, component=None):
         """
-        Removes duplication by deleting files in a greedy fashion.
-        That is, removing the files smallest files
-        first, and keep doing so until there is no edge on the graph (no lumi
-        in two different files)
+        Removes duplication by deleting files in a greedy fashion :
+        the file with the most duplicated neighbours goes first, the smallest file
+        first for the same number of neighbours, until no lumi is in two different files
         """
+        import heapq
+        component = component if component is not None else graph.keys()
+        degree = dict([(f,len(graph[f])) for f in component])
+        heap = [(-degree[f], events[f], f) for f in component if degree[f]]
+        heapq.heapify( heap )
+        removed = set()
         files = []
-        print "Initial files:", len(graph)
-        #sort by number of events
-        ls = sorted(graph.keys(), key=lambda x: events[x])
-        #quadratic first
-        while self._hasEdges(graph):
-        #get smallest vertex
-            minv = ls.pop()
-            #remove minv from all its adjacent vertices
-            for v in graph[minv]:
-                del graph[v][minv]
-            #remove maxv entry
-            del graph[minv]
-            files.append(minv)
-
-        #print "End Files:",len(graph), "Invalidated:",len(graph)
+        while heap:
+            d, _, f = heapq.heappop( heap )
+            ## lazy deletion of outdated entries
+            if f in removed or -d != degree[f] or not degree[f]: continue
+            removed.add( f )
+            files.append( f )
+            for n in graph[f]:
+                if n in removed: continue
+                degree[n] -= 1
+                if degree[n]:
+                    heapq.heappush( heap, (-degree[n], events[n], n))
+            degree[f] = 0
         return files
 
     def files_to_remove(self, files_per_lumis):
         lumi_count_per_file = defaultdict(int)
         for rl,fns in files_per_lumis.items():
             for fn in fns: lumi_count_per_file[fn]+=1
-        bad_lumis = dict([(rl,files) for rl,files in files_per_lumis.items() if len(files)>1])
+        bad_lumis = dict([(rl,files) for rl,files in files_per_lumis.items() if len(set(files))>1])
         graph = self._buildGraph(bad_lumis)
-        try:
-            files = self._colorBipartiteGraph(graph, lumi_count_per_file)
-        except:
-            #print "not with colorBipartiteGraph"
-            files = self._deleteSmallestVertexFirst(graph, lumi_count_per_file)
+        files = []
+        for component in self._components(graph):
+            try:
+                files.extend( self._colorBipartiteGraph(graph, lumi_count_per_file, component) )
+            except:
+                files.extend( self._deleteSmallestVertexFirst(graph, lumi_count_per_file, component) )
         return files
 
 
-def getDatasetLumisAndFiles(dataset, runs=None, lumilist=None, with_cache=False,force=False, check_with_invalid_files_too=False):
-    if runs and lumilist:
-        print "should not be used that way"
-        return {},{}
-    #lumis =set()
-    #if lumilist:
-    #    for r in lumilist:
-    #        lumis.update( [(r,l) for l in lumilist[r]])
+class lumiFileIndex:
+    """
+    Compact (run, lumi) -> files index of a dataset.
+    Files are interned in a table, and the run, lumi and file id are kept in
+    parallel unsigned int arrays sorted by (run, lumi, file id)
+    """
+    def __init__(self, files=None, runs=None, lumis=None, fids=None):
+        self.files = files if files is not None else []
+        self.runs = runs if runs is not None else array.array('I')
+        self.lumis = lumis if lumis is not None else array.array('I')
+        self.fids = fids if fids is not None else array.array('I')
+
+    @classmethod
+    def from_file_lumis(cls, records):
+        """
+        records are the aggregated output of listFileLumis, with a list of lumis per (run, file)
+        """
+        file_ids = {}
+        files = []
+        entries = []
+        for f in records:
+            lfn = f['logical_file_name']
+            if not lfn in file_ids:
+                file_ids[lfn] = len(files)
+                files.append( intern(str(lfn)) )
+            fid = file_ids[lfn]
+            run = int(f['run_num'])
+            entries.extend( [(run, int(lumi), fid) for lumi in f['lumi_section_num']] )
+        entries = sorted(set(entries))
+        return cls(files,
+                   array.array('I', [e[0] for e in entries]),
+                   array.array('I', [e[1] for e in entries]),
+                   array.array('I', [e[2] for e in entries]))
+
+    def __len__(self):
+        return len(self.fids)
+
+    def _lower_bound(self, run, lumi):
+        lo, hi = 0, len(self.runs)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if (self.runs[mid], self.lumis[mid]) < (run, lumi):
+                lo = mid+1
+            else:
+                hi = mid
+        return lo
 
-    now = time.mktime(time.gmtime())
-    dbsapi = DbsApi(url=dbs_url)
-    cache_key = 'json_lumis_{}'.format( dataset )
+    def files_for(self, run, lumi):
+        i = self._lower_bound(run, lumi)
+        files = []
+        while i < len(self.runs) and self.runs[i] == run and self.lumis[i] == lumi:
+            files.append( self.files[self.fids[i]] )
+            i += 1
+        return files
+
+    def run_range(self, run):
+        start = bisect.bisect_left(self.runs, run)
+        end = bisect.bisect_right(self.runs, run, start)
+        return start, end
+
+    def _groups(self, runs=None):
+        ## yields (run, lumi, start, end) for each distinct lumi, in order
+        if runs is None:
+            ranges = [(0, len(self.runs))]
+        else:
+            ranges = [self.run_range(int(run)) for run in sorted(set(map(int,runs)))]
+        for (start, end) in ranges:
+            i = start
+            while i < end:
+                j = i+1
+                run, lumi = self.runs[i], self.lumis[i]
+                while j < end and self.lumis[j] == lumi and self.runs[j] == run:
+                    j += 1
+                yield int(run), int(lumi), i, j
+                i = j
+
+    def lumis_per_run(self, runs=None):
+        lumi_json = defaultdict(list)
+        for run, lumi, _, _ in self._groups(runs):
+            lumi_json[run].append( lumi )
+        return dict(lumi_json)
+
+    def files_per_lumi(self, runs=None):
+        return dict([((run, lumi), [self.files[self.fids[k]] for k in range(i,j)]) for (run, lumi, i, j) in self._groups(runs)])
+
+    def duplicated(self, runs=None):
+        """
+        the (run, lumi) present in more than one file
+        """
+        return dict([((run, lumi), [self.files[self.fids[k]] for k in range(i,j)]) for (run, lumi, i, j) in self._groups(runs) if j-i > 1])
+
+    def serialize(self):
+        header = json.dumps({'files': self.files, 'n': len(self.fids), 'byteorder': sys.byteorder})
+        blob = header + '\n' + self.runs.tostring() + self.lumis.tostring() + self.fids.tostring()
+        return base64.b64encode( zlib.compress( blob ) )
+
+    @classmethod
+    def deserialize(cls, payload):
+        blob = zlib.decompress( base64.b64decode( payload ))
+        header, columns = blob.split('\n',1)
+        header = json.loads( header )
+        n = header['n']
+        cols = []
+        size = array.array('I').itemsize
+        for c in range(3):
+            col = array.array('I')
+            col.fromstring( columns[c*n*size:(c+1)*n*size] )
+            if header['byteorder'] != sys.byteorder:
+                col.byteswap()
+            cols.append( col )
+        files = [intern(str(f)) for f in header['files']]
+        return cls(files, *cols)
+
+def getDatasetLumiFileIndex(dataset, with_cache=False, force=False, check_with_invalid_files_too=False):
+    """
+    the lumiFileIndex of a dataset, cached compressed in cacheInfo
+    """
+    cache_key = 'lumi_index_{}'.format( dataset )
     cache = cacheInfo()
     cached = None
     if force: with_cache=False
     if with_cache:
         cached = cache.get( cache_key )
-        
-    if not cached:
-        ## do the full query
-        
-        print "querying getDatasetLumisAndFiles", dataset
-        full_lumi_json = defaultdict(set)
-        files_per_lumi = defaultdict(set) ## the revers dictionnary of files by r:l
-
-        class getFilesFromBlock(threading.Thread):
-            def __init__(self, b, dbs=None):
-                threading.Thread.__init__(self)
-                self.b = b
-                self.a = dbs if dbs else DbsApi(url=dbs_url)
-                self.res = None
-            
-            def run(self):
-                response = self.a.listFileLumis( block_name = self.b , validFileOnly=int(not check_with_invalid_files_too))
-                if type(response[0]["lumi_section_num"]) is list:
-                    # Old DBS Server response
-                    print "Handling dbsapi.listFileLumis response from OLD DBS server"
-                    self.res = response
+    if cached:
+        return lumiFileIndex.deserialize( cached )
 
-                else:
-                    # New DBS Server response
-                    print "Handling dbsapi.listFileLumis response from NEW DBS server"
-                    self.res = aggregateListFileLumis(response)
-
-        threads = []
-        all_blocks = dbsapi.listBlocks( dataset = dataset )
-        for block in all_blocks:
-            threads.append( getFilesFromBlock( block.get('block_name') ))
-
-        run_rthreads = ThreadHandler( threads = threads,
-                                      n_threads = 10,
-                                      label = 'getDatasetLumisAndFiles')
-        run_rthreads.start()
-        while run_rthreads.is_alive():
-            time.sleep(1)
+    print "querying getDatasetLumiFileIndex", dataset
 
-        for t in run_rthreads.threads:
-            if not t.res: continue
-            for f in t.res:
-                full_lumi_json[ str(f['run_num']) ].update( f['lumi_section_num'])
-                for lumi in f['lumi_section_num']:
-                    files_per_lumi['{}:{}'.format(f['run_num'], lumi)].add( f['logical_file_name'])
-        for k,v in full_lumi_json.items():
-            full_lumi_json[k] = list(v)
-        for k,v in files_per_lumi.items():
-            files_per_lumi[k] = list(v)
-
-        cache.store( cache_key,
-                     {'files' : files_per_lumi,
-                      'lumis' : full_lumi_json},
-                     lifetime_min =600)
-    else:
-        files_per_lumi = cached['files']
-        full_lumi_json = cached['lumis']
+    def getFilesFromBlock(b):
+        response = DbsApi(url=dbs_url).listFileLumis( block_name = b , validFileOnly=int(not check_with_invalid_files_too))
+        if not response: return None
+        if type(response[0]["lumi_section_num"]) is list:
+            # Old DBS Server response
+            print "Handling dbsapi.listFileLumis response from OLD DBS server"
+            return response
+        else:
+            # New DBS Server response
+            print "Handling dbsapi.listFileLumis response from NEW DBS server"
+            return aggregateListFileLumis(response)
+
+    records = []
+    label = 'listFileLumis' if not check_with_invalid_files_too else 'listFileLumis_all'
+    for block,res in getDatasetBlocksContent( dataset, label, getFilesFromBlock, n_threads = 10, fresh = force).items():
+        if res: records.extend( res )
+    index = lumiFileIndex.from_file_lumis( records )
+
+    cache.store( cache_key,
+                 index.serialize(),
+                 lifetime_min =600)
+    return index
+
+def getDatasetLumisAndFiles(dataset, runs=None, lumilist=None, with_cache=False,force=False, check_with_invalid_files_too=False):
+    """
+    compatibility accessor on top of getDatasetLumiFileIndex,
+    returning {run : [lumis]} and {(run,lumi) : [files]}
+    """
+    if runs and lumilist:
+        print "should not be used that way"
+        return {},{}
+
+    index = getDatasetLumiFileIndex(dataset, with_cache=with_cache, force=force,
+                                    check_with_invalid_files_too=check_with_invalid_files_too)
 
     ## need to filter on the runs
-    lumi_json = dict([(int(k),v) for (k,v) in full_lumi_json.items()])
-    files_json = dict([(tuple(map(int,k.split(":"))),v) for (k,v) in files_per_lumi.items()])
     if runs:
-        lumi_json = dict([(int(k),v) for (k,v) in full_lumi_json.items() if int(k) in runs])
-        files_json = dict([(tuple(map(int,k.split(":"))),v) for (k,v) in files_per_lumi.items() if int(k.split(':')[0]) in runs])
+        lumi_json = index.lumis_per_run( runs )
+        files_json = index.files_per_lumi( runs )
     elif lumilist:
-        #runs = map(int(lumilist.keys()))
         runs = [int(r) for r in lumilist.keys()]
-        lumi_json = dict([(int(k),v) for (k,v) in full_lumi_json.items() if int(k) in runs])
+        lumi_json = index.lumis_per_run( runs )
         # This file json is only necessary for duplicate check in checkor. It's disabled.
-        #files_json = dict([(tuple(map(int,k.split(":"))),v) for (k,v) in files_per_lumi.items() if map(int,k.split(":")) in lumis])
+        files_json = index.files_per_lumi()
+    else:
+        lumi_json = index.lumis_per_run()
+        files_json = index.files_per_lumi()
 
     return lumi_json,files_json
 
@@ -2767,6 +3808,7 @@ def invalidateFiles( files ):
             print "could not set to invalidate", fn
             all_OK = False
 
+    forgetFilesContent( files )
     return all_OK
 
 def findParent( dataset ):
@@ -2787,6 +3829,7 @@ def setFileStatus(file_names, validate=True):
             ## then change the status
             print "Turning",fn['logical_file_name'],"to",validate
             dbswrite.updateFileStatus( logical_file_name= fn['logical_file_name'], is_file_valid = int(validate) )
+    forgetFilesContent( file_names )
 
 
 def setDatasetStatus(dataset, status, withFiles=True):
@@ -2892,19 +3935,100 @@ def getWorkflowByCampaign(url, campaign, details=False):
     else:
         return data
 
+class couchView(object):
+    """
+    Bulk queries of a CouchDB view, or of _all_docs : the keys are POSTed by chunks, the chunks run
+    in parallel over the pooled connections, and keys already being fetched by another thread are
+    waited for instead of being asked again. Use the shared instances from couch_view().
+    """
+    def __init__(self, url, path, include_docs=False, reduce=None, chunk_size=100, n_threads=4):
+        self.url = url
+        self.path = path
+        self.include_docs = include_docs
+        self.reduce = reduce
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.queries = 0
+
+    def _post(self, keys):
+        options = []
+        if self.include_docs: options.append('include_docs=true')
+        if self.reduce is not None: options.append('reduce=%s'%('true' if self.reduce else 'false'))
+        there = self.path + ('?'+'&'.join(options) if options else '')
+        conn = make_x509_conn(self.url)
+        r1=conn.request("POST", there, json.dumps({'keys' : keys}), headers={"Content-Type" : "application/json", "Accept" : "application/json"})
+        r2=conn.getresponse()
+        if r2.status != 200:
+            raise Exception("view query %s failed with %s : %s"%(there, r2.status, r2.read()))
+        rows = json.loads(r2.read())['rows']
+        with self.lock:
+            self.queries += 1
+        return rows
+
+    def fetch(self, keys):
+        """
+        {key : [rows]}, with the keys which are lists turned to tuples
+        """
+        keys = dict([(json.dumps(k), k) for k in keys])
+        mine = []
+        waiting = {}
+        with self.lock:
+            for jk in keys:
+                if jk in self.inflight:
+                    waiting[jk] = self.inflight[jk]
+                else:
+                    self.inflight[jk] = {'done' : threading.Event(), 'rows' : [], 'error' : None}
+                    mine.append( jk )
+        try:
+            chunks = [[keys[jk] for jk in mine[i:i+self.chunk_size]] for i in range(0, len(mine), self.chunk_size)]
+            if len(chunks) > 1:
+                pool = WorkerPool( n_threads = min(self.n_threads, len(chunks)), label = 'couchView')
+                results = [future.result() for future in pool.map( lambda chunk : runWithRetries(self._post, [chunk], {}, retries =3, wait=2), chunks)]
+                pool.shutdown()
+            else:
+                results = [runWithRetries(self._post, [chunk], {}, retries =3, wait=2) for chunk in chunks]
+            for rows in results:
+                for row in rows:
+                    jk = json.dumps(row.get('key'))
+                    if jk in self.inflight:
+                        self.inflight[jk]['rows'].append( row )
+        except Exception as e:
+            for jk in mine:
+                self.inflight[jk]['error'] = e
+            raise
+        finally:
+            with self.lock:
+                done = [(jk, self.inflight.pop(jk)) for jk in mine]
+            for jk, holder in done:
+                holder['done'].set()
+            done = dict(done)
+        for jk, holder in waiting.items():
+            holder['done'].wait()
+            if holder['error'] is not None:
+                raise holder['error']
+            done[jk] = holder
+        return dict([(tuple(k) if isinstance(k, list) else k, done[jk]['rows']) for jk, k in keys.items()])
+
+_couch_views = {}
+_couch_views_lock = threading.Lock()
+def couch_view(url, path, include_docs=False, reduce=None):
+    with _couch_views_lock:
+        key = (url, path, include_docs, reduce)
+        if not key in _couch_views:
+            _couch_views[key] = couchView(url, path, include_docs=include_docs, reduce=reduce)
+        return _couch_views[key]
+
+def getWorkflowsByOutput( url, datasets, details=False):
+    """
+    {dataset : [requests]} in one go
+    """
+    rows = couch_view(url, '/couchdb/reqmgr_workload_cache/_design/ReqMgr/_view/byoutputdataset', include_docs=details).fetch( datasets )
+    return dict([(dataset, [item['doc'] if details else item['id'] for item in items]) for dataset, items in rows.items()])
+
 def getWorkflowByOutput( url, dataset , details=False):
-    conn = make_x509_conn(url)
-    there = '/couchdb/reqmgr_workload_cache/_design/ReqMgr/_view/byoutputdataset?key="%s"'%(dataset)
-    if details:
-        there+='&include_docs=true'
-    r1=conn.request("GET",there)
-    r2=conn.getresponse()
-    data = json.loads(r2.read())
-    items = data['rows']
-    if details:
-        return [item['doc'] for item in items]
-    else:
-        return [item['id'] for item in items]
+    return getWorkflowsByOutput( url, [dataset], details=details)[dataset]
 
 def display_N( n ):
     if not str(n).isdigit(): return str(n)
@@ -2941,20 +4065,192 @@ def display_time( sec ):
 
     return dis
 
-def getWorkflowById( url, pid , details=False):
-    conn = make_x509_conn(url)
-    there = '/couchdb/reqmgr_workload_cache/_design/ReqMgr/_view/byprepid?key="%s"'%(pid)
-    if details:
-        there+='&include_docs=true'
-    r1=conn.request("GET",there)
-    r2=conn.getresponse()
-    data = json.loads(r2.read())
-    items = data['rows']
+class familyCache(object):
+    """
+    The requests sharing a PrepID (the original request, its clones and ACDCs), from the byprepid view
+    of reqmgr_workload_cache. Families are fetched in bulk with one view query for many keys,
+    kept for lifetime seconds, and dropped as soon as one of their members changes status.
+    """
+    def __init__(self, lifetime=10*60):
+        self.lifetime = lifetime
+        self.lock = threading.Lock()
+        self.families = {}
+        self.members = defaultdict(set)
+        self.queries = 0
+
+    def _fetch(self, url, prepids):
+        rows = couch_view(url, '/couchdb/reqmgr_workload_cache/_design/ReqMgr/_view/byprepid', include_docs=True).fetch( prepids )
+        self.queries += 1
+        return dict([(pid, [row['doc'] for row in items if row.get('doc')]) for pid, items in rows.items()])
+
+    def _relations(self, docs):
+        ## parent, children and ACDCs of each member
+        relations = dict([(d['RequestName'], {'parent' : d.get('OriginalRequestName'), 'children' : [], 'acdcs' : []}) for d in docs])
+        for d in docs:
+            parent = d.get('OriginalRequestName')
+            if parent in relations:
+                relations[parent]['acdcs' if d.get('RequestType') == 'Resubmission' else 'children'].append( d['RequestName'] )
+        return relations
+
+    def prefetch(self, url, prepids):
+        now = time.time()
+        with self.lock:
+            missing = sorted(set([pid for pid in prepids if pid and (not (url,pid) in self.families or (now - self.families[(url,pid)]['time']) > self.lifetime)]))
+        if missing:
+            ## chunked by the view client
+            docs = self._fetch(url, missing)
+            with self.lock:
+                for pid, family in docs.items():
+                    self.families[(url,pid)] = {'time' : now, 'docs' : family, 'relations' : self._relations( family )}
+                    for d in family:
+                        self.members[d['RequestName']].add( (url,pid) )
+
+    def prefetch_requests(self, url, statuses, names=None):
+        """
+        the families of all the requests in those statuses, or only of those names
+        """
+        prepids = set()
+        for status in ([statuses] if isinstance(statuses, basestring) else statuses):
+            for r in getWorkflows(url, status, details=True, fields=['RequestName','PrepID'], snapshot=True):
+                if names is None or r['RequestName'] in names:
+                    prepids.add( r.get('PrepID') )
+        self.prefetch(url, prepids)
+
+    def _family(self, url, prepid):
+        self.prefetch(url, [prepid])
+        with self.lock:
+            family = self.families.get((url,prepid))
+        if family is None:
+            ## an empty PrepID is not cached, and the family may have been invalidated meanwhile : queried for this call
+            docs = self._fetch(url, [prepid]).get(prepid, [])
+            family = {'docs' : docs, 'relations' : self._relations( docs )}
+        return family
+
+    def get(self, url, prepid):
+        ## copies : the callers modify the documents
+        return copy.deepcopy( self._family(url, prepid)['docs'] )
+
+    def relations(self, url, prepid):
+        return copy.deepcopy( self._family(url, prepid)['relations'] )
+
+    def invalidate(self, prepid=None, workflow=None):
+        with self.lock:
+            keys = set([k for k in self.families if k[1] == prepid])
+            if workflow:
+                keys.update( self.members.pop(workflow, set()) )
+            for key in keys:
+                for d in self.families.pop(key, {}).get('docs', []):
+                    self.members[d['RequestName']].discard( key )
+
+family_cache = familyCache()
+
+def getWorkflowById( url, pid , details=False, cached=True):
+    if cached:
+        family = family_cache.get(url, pid)
+        return family if details else [d['RequestName'] for d in family]
+    items = couch_view(url, '/couchdb/reqmgr_workload_cache/_design/ReqMgr/_view/byprepid', include_docs=details).fetch( [pid] )[pid]
     if details:
         return [item['doc'] for item in items]
     else:
         return [item['id'] for item in items]
 
+class datasetVersionIndex(object):
+    """
+    The processing versions in use for a (primary dataset, acquisition era, processing string),
+    per data tier : the highest one in DBS, and those of the outputs of the requests in ReqMgr.
+    A key is read with one DBS query wildcarding the version and tier, and one key range query
+    of the byoutputdataset view, then kept for lifetime seconds, so that the workflows of an assignor
+    cycle share it. The view is queried again once one of the requests which looked it up changes status.
+    """
+    def __init__(self, lifetime=10*60):
+        self.lifetime = lifetime
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.members = defaultdict(set)
+        self.queries = 0
+
+    def _dbs(self, dsn, era, ps):
+        highest = defaultdict(int)
+        for d in getDatasets( '/'.join(['',dsn,'-'.join([era,ps,'v*']),'*']) ):
+            (_,_,mid,tier) = d['dataset'].split('/')
+            highest[tier] = max(highest[tier], int(mid.split('-')[-1].replace('v','')))
+        return dict(highest)
+
+    def _reqmgr(self, url, dsn, era, ps):
+        ## {tier : {version : [requests]}}, for all versions at once
+        prefix = '/'.join(['',dsn,'-'.join([era,ps,'v'])])
+        there = '/couchdb/reqmgr_workload_cache/_design/ReqMgr/_view/byoutputdataset?startkey=%s&endkey=%s'%(
+            urllib.quote(json.dumps(prefix)), urllib.quote(json.dumps(prefix+u'\ufff0')))
+        conn = make_x509_conn(url)
+        r1=conn.request("GET", there, headers={"Accept" : "application/json"})
+        r2=conn.getresponse()
+        if r2.status != 200:
+            raise Exception("view query %s failed with %s : %s"%(there, r2.status, r2.read()))
+        used = defaultdict(lambda : defaultdict(list))
+        for row in json.loads(r2.read())['rows']:
+            (v,_,tier) = row['key'][len(prefix):].partition('/')
+            if v.isdigit() and tier and not '/' in tier:
+                used[tier][int(v)].append( row['id'] )
+        return used
+
+    def _used(self, url, dsn, era, ps):
+        ## a wildcard cannot be a key range of the view
+        return None if '*' in era+ps else runWithRetries(self._reqmgr, [url, dsn, era, ps], {}, retries =3, wait=5)
+
+    def entry(self, url, dsn, era, ps, workflow=None):
+        key = (url, dsn, era, ps)
+        now = time.time()
+        with self.lock:
+            e = self.entries.get(key)
+            if workflow:
+                self.members[workflow].add( key )
+        if e is None or (now - e['time']) > self.lifetime:
+            e = {'time' : now,
+                 'dbs' : self._dbs(dsn, era, ps),
+                 'reqmgr' : self._used(url, dsn, era, ps)}
+        elif not 'reqmgr' in e:
+            e = dict(e, reqmgr = self._used(url, dsn, era, ps))
+        else:
+            return e
+        with self.lock:
+            self.queries += 1
+            self.entries[key] = e
+        return e
+
+    def highest(self, url, dsn, era, ps, tier, workflow=None):
+        """
+        the highest version of the dataset in DBS, 0 if none
+        """
+        return self.entry(url, dsn, era, ps, workflow)['dbs'].get(tier, 0)
+
+    def next_free(self, url, dsn, era, ps, tier, version, workflow):
+        """
+        the lowest version from version on, such that version+1 is not an output of a request other than workflow
+        """
+        used = self.entry(url, dsn, era, ps, workflow)['reqmgr']
+        while True:
+            predicted = '/'.join(['',dsn,'-'.join([era,ps,'v%d'%(version+1)]),tier])
+            if used is None:
+                conflicts = getWorkflowByOutput( url, predicted )
+            else:
+                conflicts = used.get(tier, {}).get(version+1, [])
+            conflicts = filter(lambda wfn : wfn!=workflow, conflicts)
+            if len(conflicts):
+                print "There is an output conflict for",workflow,"with",conflicts,"on",predicted
+                ## since we are not planned for pure extension and ever writing in the same dataset, go +1
+                version += 1
+            else:
+                return version
+
+    def forget(self, workflow):
+        with self.lock:
+            for key in self.members.pop(workflow, set()):
+                if key in self.entries:
+                    ## the versions in DBS do not change with the status of the request, those in ReqMgr do
+                    self.entries[key] = dict([(k,v) for (k,v) in self.entries[key].items() if k != 'reqmgr'])
+
+dataset_versions = datasetVersionIndex()
+
 def invalidate(url, wfi, only_resub=False, with_output=True):
     tries = 3
     while tries:
@@ -3640,12 +4936,19 @@ def _getWorkflowsByName(url, names, details=False):
     print "%d retrieved for %d workflow names with details: %s" % (len(workflows), len(names), details)
     return workflows
 
-def getWorkflows(url,status,user=None,details=False,rtype=None, priority=None):
+def getWorkflows(url,status,user=None,details=False,rtype=None, priority=None, snapshot=False, fields=None):
+    """
+    fields : with details, the request documents only carry those keys
+    snapshot : served from the shared reqmgrSnapshot, up to its max_age old, for the modules which only read the listing
+    """
+    if snapshot and url == reqmgr_url and not (user or rtype or priority!=None):
+        ## served from the shared snapshot, only the changed requests are fetched in detail
+        return reqmgrSnapshot(url).get(status, details=details, fields=fields)
     return runWithRetries(try_getWorkflows, [url, status],
-                          {'user': user, 'details': details, 'rtype': rtype, 'priority': priority},
+                          {'user': user, 'details': details, 'rtype': rtype, 'priority': priority, 'fields': fields},
                           retries =5, wait=5)
 
-def try_getWorkflows(url,status,user=None,details=False,rtype=None, priority=None):
+def try_getWorkflows(url,status,user=None,details=False,rtype=None, priority=None, fields=None):
     conn = make_x509_conn(url)
     go_to = '/reqmgr2/data/request?status=%s'%status
     if rtype:
@@ -3658,8 +4961,16 @@ def try_getWorkflows(url,status,user=None,details=False,rtype=None, priority=Non
         go_to+='&initialpriority=%d'%priority ### does not work...
 
     go_to+='&detail=%s'%('true' if details else 'false')
+    if details and fields:
+        ## projection done by reqmgr2, and the response is streamed
+        for field in set(['RequestName']+list(fields)):
+            go_to+='&mask=%s'%field
     r1=conn.request("GET",go_to, headers={"Accept":"application/json"})
     r2=conn.getresponse()
+    if details and fields:
+        workflows = [doc for (name, doc) in jsonResultStream(r2, fields)]
+        print len(workflows),"retrieved",status,user,details,rtype,"with",','.join(fields)
+        return workflows
     data = json.loads(r2.read())
     items = data['result']
 
@@ -3678,6 +4989,209 @@ def try_getWorkflows(url,status,user=None,details=False,rtype=None, priority=Non
             workflows.extend(those)
     return workflows
 
+class RequestIndex(object):
+    """
+    Hash indexes over the detailed request documents of ReqMgr, to be built once per cycle
+    in place of scanning the getWorkflows list for every single workflow.
+    Requests are indexed by name, status, prepid, campaign and output dataset,
+    and iterate from the highest to the lowest RequestPriority.
+    """
+    def __init__(self, requests=None):
+        self.by_name = {}
+        self.by_status = defaultdict(set)
+        self.by_prepid = defaultdict(set)
+        self.by_campaign = defaultdict(set)
+        self.by_output = defaultdict(set)
+        self.order = []
+        self._ranks = None
+        self._ordered_names = []
+        self.add( requests or [] )
+
+    @classmethod
+    def from_reqmgr(cls, url, statuses, fields=None, snapshot=False):
+        if isinstance(statuses, basestring):
+            statuses = [statuses]
+        index = cls()
+        for status in statuses:
+            index.add( getWorkflows(url, status, details=True, fields=fields, snapshot=snapshot) )
+        return index
+
+    def _keys(self, request):
+        campaigns = set([request.get('Campaign')])
+        if 'Chain' in request.get('RequestType',''):
+            base = request['RequestType'].replace('Chain','')
+            itask = 1
+            while '%s%d'%(base, itask) in request:
+                campaigns.add( request['%s%d'%(base, itask)].get('Campaign') )
+                itask += 1
+        return [(self.by_status, [request.get('RequestStatus')]),
+                (self.by_prepid, getPrepIDs(request) if 'RequestType' in request else [request.get('PrepID')]),
+                (self.by_campaign, campaigns),
+                (self.by_output, request.get('OutputDatasets',[]))]
+
+    def add(self, requests):
+        for request in requests:
+            name = request['RequestName']
+            if name in self.by_name:
+                self.remove( name )
+            else:
+                self.order.append( name )
+            self.by_name[name] = request
+            for index, keys in self._keys( request ):
+                for key in keys:
+                    if key: index[key].add( name )
+        self._ranks = None
+
+    def remove(self, name):
+        request = self.by_name.pop(name, None)
+        if request is None: return
+        for index, keys in self._keys( request ):
+            for key in keys:
+                index[key].discard( name )
+                if key in index and not index[key]: index.pop( key )
+        self._ranks = None
+
+    def get(self, name, default=None):
+        return self.by_name.get(name, default)
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def _ordered(self):
+        ## increasing priority, ties kept in the order ReqMgr returned them
+        if self._ranks is None:
+            self.order = [name for name in self.order if name in self.by_name]
+            ordered = sorted(self.order, key = lambda name : self.by_name[name]['RequestPriority'])
+            self._ranks = dict([(name, i) for (i, name) in enumerate(ordered)])
+            self._ordered_names = ordered
+        return self._ordered_names
+
+    def __iter__(self):
+        for name in reversed(self._ordered()):
+            yield self.by_name[name]
+
+    def rank(self, name):
+        """
+        position in increasing priority, 0 for an unknown request, as a sort key
+        """
+        self._ordered()
+        return self._ranks.get(name, 0)
+
+    def _select(self, names):
+        self._ordered()
+        return [self.by_name[name] for name in sorted(names, key = lambda name : self._ranks[name], reverse=True)]
+
+    def with_status(self, status):
+        return self._select( self.by_status.get(status, []) )
+
+    def with_prepid(self, prepid):
+        return self._select( self.by_prepid.get(prepid, []) )
+
+    def with_campaign(self, campaign):
+        return self._select( self.by_campaign.get(campaign, []) )
+
+    def producing(self, dataset):
+        return self._select( self.by_output.get(dataset, []) )
+
+def request_stamp(request):
+    ## changes with the status transitions and the priority of the request
+    transitions = request.get('RequestTransition') or [{}]
+    return '%s:%s:%s'%(len(transitions), transitions[-1].get('UpdateTime'), request.get('RequestPriority'))
+
+class reqmgrSnapshot:
+    """
+    The detailed ReqMgr2 requests, persisted compressed in mongo and shared by all modules and hosts.
+    A refresh of a status lists its requests with only RequestStatus, RequestPriority and RequestTransition,
+    and fetches in detail only the requests that are new, changed transition or priority, or are older than full_refresh hours.
+    A status is not listed again within max_age seconds of its last refresh.
+    """
+    def __init__(self, url=reqmgr_url, max_age=60, full_refresh=6, chunk_size=50):
+        self.url = url
+        self.max_age = max_age
+        self.full_refresh = full_refresh
+        self.chunk_size = chunk_size
+        self.client = mongo_client()
+        self.db = self.client.unified.reqmgrSnapshot
+        self.statuses = self.client.unified.reqmgrSnapshotStatus
+        self.fetched = 0
+
+    def _stamp(self, request):
+        return request_stamp( request )
+
+    def _pack(self, request):
+        return base64.b64encode( zlib.compress( json.dumps( request )))
+
+    def _unpack(self, payload):
+        return json.loads( zlib.decompress( base64.b64decode( payload )))
+
+    def _light(self, status):
+        conn = make_x509_conn(self.url)
+        go_to = '/reqmgr2/data/request?status=%s&mask=RequestStatus&mask=RequestPriority&mask=RequestTransition'%status
+        conn.request("GET",go_to, headers={"Accept":"application/json"})
+        r2=conn.getresponse()
+        items = json.loads(r2.read())['result']
+        light = {}
+        for item in items:
+            light.update( item )
+        return light
+
+    def refresh(self, status, force=False):
+        now = time.mktime(time.gmtime())
+        last = self.statuses.find_one({'status' : status})
+        if not force and last and (now - last['refreshed']) < self.max_age:
+            return
+        light = runWithRetries(self._light, [status], {}, retries =5, wait=5)
+        stored = dict([(o['name'], o) for o in self.db.find({'$or' : [{'status' : status}, {'name' : {'$in' : light.keys()}}]},
+                                                            {'name' : 1, 'stamp' : 1, 'time' : 1})])
+        changed = []
+        for name, request in light.items():
+            o = stored.get(name)
+            if not o or o['stamp'] != self._stamp( request ) or (now - o['time']) > self.full_refresh*60*60:
+                changed.append( name )
+        for i in range(0, len(changed), self.chunk_size):
+            for request in getWorkflowsByName(self.url, changed[i:i+self.chunk_size], details=True):
+                self.db.update_one({'name' : request['RequestName']},
+                                   {'$set' : {'name' : request['RequestName'],
+                                              'status' : request['RequestStatus'],
+                                              'stamp' : self._stamp( request ),
+                                              'time' : int(now),
+                                              'data' : self._pack( request )}},
+                                   upsert = True)
+                self.fetched += 1
+        ## those moved out of the status, and will be fetched again in their new one if needed
+        gone = [name for name, o in stored.items() if not name in light]
+        if gone:
+            self.db.delete_many({'name' : {'$in' : gone}, 'status' : status})
+        self.statuses.update_one({'status' : status},
+                                 {'$set' : {'status' : status, 'refreshed' : int(now), 'count' : len(light)}},
+                                 upsert = True)
+        print len(light),status,"in the snapshot,",len(changed),"fetched in detail,",len(gone),"removed"
+
+    def forget(self, workflow, status=None):
+        """
+        the request was changed from here : it is fetched again, and its statuses listed again, at the next get
+        """
+        statuses = set([o['status'] for o in self.db.find({'name' : workflow}, {'status' : 1})])
+        if status: statuses.add( status )
+        self.db.delete_many({'name' : workflow})
+        if statuses:
+            self.statuses.delete_many({'status' : {'$in' : list(statuses)}})
+
+    def get(self, status, details=True, fields=None):
+        self.refresh( status )
+        if not details:
+            return [o['name'] for o in self.db.find({'status' : status}, {'name' : 1})]
+        requests = (self._unpack( o['data'] ) for o in self.db.find({'status' : status}, {'data' : 1}))
+        if fields:
+            return [dict([(k, r[k]) for k in fields if k in r]) for r in requests]
+        return list(requests)
+
 def getPrepIDs(wl):
     pids = list()
     if 'Chain' in wl['RequestType']:
@@ -3798,53 +5312,197 @@ class wtcInfo:
                 print item,"goes away"
                 self.db.delete_one({'_id' : item.get('_id',None)})
 
-class workflowInfo:
+def _section_dict(section):
+    ## the json content of a WMCore ConfigSection, marked as complete
+    if hasattr(section, 'dictionary_'):
+        content = dict([(k, _section_dict(v)) for (k, v) in section.dictionary_().items()])
+        content['_complete'] = True
+        return content
+    if isinstance(section, (list, tuple, set)):
+        return [_section_dict(v) for v in section]
+    if isinstance(section, dict):
+        return dict([(k, _section_dict(v)) for (k, v) in section.items()])
+    if section is None or isinstance(section, (basestring, int, long, float, bool)):
+        return section
+    return str(section)
+
+def _spec_task_node(task):
+    node = {'_internal_name' : task._internal_name,
+            'pathName' : task.pathName,
+            'taskType' : task.taskType}
+    if hasattr(task, 'prepID'):
+        node['prepID'] = task.prepID
+    node['input'] = {'splitting' : _section_dict( task.input.splitting )}
+    if hasattr(task.input, 'dataset'):
+        node['input']['dataset'] = _section_dict( task.input.dataset )
+    node['subscriptions'] = _section_dict( task.subscriptions )
+    cmsrun = getattr(getattr(task, 'steps', None), 'cmsRun1', None)
+    if cmsrun is not None:
+        node['steps'] = {'cmsRun1' : {}}
+        config = getattr(getattr(cmsrun, 'application', None), 'configuration', None)
+        if hasattr(config, 'configId'):
+            node['steps']['cmsRun1']['application'] = {'configuration' : {'configId' : config.configId}}
+        if hasattr(cmsrun, 'pileup'):
+            node['steps']['cmsRun1']['pileup'] = _section_dict( cmsrun.pileup )
+    node['tree'] = {'childNames' : list(task.tree.childNames),
+                    'children' : dict([(child, _spec_task_node( getattr(task.tree.children, child) )) for child in task.tree.childNames])}
+    return node
+
+def specTaskGraph(spec):
+    """
+    the compact json task graph of a workload spec : the names, types, splitting, output modules,
+    input dataset, config id and pileup of all the tasks, in the same layout as in the spec
+    """
+    tasklist = list(spec.tasks.tasklist)
+    return {'tasklist' : tasklist,
+            'tasks' : dict([(name, _spec_task_node( getattr(spec.tasks, name) )) for name in tasklist])}
+
+class taskSection(object):
+    """
+    Attribute access to a node of the task graph, as to the ConfigSection of the spec.
+    What is not in the graph is taken from the spec through fallback(), loading the full spec only then.
+    """
+    def __init__(self, content, fallback=None):
+        self._content = content
+        self._fallback = None if content.get('_complete') else fallback
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        content = self._content
+        if name in content:
+            value = content[name]
+            if isinstance(value, dict):
+                fallback = self._fallback
+                return taskSection(value, (lambda : getattr(fallback(), name)) if fallback else None)
+            return value
+        if self._fallback:
+            return getattr(self._fallback(), name)
+        raise AttributeError(name)
+
+    def dictionary_(self):
+        return dict([(k, v) for (k, v) in self._content.items() if k != '_complete'])
+
+class workflowInfo(object):
+    """
+    The request, spec, wmstats and job details of a workflow are fetched when first used, once even if
+    several threads ask at the same time, and each thread talks to cmsweb over its own connection.
+    A request given at construction is shared with the caller until it gets modified through own_request().
+    """
+    __slots__ = ['logs', 'url', 'name', '_lock', '_conn', '_request', '_request_owned', 'full_spec', 'task_graph', '_spec_rev',
+                 '_wmstats', '_errors', 'recovery_doc', 'workqueue', 'summary', '_UC', '__weakref__']
+
     def __init__(self, url, workflow, spec=True, request=None,stats=False, wq=False, errors=False):
         self.logs = defaultdict(str)
         self.url = url
-        self.conn = make_x509_conn(self.url)
-        if request == None:
-            try:
-                r1=self.conn.request("GET",'/reqmgr2/data/request/'+workflow, headers={"Accept":"*/*"})
-                r2=self.conn.getresponse()
-                ret = json.loads(r2.read())
-                ret = ret['result'][0][workflow] ##new
-                self.request = ret
-            except Exception as e:
-                print "failed to get workload"
-                print str(e)
-                try:
-                    r1=self.conn.request("GET",'/couchdb/reqmgr_workload_cache/'+workflow)
-                    r2=self.conn.getresponse()
-                    ret = json.loads(r2.read())
-                    self.request = ret
-                except Exception as e:
-                    print "Failed to get workload cache for",workflow
-                    print str(e)
-                    raise Exception("Failed to get workload cache for %s"%workflow)
-        else:
-            self.request = copy.deepcopy( request )
+        self.name = workflow
+        self._lock = threading.RLock()
+        self._conn = threading.local()
+        self._request = request
+        self._request_owned = False
         self.full_spec=None
-        if spec:
-            self.get_spec()
-
-        self.wmstats = None
+        self.task_graph=None
+        self._spec_rev = False
+        self._wmstats = None
+        self._errors = None
+        self.recovery_doc = None
+        self.workqueue = None
+        self.summary = None
+        self._UC = None
+        ## the request and the spec are loaded when first used
         if stats:
             self.getWMStats()
-
-        self.errors = None
         if errors:
             self.getWMErrors()
-
-        self.recovery_doc = None
-
-        self.workqueue = None
         if wq:
             self.getWorkQueue()
 
-        self.summary = None
-
-        self.UC = unifiedConfiguration()
+    def _get_request(self):
+        workflow = self.name
+        try:
+            r1=self.conn.request("GET",'/reqmgr2/data/request/'+workflow, headers={"Accept":"*/*"})
+            r2=self.conn.getresponse()
+            ret = json.loads(r2.read())
+            return ret['result'][0][workflow] ##new
+        except Exception as e:
+            print "failed to get workload"
+            print str(e)
+            try:
+                self.conn = make_x509_conn(self.url)
+                r1=self.conn.request("GET",'/couchdb/reqmgr_workload_cache/'+workflow)
+                r2=self.conn.getresponse()
+                return json.loads(r2.read())
+            except Exception as e:
+                print "Failed to get workload cache for",workflow
+                print str(e)
+                raise Exception("Failed to get workload cache for %s"%workflow)
+
+    @property
+    def request(self):
+        if self._request is None:
+            with self._lock:
+                if self._request is None:
+                    self._request_owned = True
+                    self._request = self._get_request()
+        return self._request
+
+    @request.setter
+    def request(self, request):
+        with self._lock:
+            self._request = request
+            self._request_owned = True
+
+    def own_request(self):
+        """
+        the request, to be modified : copied first if it is shared with the caller
+        """
+        with self._lock:
+            if not self._request_owned:
+                self._request = copy.deepcopy( self.request )
+                self._request_owned = True
+            return self._request
+
+    @property
+    def conn(self):
+        ## one connection per thread : the instance is shared through the registry
+        conn = getattr(self._conn, 'conn', None)
+        if conn is None:
+            conn = self._conn.conn = make_x509_conn(self.url)
+        return conn
+
+    @conn.setter
+    def conn(self, conn):
+        self._conn.conn = conn
+
+    @property
+    def wmstats(self):
+        if self._wmstats is None:
+            with self._lock:
+                if self._wmstats is None:
+                    self.getWMStats()
+        return self._wmstats
+
+    @wmstats.setter
+    def wmstats(self, wmstats):
+        self._wmstats = wmstats
+
+    @property
+    def errors(self):
+        if self._errors is None:
+            with self._lock:
+                if self._errors is None:
+                    self.getWMErrors()
+        return self._errors
+
+    @errors.setter
+    def errors(self, errors):
+        self._errors = errors
+
+    @property
+    def UC(self):
+        if self._UC is None:
+            self._UC = unifiedConfiguration()
+        return self._UC
 
     def getFamilly(self, details=True, only_resub=False, and_self=False):
         familly = getWorkflowById( self.url, self.request['PrepID'] ,details=True)
@@ -4044,26 +5702,74 @@ class workflowInfo:
                 print "cannot get spec for",self.request['RequestName']
                 return None
 
+    def _revision(self):
+        ## the couch revision of the workload document the spec is attached to, None when it cannot be read
+        if self._spec_rev is False:
+            self._spec_rev = None
+            try:
+                conn = make_x509_conn(self.url)
+                conn.request("HEAD",'/couchdb/reqmgr_workload_cache/%s'%self.request['RequestName'])
+                r2 = conn.getresponse()
+                r2.read()
+                etag = r2.getheader('ETag')
+                if r2.status == 200 and etag:
+                    self._spec_rev = etag.strip('"')
+            except Exception as e:
+                print "cannot get the revision of the spec for",self.name
+                print str(e)
+        return self._spec_rev
+
     def _get_spec(self):
-        if not self.full_spec:
-            self.conn = make_x509_conn(self.url)
-            r1=self.conn.request("GET",'/couchdb/reqmgr_workload_cache/%s/spec'%self.request['RequestName'])
-            r2=self.conn.getresponse()
-            self.full_spec = pickle.loads(r2.read())
+        if self.full_spec:
+            return self.full_spec
+        with self._lock:
+            if self.full_spec:
+                return self.full_spec
+            name = self.request['RequestName']
+            revision = self._revision()
+            blob = artifact_cache.get('spec', name, revision) if revision else None
+            if blob is None:
+                self.conn = make_x509_conn(self.url)
+                r1=self.conn.request("GET",'/couchdb/reqmgr_workload_cache/%s/spec'%name)
+                r2=self.conn.getresponse()
+                blob = r2.read()
+                self.full_spec = pickle.loads(blob)
+                if revision:
+                    artifact_cache.put('spec', name, blob, revision)
+            else:
+                self.full_spec = pickle.loads(blob)
         return self.full_spec
 
+    def getTaskGraph(self):
+        """
+        the task graph of the spec, extracted once per couch revision of the workload document
+        """
+        if self.task_graph:
+            return self.task_graph
+        with self._lock:
+            if self.task_graph:
+                return self.task_graph
+            name = self.request['RequestName']
+            revision = self._revision()
+            graph = artifact_cache.get_json('taskgraph', name, revision) if revision else None
+            if graph is None:
+                spec = self.get_spec()
+                if spec is None:
+                    return None
+                graph = specTaskGraph( spec )
+                if revision:
+                    artifact_cache.put_json('taskgraph', name, graph, revision)
+            self.task_graph = graph
+        return self.task_graph
+
     def getWMErrors(self,cache=0):
         try:
-            f_cache = '%s/%s.wmerror'%(cache_dir, self.request['RequestName'])
             if cache:
-                if os.path.isfile(f_cache):
-                    d_cache = json.loads(open(f_cache).read())
-                    now = time.mktime(time.gmtime())
-                    stamp = d_cache['timestamp']
-                    if (now-stamp) < cache:
-                        print "wmerrors taken from cache",f_cache
-                        self.errors = d_cache['data']
-                        return self.errors
+                cached = artifact_cache.get_json('wmerror', self.request['RequestName'], max_age=cache)
+                if cached is not None:
+                    print "wmerrors taken from cache"
+                    self.errors = cached
+                    return self.errors
 
             self.conn = make_x509_conn(self.url)
             r1=self.conn.request("GET",'/wmstatsserver/data/jobdetail/%s'%(self.request['RequestName']), headers={"Accept":"*/*"})
@@ -4071,8 +5777,7 @@ class workflowInfo:
 
             self.errors = json.loads(r2.read())['result'][0][self.request['RequestName']]
             try:
-                open(f_cache,'w').write( json.dumps({'timestamp': time.mktime(time.gmtime()),
-                                                     'data' : self.errors}))
+                artifact_cache.put_json('wmerror', self.request['RequestName'], self.errors)
             except Exception as e:
                 print "failed getting getWMErrors"
                 print str(e)
@@ -4098,22 +5803,17 @@ class workflowInfo:
         return {}
 
     def _getWMStats(self ,cache=0):
-        f_cache = '%s/%s.wmstats'%(cache_dir, self.request['RequestName'])
         if cache:
-            if os.path.isfile(f_cache):
-                d_cache = json.loads(open(f_cache).read())
-                now = time.mktime(time.gmtime())
-                stamp = d_cache['timestamp']
-                if (now-stamp) < cache:
-                    print "wmstats taken from cache",f_cache
-                    self.wmstats = d_cache['data']
-                    return self.wmstats
+            cached = artifact_cache.get_json('wmstats', self.request['RequestName'], max_age=cache)
+            if cached is not None:
+                print "wmstats taken from cache"
+                self.wmstats = cached
+                return self.wmstats
         r1=self.conn.request("GET",'/wmstatsserver/data/request/%s'%self.request['RequestName'], headers={"Accept":"application/json"})
         r2=self.conn.getresponse()
         self.wmstats = json.loads(r2.read())['result'][0][self.request['RequestName']]
         try:
-            open(f_cache,'w').write( json.dumps({'timestamp': time.mktime(time.gmtime()),
-                                                 'data' : self.wmstats}) )
+            artifact_cache.put_json('wmstats', self.request['RequestName'], self.wmstats)
         except Exception as e:
             print "failed getWMStats"
             print str(e)
@@ -4132,35 +5832,24 @@ class workflowInfo:
                 files_and_loc[ fn ].update( d['files'][fn]['locations'] )
 
         print len(all_files),"file in recovery"
-        dbsapi = DbsApi(url=dbs_url)
         all_blocks = set()
         all_blocks_loc = defaultdict(set)
         files_no_block = set()
         files_in_block = set()
-        datasets = set()
-        cache = cacheInfo()
-        file_block_cache = defaultdict( str )
+        in_dbs = [f for f in all_files if not f.startswith('/store/unmerged/') and not f.startswith('MCFakeFile-')]
+        file_block_cache = getFilesBlock( in_dbs )
         for f in all_files:
             if not f.startswith('/store/unmerged/') and not f.startswith('MCFakeFile-'):
-                if f in file_block_cache:
-                    file_block = file_block_cache[ f ]
-                else:
-                    file_block = getFileBlock( f ) 
-                    if file_block:
-                        for _f in getDatasetFileArray( file_block.split('#')[0], detail=True, cache_timeout=12*60*60 ):
-                            file_block_cache[ _f['logical_file_name' ] ] = _f['block_name']
-                    
+                file_block = file_block_cache.get( f )
                 files_in_block.add( f )
                 all_blocks.add( file_block )
                 all_blocks_loc[file_block].update( files_and_loc.get( f, []) )
             else:
                 files_no_block.add( f )
 
-        file_block_doc = defaultdict( lambda : defaultdict( set ))
         dataset_blocks = set()
-        for _f,_b in file_block_cache.iteritems():
-            file_block_doc[ _b.split('#')[0]][_b].add( _f )
-            dataset_blocks.add( _b )
+        for dataset in set([_b.split('#')[0] for _b in file_block_cache.values()]):
+            dataset_blocks.update( getDatasetBlocks( dataset ) )
 
         ## skim out the files
         files_and_loc_noblock = dict([(k,list(v)) for (k,v) in files_and_loc.items() if k in files_no_block])
@@ -4182,9 +5871,7 @@ class workflowInfo:
             return self.recovery_doc
         try:
             print "using",collection_name
-            r1=self.conn.request("GET",'/couchdb/acdcserver/_design/ACDC/_view/byCollectionName?key="%s"&include_docs=true&reduce=false'% collection_name)
-            r2=self.conn.getresponse()
-            rows = json.loads(r2.read())['rows']
+            rows = couch_view(self.url, '/couchdb/acdcserver/_design/ACDC/_view/byCollectionName', include_docs=True, reduce=False).fetch( [collection_name] )[collection_name]
             self.recovery_doc = [r['doc'] for r in rows]
         except Exception as e:
             self.conn = make_x509_conn(self.url)
@@ -4341,7 +6028,11 @@ class workflowInfo:
             return None
 
     def _tasks(self):
-        return self.get_spec().tasks.tasklist
+        return self.getTaskGraph()['tasklist']
+
+    def _taskNode(self, task):
+        return taskSection(self.getTaskGraph()['tasks'][task],
+                           lambda : getattr(self.get_spec().tasks, task))
 
     def firstTask(self):
         return self._tasks()[0]
@@ -4880,7 +6571,7 @@ class workflowInfo:
     def getAllTasks(self, select=None):
         all_tasks = []
         for task in self._tasks():
-            ts = getattr(self.get_spec().tasks, task)
+            ts = self._taskNode( task )
             all_tasks.extend( self._taskDescending( ts, select ) )
         return all_tasks
 
@@ -5216,11 +6907,13 @@ class workflowInfo:
 
     def getNextVersion( self ):
         ## returns 1 if nothing is in the way
+        ## the versions in DBS and in ReqMgr come from dataset_versions, shared by the workflows of the cycle
         if 'ProcessingVersion' in self.request:
             version = max(0,int(self.request['ProcessingVersion'])-1)
         else:
             version = 0
         outputs = self.request['OutputDatasets']
+        name = self.request['RequestName']
         era = self.acquisitionEra()
         ps = self.processingString()
         if self.request['RequestType'] == 'TaskChain':
@@ -5233,13 +6926,7 @@ class workflowInfo:
                 else:
                     aera='*'
                     aps='*'
-                pattern = '/'.join(['',dsn,'-'.join([aera,aps,'v*']),tier])
-                wilds = getDatasets( pattern )
-                print pattern,"->",len(wilds),"match(es)"
-                for wild in [wildd['dataset'] for wildd in wilds]:
-                    (_,_,mid,_) = wild.split('/')
-                    v = int(mid.split('-')[-1].replace('v',''))
-                    version = max(v,version)
+                version = max(version, dataset_versions.highest(self.url, dsn, aera, aps, tier, name))
             for output in outputs:
                 (_,dsn,ps,tier) = output.split('/')
                 if ps.count('-')==2:
@@ -5250,17 +6937,7 @@ class workflowInfo:
                     print "Cannot check output in reqmgr"
                     print output,"is what is in the request workload"
                     continue
-                while True:
-                    predicted = '/'.join(['',dsn,'-'.join([aera,aps,'v%d'%(version+1)]),tier])
-                    print "checking against",predicted
-                    conflicts = getWorkflowByOutput( self.url, predicted )
-                    conflicts = filter(lambda wfn : wfn!=self.request['RequestName'], conflicts)
-                    if len(conflicts):
-                        print "There is an output conflict for",self.request['RequestName'],"with",conflicts
-                        ## since we are not planned for pure extension and ever writing in the same dataset, go +1
-                        version += 1
-                    else:
-                        break
+                version = dataset_versions.next_free(self.url, dsn, aera, aps, tier, version, name)
 
         else:
             for output in  outputs:
@@ -5281,17 +6958,9 @@ class workflowInfo:
                 if aps == 'None':
                     print "no process string, using wild char"
                     aps='*'
-                pattern = '/'.join(['',dsn,'-'.join([aera,aps,'v*']),tier])
-                print "looking for",pattern
-                wilds = getDatasets( pattern )
-                print pattern,"->",len(wilds),"match(es)"
-                for wild in [wildd['dataset'] for wildd in wilds]:
-                    (_,_,mid,_) = wild.split('/')
-                    v = int(mid.split('-')[-1].replace('v',''))
-                    version = max(v,version)
+                version = max(version, dataset_versions.highest(self.url, dsn, aera, aps, tier, name))
             #print "version found so far",version
             for output in  outputs:
-                print output
                 (_,dsn,ps,tier) = output.split('/')
                 if ps.count("-") == 2:
                     (aera,aps,_) = ps.split('-')
@@ -5307,20 +6976,57 @@ class workflowInfo:
                 if aps == 'None':
                     print "no process string, cannot parse"
                     continue
-                while True:
-                    predicted = '/'.join(['',dsn,'-'.join([aera,aps,'v%d'%(version+1)]),tier])
-                    conflicts = getWorkflowByOutput( self.url, predicted )
-                    conflicts = filter(lambda wfn : wfn!=self.request['RequestName'], conflicts)
-                    if len(conflicts):
-                        print "There is an output conflict for",self.request['RequestName'],"with",conflicts
-                        #return None
-                        ## since we are not planned for pure extension and ever writing in the same dataset, go +1
-                        version += 1
-                    else:
-                        break
+                version = dataset_versions.next_free(self.url, dsn, aera, aps, tier, version, name)
 
         return version+1
 
+class workflowRegistry(object):
+    """
+    Process-wide workflowInfo instances, shared by all the threads and steps of a module cycle
+    instead of being built again for the same workflow.
+    A request document with another status transition or priority than the one held replaces the instance,
+    as does an instance older than max_age [s], or a request modified through reqMgrClient.
+    """
+    def __init__(self, max_age=1800):
+        self.lock = threading.Lock()
+        self.instances = {}
+        self.built_at = {}
+        self.max_age = max_age
+        self.built = 0
+
+    def get(self, url, workflow, request=None, stats=False, errors=False, wq=False):
+        with self.lock:
+            wfi = self.instances.get((url, workflow))
+            if wfi is not None and request is not None and wfi._request is not None and request_stamp(request) != request_stamp(wfi._request):
+                wfi = None
+            if wfi is not None and time.time() - self.built_at[(url, workflow)] > self.max_age:
+                wfi = None
+            if wfi is None:
+                wfi = workflowInfo(url, workflow, request=request)
+                self.instances[(url, workflow)] = wfi
+                self.built_at[(url, workflow)] = time.time()
+                self.built += 1
+        if stats: wfi.wmstats
+        if errors: wfi.errors
+        if wq: wfi.getWorkQueue()
+        return wfi
+
+    def forget(self, workflow):
+        with self.lock:
+            for key in [k for k in self.instances if k[1] == workflow]:
+                self.instances.pop( key )
+                self.built_at.pop( key )
+
+    def clear(self):
+        with self.lock:
+            self.instances.clear()
+            self.built_at.clear()
+
+    def __len__(self):
+        return len(self.instances)
+
+workflow_registry = workflowRegistry()
+
 def getFailedJobs(taskname, caller='getFailedJobs'):
     wfname=taskname.split('/')[1]
     print 'wfname=',wfname